@@ -1,3 +1,4 @@
+import cv2
 from PIL import Image
 
 
@@ -14,3 +15,18 @@ def convert_to_monochrome(image_path):
     image = Image.open(image_path)
     monochrome_image = image.convert("L")
     return monochrome_image
+
+
+def convert_array_to_monochrome(image):
+    '''
+    Convert an already decoded OpenCV image to monochrome (grayscale), the same as convert_to_monochrome does for a file.
+    The conversion is left to PIL, since OpenCV rounds the luma differently and the pixels (and so the detection cache
+    and recording keys) would not match those of convert_to_monochrome
+
+    Parameters:
+    image (numpy.ndarray): The HxWx3 BGR image.
+
+    Returns:
+    Image: A monochrome version of the image.
+    '''
+    return Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)).convert("L")
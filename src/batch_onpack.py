@@ -0,0 +1,286 @@
+import csv
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import torch
+
+import directories
+import onpack
+from inpaint import Inpainter
+from inpaint_lama import LamaInpainter
+from inpaint_pool import InpaintWorkerPool, PooledInpainter
+from thread_budget import resolve_num_threads
+
+log = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+def collect_images(source: str) -> list[str]:
+    """
+    List the pack images of a directory (not recursive), or those matching a glob pattern, sorted by path.
+
+    Raises:
+    ValueError: If two images have the same name, since the outputs are named after the image.
+    """
+    if os.path.isdir(source):
+        paths = [os.path.join(source, name) for name in os.listdir(source)]
+    else:
+        paths = glob.glob(source, recursive=True)
+    paths = sorted(os.path.abspath(path) for path in paths if path.lower().endswith(IMAGE_EXTENSIONS))
+    stems = {}
+    for path in paths:
+        stem = Path(path).stem
+        if stem in stems:
+            raise ValueError(f"{path} and {stems[stem]} would write the same output file")
+        stems[stem] = path
+    return paths
+
+
+def load_texts(texts_path: str) -> dict[str, str]:
+    """
+    Load the per image bottom texts: a JSON object, or a CSV file with "file" and "text" columns, mapping an image's
+    file name (or its name without extension) to its text.
+    """
+    if texts_path.lower().endswith(".csv"):
+        with open(texts_path, newline="") as f:
+            return {row["file"]: row["text"] for row in csv.DictReader(f)}
+    with open(texts_path) as f:
+        return json.load(f)
+
+
+def get_text(image_path: str, texts: dict[str, str], default_text: str) -> str:
+    for key in (os.path.basename(image_path), Path(image_path).stem):
+        if key in texts:
+            return texts[key]
+    return default_text
+
+
+class BatchManifest:
+    def __init__(self, path: str):
+        """
+        The state of a batch run, one entry per image with its status ("running", "done" or "failed"), text, timings,
+        output paths and the run information of `onpack.generate_onpack`.
+
+        The file is a JSON lines log: every change appends one line with the image and the changed fields, so the cost
+        of a change does not grow with the size of the batch. The lines are folded into the entries on load, a last
+        line cut short by a crash is ignored, and the folded entries are written back compacted, one line per image.
+
+        Parameters:
+        path (str): The JSON lines file. Loaded when it exists.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self.images: dict[str, dict] = {}
+        if os.path.exists(path):
+            self.images = self.load(path)
+        self.compact()
+        self._file = open(path, "a")
+
+    @staticmethod
+    def load(path: str) -> dict[str, dict]:
+        images = {}
+        with open(path) as f:
+            for line_number, line in enumerate(f, 1):
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    log.warning(f"Ignoring the unreadable line {line_number} of {path}")
+                    continue
+                images.setdefault(event.pop("image"), {}).update(event)
+        return images
+
+    def is_done(self, image_path: str, text: str) -> bool:
+        """
+        Whether an image was finished with the same text and its output is still there.
+        """
+        entry = self.images.get(image_path)
+        return (
+            entry is not None
+            and entry["status"] == "done"
+            and entry.get("text") == text
+            and os.path.exists(entry.get("output") or "")
+        )
+
+    def update(self, image_path: str, **fields):
+        line = json.dumps({"image": image_path, **fields}, default=str)
+        with self._lock:
+            self.images.setdefault(image_path, {}).update(fields)
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def compact(self):
+        """
+        Rewrite the file atomically with one line per image.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            for image_path, entry in self.images.items():
+                f.write(json.dumps({"image": image_path, **entry}, default=str) + "\n")
+        os.replace(temp_path, self.path)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def summary(self) -> dict[str, int]:
+        """
+        Count the images per status, and the finished images whose inpainting was skipped as "inpainting_skipped".
+        """
+        with self._lock:
+            counts = {}
+            for entry in self.images.values():
+                counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+                if (entry.get("run_info") or {}).get("inpainting") == "skipped":
+                    counts["inpainting_skipped"] = counts.get("inpainting_skipped", 0) + 1
+            return counts
+
+
+def create_batch_inpainter(jobs: int, inpaint_mode: str, max_image_memory_mb: float) -> tuple:
+    """
+    Create the LaMa inpainter the jobs of a batch share, with the thread budget (see thread_budget.resolve_num_threads)
+    split evenly between the jobs, so parallel jobs do not each run a thread per core. On the CPU, where the "fork"
+    start method is available, the images are inpainted by an InpaintWorkerPool with one worker per job; otherwise
+    the jobs share one LamaInpainter.
+
+    Must be called before the process runs any multi-threaded PyTorch work, see InpaintWorkerPool.
+
+    Parameters:
+    jobs (int): The number of images processed in parallel.
+    inpaint_mode (str): The LamaInpainter mode.
+    max_image_memory_mb (float): The memory budget of a single LaMa input, or None.
+
+    Returns:
+    tuple: The inpainter, and the started InpaintWorkerPool to close after the batch, or None.
+    """
+    num_threads = max(1, resolve_num_threads() // jobs)
+    inpainter = LamaInpainter(
+        str(directories.big_lama_model_dir),
+        mode=inpaint_mode,
+        max_image_memory_mb=max_image_memory_mb,
+        num_threads=num_threads,
+    )
+    if torch.cuda.is_available() or "fork" not in multiprocessing.get_all_start_methods():
+        log.info(f"Sharing one inpainter between {jobs} jobs with {num_threads} thread(s)")
+        return inpainter, None
+    pool = InpaintWorkerPool(inpainter, num_workers=jobs, threads_per_worker=num_threads).start()
+    return PooledInpainter(pool), pool
+
+
+def process_image(
+        image_path: str,
+        text: str,
+        output_dir: str,
+        mask_dir: str,
+        manifest: BatchManifest,
+        lama_inpainter: Inpainter = None,
+):
+    """
+    Generate the on-pack image of one pack image with `onpack.generate_onpack` in its own temporary directories, and
+    record the outcome in the manifest. Failures are recorded, not raised, so one bad image does not stop the batch.
+    """
+    started = time.time()
+    manifest.update(image_path, status="running", text=text, started=started, error=None)
+    run_info = {}
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            temp_mask_dir = os.path.join(tmpdir, "mask")
+            temp_generated_dir = os.path.join(tmpdir, "generated")
+            os.makedirs(temp_mask_dir)
+            os.makedirs(temp_generated_dir)
+            output = onpack.generate_onpack(
+                orignal_file=Path(image_path),
+                temp_mask_dir=Path(temp_mask_dir),
+                temp_generated_dir=Path(temp_generated_dir),
+                bottom_text=text,
+                final_mask_dir=mask_dir,
+                final_output_dir=output_dir,
+                run_info=run_info,
+                lama_inpainter=lama_inpainter,
+            )
+    except Exception as e:
+        log.exception(f"Failed to process {image_path}")
+        manifest.update(
+            image_path, status="failed", error=repr(e), seconds=time.time() - started, run_info=run_info
+        )
+        return
+    manifest.update(
+        image_path,
+        status="done",
+        output=str(output),
+        mask=os.path.join(mask_dir, f"{Path(image_path).stem}_mask.png"),
+        finished=time.time(),
+        seconds=time.time() - started,
+        run_info=run_info,
+    )
+    log.info(f"Processed {image_path} in {time.time() - started:.1f}s")
+
+
+def run_batch(
+        source: str,
+        texts: dict[str, str] = None,
+        default_text: str = "",
+        jobs: int = 1,
+        manifest_path: str = None,
+        output_dir: str = directories.generated_dir,
+        mask_dir: str = directories.generated_mask_dir,
+) -> BatchManifest:
+    """
+    Generate the on-pack images of many pack images, `jobs` at a time. Existing outputs are never deleted: images the
+    manifest records as done, with the same text and an existing output, are skipped, and unfinished or failed
+    images are processed again, so an interrupted run is resumed by running the same command again.
+
+    With more than one job the jobs share one loaded model and the cores, see create_batch_inpainter. Every job
+    inpaints its own image, so the memory used grows with `jobs`; set INPAINT_MAX_MEMORY_MB to bound each image.
+
+    Parameters:
+    source (str): A directory of pack images, or a glob pattern.
+    texts (dict[str, str]): The bottom text per image file name or name without extension, see load_texts.
+    default_text (str): The bottom text of images missing from `texts`. No text is added when empty.
+    jobs (int): The number of images processed in parallel.
+    manifest_path (str): The manifest file. Defaults to directories.batch_manifest_file, outside the output
+        directory, which the single image command empties.
+    output_dir (str): The directory the on-pack images are written to.
+    mask_dir (str): The directory the masks are written to.
+
+    Returns:
+    BatchManifest: The manifest of the run.
+    """
+    texts = texts or {}
+    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(mask_dir, exist_ok=True)
+    image_paths = collect_images(source)
+    manifest = BatchManifest(manifest_path or directories.batch_manifest_file)
+    todo = []
+    for image_path in image_paths:
+        text = get_text(image_path, texts, default_text)
+        if not manifest.is_done(image_path, text):
+            todo.append((image_path, text))
+    log.info(f"{len(todo)} of {len(image_paths)} image(s) to process, the others are already done")
+    (lama_inpainter, pool) = (None, None)
+    if jobs > 1 and todo and os.getenv("ONLY_MASK", "false").lower() == "false":
+        max_image_memory_mb = float(os.getenv("INPAINT_MAX_MEMORY_MB")) if os.getenv("INPAINT_MAX_MEMORY_MB") else None
+        (lama_inpainter, pool) = create_batch_inpainter(jobs, os.getenv("INPAINT_MODE", "full"), max_image_memory_mb)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, jobs), thread_name_prefix="onpack") as executor:
+            futures = [
+                executor.submit(process_image, image_path, text, output_dir, mask_dir, manifest, lama_inpainter)
+                for (image_path, text) in todo
+            ]
+            for future in as_completed(futures):
+                future.result()
+    finally:
+        if pool is not None:
+            pool.close()
+        manifest.close()
+    log.info(f"Batch finished: {manifest.summary()}")
+    return manifest
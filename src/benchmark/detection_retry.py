@@ -0,0 +1,89 @@
+import logging
+import sys
+
+from PIL import Image
+
+from detection.base import BoundingBox, Detector, Prediction
+from detection.batch import detect_with_retry, is_retryable
+
+log = logging.getLogger(__name__)
+
+
+class FailingDetector(Detector):
+    def __init__(self, error: Exception, failures: int):
+        """
+        Detector raising `error` on its first `failures` calls and returning one prediction afterwards.
+        """
+        self.error = error
+        self.failures = failures
+        self.calls = 0
+
+    def detect(self, image: Image.Image) -> list[Prediction]:
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        return [Prediction(tag_name="weight", probability=0.9, bounding_box=BoundingBox(0.1, 0.1, 0.2, 0.2))]
+
+
+def get_errors() -> list[tuple]:
+    """
+    Returns the errors to check, each with whether it must be retried. The msrest and requests errors are only
+    included when the package is installed.
+    """
+    errors = [
+        (ConnectionError("connection reset"), True),
+        (TimeoutError("timed out"), True),
+        (ValueError("bad image"), False),
+    ]
+    try:
+        from msrest.exceptions import ClientRequestError
+
+        errors.append((ClientRequestError("Error occurred in request."), True))
+    except ImportError:
+        log.warning("msrest is not installed, its errors are not checked")
+    try:
+        from requests.exceptions import ConnectionError as RequestsConnectionError, ReadTimeout
+
+        errors.append((RequestsConnectionError("connection aborted"), True))
+        errors.append((ReadTimeout("read timed out"), True))
+    except ImportError:
+        log.warning("requests is not installed, its errors are not checked")
+    return errors
+
+
+def check_retries(failures: int = 2) -> list[dict]:
+    """
+    Run detect_with_retry against a detector failing `failures` times with each error of get_errors, and check that
+    transient errors are retried until the detection succeeds and other errors are raised at once.
+
+    Returns:
+    list[dict]: One row per error with its type, the detector calls made and whether the behaviour was as expected.
+    """
+    image = Image.new("L", (32, 32))
+    rows = []
+    for (error, retryable) in get_errors():
+        detector = FailingDetector(error, failures)
+        try:
+            detect_with_retry(detector, image, max_retries=failures, base_delay=0.0)
+            succeeded = True
+        except type(error):
+            succeeded = False
+        rows.append(
+            {
+                "error": f"{type(error).__module__}.{type(error).__name__}",
+                "is_retryable": is_retryable(error),
+                "calls": detector.calls,
+                "ok": succeeded == retryable and detector.calls == (failures + 1 if retryable else 1),
+            }
+        )
+        log.info(rows[-1])
+    return rows
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    rows = check_retries()
+    print(f"{'error':<45}{'retryable':>10}{'calls':>7}{'ok':>6}")
+    for row in rows:
+        print(f"{row['error']:<45}{str(row['is_retryable']):>10}{row['calls']:>7}{str(row['ok']):>6}")
+    sys.exit(0 if all(row["ok"] for row in rows) else 1)
@@ -0,0 +1,91 @@
+import argparse
+import logging
+import os
+import sys
+import time
+
+import directories
+from detection.upload import encode, prepare_upload
+from ImageCompression import convert_to_monochrome
+
+log = logging.getLogger(__name__)
+
+
+def measure_uploads(
+        sample_dir: str = directories.sample_images_dir,
+        max_edge: int = None,
+        max_bytes: int = None,
+        detect: bool = False,
+        limit: int = None,
+) -> list[dict]:
+    """
+    Compare the full resolution PNG upload `get_predictions` used to send with the prepared upload for every sample
+    image: bytes sent, time spent preparing and, with `detect`, the Custom Vision round trip and number of detections.
+
+    Returns:
+    list[dict]: One row per sample image.
+    """
+    client = None
+    if detect:
+        from detection.custom_vision import CustomVisionDetector
+
+        client = CustomVisionDetector(max_edge=max_edge, max_upload_bytes=max_bytes)
+    rows = []
+    for file_name in sorted(os.listdir(sample_dir))[:limit]:
+        if not file_name.lower().endswith((".png", ".jpg", ".jpeg")):
+            continue
+        image = convert_to_monochrome(os.path.join(sample_dir, file_name))
+        start = time.perf_counter()
+        original = encode(image, "PNG")
+        original_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        (prepared, upload) = prepare_upload(image, max_edge, max_bytes)
+        prepared_seconds = time.perf_counter() - start
+        row = {
+            "name": file_name,
+            "size": image.size,
+            "original_bytes": len(original),
+            "original_encode_seconds": original_seconds,
+            "prepared_bytes": len(prepared),
+            "prepared_encode_seconds": prepared_seconds,
+            "upload": upload,
+        }
+        if client is not None:
+            for (key, data) in (("original", original), ("prepared", prepared)):
+                start = time.perf_counter()
+                results = client.client.detect_image(
+                    project_id=client.project_id, published_name=client.iteration_name, image_data=data
+                )
+                row[f"{key}_request_seconds"] = time.perf_counter() - start
+                row[f"{key}_detections"] = sum(prediction.probability > 0.8 for prediction in results.predictions)
+        rows.append(row)
+        log.info(row)
+    return rows
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    parser = argparse.ArgumentParser(description="Bytes sent and latency of detection uploads before and after preparation")
+    parser.add_argument("--sample-dir", default=directories.sample_images_dir)
+    parser.add_argument("--max-edge", type=int, default=None)
+    parser.add_argument("--max-kb", type=float, default=None)
+    parser.add_argument("--detect", action="store_true", help="Also time the Custom Vision requests (needs credentials)")
+    parser.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args()
+    max_bytes = int(args.max_kb * 1024) if args.max_kb else None
+    rows = measure_uploads(args.sample_dir, args.max_edge, max_bytes, args.detect, args.limit)
+    print(f"{'name':<10}{'size':>12}{'png KB':>10}{'sent KB':>10}{'format':>8}{'prep s':>8}", end="")
+    print(f"{'png req s':>11}{'sent req s':>11}{'boxes':>8}" if args.detect else "")
+    for row in rows:
+        print(
+            f"{row['name']:<10}{'%dx%d' % row['size']:>12}{row['original_bytes'] / 1024:>10.1f}"
+            f"{row['prepared_bytes'] / 1024:>10.1f}{row['upload']['format']:>8}{row['prepared_encode_seconds']:>8.3f}",
+            end="",
+        )
+        if args.detect:
+            print(
+                f"{row['original_request_seconds']:>11.3f}{row['prepared_request_seconds']:>11.3f}"
+                f"{'%d/%d' % (row['original_detections'], row['prepared_detections']):>8}"
+            )
+        else:
+            print()
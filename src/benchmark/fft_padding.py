@@ -0,0 +1,57 @@
+import argparse
+import logging
+import sys
+
+import directories
+from benchmark.samples import load_samples, time_call
+from inpaint_lama import PAD_POLICIES, LamaInpainter, get_pad_size
+
+log = logging.getLogger(__name__)
+
+
+def measure_padding(model_path: str, sample_dir: str = directories.sample_images_dir, limit: int = None, repeats: int = 3) -> list[dict]:
+    """
+    Inpaint the sample images with every padding policy and report the padded size and the median latency of each.
+
+    Returns:
+    list[dict]: One row per sample and padding policy.
+    """
+    inpainters = {pad_policy: LamaInpainter(model_path, pad_policy=pad_policy) for pad_policy in PAD_POLICIES}
+    modulo = inpainters["modulo"].predict_config.dataset.get("pad_out_to_modulo", None) or 1
+    for inpainter in inpainters.values():
+        inpainter.warm_up()
+    rows = []
+    for (name, image, mask) in load_samples(sample_dir, limit=limit):
+        (height, width) = image.shape[:2]
+        for (pad_policy, inpainter) in inpainters.items():
+            inpainter.predict_arrays([image], [mask])
+            (_, seconds) = time_call(lambda: inpainter.predict_arrays([image], [mask]), repeats)
+            rows.append(
+                {
+                    "name": name,
+                    "size": (height, width),
+                    "pad_policy": pad_policy,
+                    "padded_size": (get_pad_size(height, modulo, pad_policy), get_pad_size(width, modulo, pad_policy)),
+                    "seconds": seconds,
+                }
+            )
+            log.info(rows[-1])
+    return rows
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    parser = argparse.ArgumentParser(description="Per-image inpainting latency of the modulo and FFT friendly padding")
+    parser.add_argument("--model-path", default=directories.big_lama_model_dir)
+    parser.add_argument("--sample-dir", default=directories.sample_images_dir)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    rows = measure_padding(args.model_path, args.sample_dir, args.limit, args.repeats)
+    print(f"{'name':<12}{'size':>12}{'modulo pad':>12}{'fft pad':>12}{'modulo s':>10}{'fft s':>10}{'speed-up':>10}")
+    for modulo_row, fft_row in zip(rows[0::2], rows[1::2]):
+        print(
+            f"{modulo_row['name']:<12}{'%dx%d' % modulo_row['size']:>12}{'%dx%d' % modulo_row['padded_size']:>12}"
+            f"{'%dx%d' % fft_row['padded_size']:>12}{modulo_row['seconds']:>10.3f}{fft_row['seconds']:>10.3f}"
+            f"{modulo_row['seconds'] / fft_row['seconds']:>10.2f}"
+        )
@@ -0,0 +1,69 @@
+import argparse
+import logging
+import sys
+
+import numpy as np
+import torch
+
+import directories
+from benchmark.samples import load_samples, psnr, time_call
+from inpaint_lama import LamaInpainter
+from lama_onnx import OnnxLamaInpainter
+
+log = logging.getLogger(__name__)
+
+
+def compare(onnx_path: str, model_path: str, mask_dir: str = None, limit: int = None, repeats: int = 3) -> list[dict]:
+    """
+    Inpaint the sample images with the eager LamaInpainter and the ONNX Runtime inpainter and report how far apart
+    the results are and how long each took.
+
+    Returns:
+    list[dict]: One row per sample with the image size, the maximum absolute pixel difference, the PSNR of the ONNX
+    result against the eager one and both median latencies.
+    """
+    eager = LamaInpainter(model_path)
+    eager.warm_up()
+    onnx = OnnxLamaInpainter(onnx_path, num_threads=torch.get_num_threads())
+    rows = []
+    for (name, image, mask) in load_samples(mask_dir=mask_dir, limit=limit):
+        (eager_result, eager_seconds) = time_call(lambda: eager.predict_arrays([image], [mask])[0], repeats)
+        (onnx_result, onnx_seconds) = time_call(lambda: onnx.inpaint_array(image, mask), repeats)
+        rows.append(
+            {
+                "name": name,
+                "size": f"{image.shape[1]}x{image.shape[0]}",
+                "max_abs_diff": int(np.abs(eager_result.astype(int) - onnx_result.astype(int)).max()),
+                "psnr": psnr(eager_result, onnx_result),
+                "eager_seconds": eager_seconds,
+                "onnx_seconds": onnx_seconds,
+            }
+        )
+        log.info(rows[-1])
+    return rows
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    parser = argparse.ArgumentParser(description="Parity check and benchmark of the ONNX Runtime LaMa backend against eager PyTorch")
+    parser.add_argument("--onnx", required=True, help="The exported generator, see lama_onnx.py")
+    parser.add_argument("--model-path", default=directories.big_lama_model_dir)
+    parser.add_argument("--mask-dir", default=None, help="Directory with <name>_mask.png masks for the sample images")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--max-abs-diff", type=int, default=2, help="Largest pixel difference accepted as parity")
+    args = parser.parse_args()
+    rows = compare(args.onnx, args.model_path, args.mask_dir, args.limit, args.repeats)
+    print(f"{'image':<8}{'size':>12}{'max diff':>10}{'psnr':>8}{'eager s':>10}{'onnx s':>10}")
+    for row in rows:
+        print(
+            f"{row['name']:<8}{row['size']:>12}{row['max_abs_diff']:>10}{row['psnr']:>8.1f}"
+            f"{row['eager_seconds']:>10.3f}{row['onnx_seconds']:>10.3f}"
+        )
+    eager_total = sum(row["eager_seconds"] for row in rows)
+    onnx_total = sum(row["onnx_seconds"] for row in rows)
+    print(f"Total eager {eager_total:.2f}s, onnx {onnx_total:.2f}s, speed-up {eager_total / onnx_total:.2f}x")
+    failed = [row["name"] for row in rows if row["max_abs_diff"] > args.max_abs_diff]
+    if failed:
+        print(f"Parity check failed for {failed}")
+        sys.exit(1)
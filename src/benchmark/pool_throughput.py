@@ -0,0 +1,71 @@
+import argparse
+import logging
+import os
+import sys
+import time
+
+import directories
+from benchmark.samples import load_samples
+from inpaint_lama import LamaInpainter
+from inpaint_pool import InpaintWorkerPool
+
+log = logging.getLogger(__name__)
+
+
+def measure_throughput(
+        model_path: str, worker_counts: list[int], mask_dir: str = None, limit: int = None, repeats: int = 2
+) -> list[dict]:
+    """
+    Inpaint the sample images `repeats` times through an InpaintWorkerPool of each size, with the cores shared evenly
+    between the workers, and report the throughput. Every pool is warmed up with one image before it is timed.
+
+    Run it in a fresh process: the pool must be started before the process has run multi-threaded PyTorch work.
+
+    Returns:
+    list[dict]: One row per worker count.
+    """
+    samples = load_samples(mask_dir=mask_dir, limit=limit)
+    images = [image for (_, image, _) in samples] * repeats
+    masks = [mask for (_, _, mask) in samples] * repeats
+    cpu_count = os.cpu_count() or 1
+    inpainter = LamaInpainter(model_path)
+    rows = []
+    for num_workers in worker_counts:
+        threads_per_worker = max(1, cpu_count // num_workers)
+        with InpaintWorkerPool(inpainter, num_workers, threads_per_worker) as pool:
+            pool.map(images[:1], masks[:1])
+            start = time.perf_counter()
+            pool.map(images, masks)
+            seconds = time.perf_counter() - start
+        rows.append(
+            {
+                "workers": num_workers,
+                "threads_per_worker": threads_per_worker,
+                "images": len(images),
+                "seconds": seconds,
+                "images_per_second": len(images) / seconds,
+            }
+        )
+        log.info(rows[-1])
+    return rows
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    parser = argparse.ArgumentParser(description="Throughput of the forked inpainting worker pool per worker count")
+    parser.add_argument("--model-path", default=directories.big_lama_model_dir)
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=sorted({1, 2, max(1, (os.cpu_count() or 1) // 2)}),
+        help="The worker counts to measure. Defaults to 1, 2 and one per two cores",
+    )
+    parser.add_argument("--mask-dir", default=None, help="Directory with <name>_mask.png masks for the sample images")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--repeats", type=int, default=2)
+    args = parser.parse_args()
+    rows = measure_throughput(args.model_path, args.workers, args.mask_dir, args.limit, args.repeats)
+    print(f"{'workers':>8}{'threads':>9}{'images':>8}{'seconds':>10}{'img/s':>8}{'speed-up':>10}")
+    for row in rows:
+        print(
+            f"{row['workers']:>8}{row['threads_per_worker']:>9}{row['images']:>8}{row['seconds']:>10.2f}"
+            f"{row['images_per_second']:>8.2f}{row['images_per_second'] / rows[0]['images_per_second']:>10.2f}"
+        )
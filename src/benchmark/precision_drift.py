@@ -0,0 +1,68 @@
+import argparse
+import logging
+import sys
+
+import numpy as np
+from skimage.metrics import structural_similarity
+
+import directories
+from benchmark.samples import load_samples, psnr, time_call
+from inpaint_lama import LamaInpainter
+from model_registry import PRECISIONS
+
+log = logging.getLogger(__name__)
+
+
+def measure_drift(model_path: str, precisions: list[str], mask_dir: str = None, limit: int = None) -> list[dict]:
+    """
+    Inpaint the sample images in fp32 and in each of the given precisions and report the PSNR and SSIM of every
+    result against the fp32 one, together with the latencies.
+
+    Returns:
+    list[dict]: One row per sample and precision.
+    """
+    inpainters = {precision: LamaInpainter(model_path, precision=precision) for precision in ["fp32"] + precisions}
+    for inpainter in inpainters.values():
+        inpainter.warm_up()
+    rows = []
+    for (name, image, mask) in load_samples(mask_dir=mask_dir, limit=limit):
+        (reference, reference_seconds) = time_call(lambda: inpainters["fp32"].predict_arrays([image], [mask])[0])
+        for precision in precisions:
+            (result, seconds) = time_call(lambda: inpainters[precision].predict_arrays([image], [mask])[0])
+            rows.append(
+                {
+                    "name": name,
+                    "precision": precision,
+                    "psnr": psnr(reference, result),
+                    "ssim": structural_similarity(reference, result, channel_axis=2),
+                    "fp32_seconds": reference_seconds,
+                    "seconds": seconds,
+                }
+            )
+            log.info(rows[-1])
+    return rows
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    parser = argparse.ArgumentParser(description="Quality drift and latency of reduced precision inpainting against fp32")
+    parser.add_argument("--model-path", default=directories.big_lama_model_dir)
+    # int8 is left out by default: it only quantises linear layers and big-lama has none, see quantize_generator.
+    parser.add_argument("--precisions", nargs="+", choices=PRECISIONS[1:], default=["bf16"])
+    parser.add_argument("--mask-dir", default=None, help="Directory with <name>_mask.png masks for the sample images")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--min-psnr", type=float, default=40.0, help="PSNR treated as visually identical")
+    parser.add_argument("--min-ssim", type=float, default=0.99, help="SSIM treated as visually identical")
+    args = parser.parse_args()
+    rows = measure_drift(args.model_path, args.precisions, args.mask_dir, args.limit)
+    print(f"{'precision':<10}{'mean psnr':>10}{'min psnr':>10}{'mean ssim':>10}{'min ssim':>10}{'speed-up':>10}  verdict")
+    for precision in args.precisions:
+        selected = [row for row in rows if row["precision"] == precision]
+        psnrs = [row["psnr"] for row in selected]
+        ssims = [row["ssim"] for row in selected]
+        speed_up = sum(row["fp32_seconds"] for row in selected) / sum(row["seconds"] for row in selected)
+        identical = min(psnrs) >= args.min_psnr and min(ssims) >= args.min_ssim
+        print(
+            f"{precision:<10}{np.mean(psnrs):>10.2f}{min(psnrs):>10.2f}{np.mean(ssims):>10.4f}{min(ssims):>10.4f}"
+            f"{speed_up:>10.2f}  {'visually identical' if identical else 'visible drift'}"
+        )
@@ -0,0 +1,73 @@
+import os
+import time
+
+import cv2
+import numpy as np
+
+from directories import sample_images_dir
+
+
+def make_synthetic_mask(image: np.ndarray) -> np.ndarray:
+    """
+    Build a mask shaped like a typical Custom Vision detection result: a nutrients block in the bottom left corner,
+    a weight label in the bottom right corner and a line of additional text near the top.
+
+    Parameters:
+    image (numpy.ndarray): The image the mask is for.
+
+    Returns:
+    numpy.ndarray: The HxW uint8 mask.
+    """
+    (height, width) = image.shape[:2]
+    mask = np.zeros((height, width), np.uint8)
+    for (left, top, right, bottom) in ((0.05, 0.70, 0.35, 0.92), (0.70, 0.80, 0.93, 0.90), (0.25, 0.08, 0.75, 0.14)):
+        mask[int(top * height):int(bottom * height), int(left * width):int(right * width)] = 255
+    return mask
+
+
+def load_samples(sample_dir: str = sample_images_dir, mask_dir: str = None, limit: int = None) -> list[tuple]:
+    """
+    Load the sample pack images with a mask each. Masks are read from `<mask_dir>/<name>_mask.png` when a mask
+    directory is given and the file exists, otherwise a synthetic mask is used.
+
+    Parameters:
+    sample_dir (str): The directory holding the sample images.
+    mask_dir (str): An optional directory holding real masks.
+    limit (int): The maximum number of samples to load.
+
+    Returns:
+    list[tuple]: (name, image, mask) tuples, sorted by name.
+    """
+    samples = []
+    for file_name in sorted(os.listdir(sample_dir))[:limit]:
+        if not file_name.lower().endswith((".png", ".jpg", ".jpeg")):
+            continue
+        name = os.path.splitext(file_name)[0]
+        image = cv2.imread(os.path.join(sample_dir, file_name))
+        mask_file = os.path.join(mask_dir, f"{name}_mask.png") if mask_dir else None
+        if mask_file and os.path.exists(mask_file):
+            mask = cv2.imread(mask_file, cv2.IMREAD_GRAYSCALE)
+        else:
+            mask = make_synthetic_mask(image)
+        samples.append((name, image, mask))
+    return samples
+
+
+def time_call(function, repeats: int = 3):
+    """
+    Call a function `repeats` times and return its last result and the median wall clock time in seconds.
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return result, float(np.median(timings))
+
+
+def psnr(reference: np.ndarray, image: np.ndarray) -> float:
+    """
+    Peak signal to noise ratio between two uint8 images, infinite when they are identical.
+    """
+    mse = np.mean((reference.astype(np.float64) - image.astype(np.float64)) ** 2)
+    return float("inf") if mse == 0 else float(10 * np.log10(255 ** 2 / mse))
@@ -0,0 +1,98 @@
+import logging
+from typing import Callable
+
+import cv2
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+def downscale(image: np.ndarray, mask: np.ndarray, scale: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Downscale an image and its mask. Every low resolution pixel that covers any masked pixel stays masked, so the
+    fill covers the whole original mask once upsampled.
+
+    Parameters:
+    image (numpy.ndarray): The HxWx3 uint8 image.
+    mask (numpy.ndarray): The HxW uint8 mask.
+    scale (float): The scale factor, between 0 and 1.
+
+    Returns:
+    tuple: The downscaled image and mask.
+    """
+    (height, width) = mask.shape[:2]
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    small_image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    small_mask = cv2.resize((mask > 0).astype(np.uint8) * 255, size, interpolation=cv2.INTER_AREA)
+    small_mask = cv2.dilate((small_mask > 0).astype(np.uint8) * 255, np.ones((3, 3), np.uint8))
+    return small_image, small_mask
+
+
+def refine_fill(fill: np.ndarray, amount: float = 0.5) -> np.ndarray:
+    """
+    Light full resolution refinement of an upsampled fill: an unsharp mask that restores some of the crispness lost
+    by the upsampling.
+    """
+    blurred = cv2.GaussianBlur(fill, (0, 0), sigmaX=1.5)
+    return cv2.addWeighted(fill, 1 + amount, blurred, -amount, 0)
+
+
+def inpaint_coarse_to_fine(
+    predict_arrays: Callable[[list, list], list],
+    image: np.ndarray,
+    mask: np.ndarray,
+    scale: float,
+    refine: bool = False,
+) -> np.ndarray:
+    """
+    Inpaint a downscaled copy of the image and composite the upsampled fill into the masked region of the full
+    resolution original. The pixels outside the mask are untouched.
+
+    Parameters:
+    predict_arrays (Callable): Inpaints a list of BGR images with their masks and returns the BGR results.
+    image (numpy.ndarray): The HxWx3 uint8 BGR image.
+    mask (numpy.ndarray): The HxW uint8 mask.
+    scale (float): The scale the image is inpainted at, between 0 and 1.
+    refine (bool): Sharpen the upsampled fill and feather its seam with the original at full resolution.
+
+    Returns:
+    numpy.ndarray: The inpainted image.
+    """
+    result = image.copy()
+    masked = mask > 0
+    if not masked.any():
+        return result
+    (height, width) = mask.shape[:2]
+    (small_image, small_mask) = downscale(image, mask, scale)
+    log.info(f"Inpainting at {small_image.shape[1]}x{small_image.shape[0]} instead of {width}x{height}")
+    small_result = predict_arrays([small_image], [small_mask])[0]
+    (ys, xs) = np.nonzero(masked)
+    pad = 4 if refine else 0
+    (x1, y1) = (max(0, xs.min() - pad), max(0, ys.min() - pad))
+    (x2, y2) = (min(width, xs.max() + 1 + pad), min(height, ys.max() + 1 + pad))
+    # Upsample the low resolution result only over the bounding box of the mask, keeping the pixel centres aligned
+    # with the full resolution image.
+    (scale_x, scale_y) = (small_image.shape[1] / width, small_image.shape[0] / height)
+    transform = np.float32(
+        [[scale_x, 0, scale_x * (x1 + 0.5) - 0.5], [0, scale_y, scale_y * (y1 + 0.5) - 0.5]]
+    )
+    fill = cv2.warpAffine(
+        small_result,
+        transform,
+        (int(x2 - x1), int(y2 - y1)),
+        flags=cv2.INTER_CUBIC | cv2.WARP_INVERSE_MAP,
+        borderMode=cv2.BORDER_REPLICATE,
+    )
+    region = result[y1:y2, x1:x2]
+    region_mask = masked[y1:y2, x1:x2]
+    if refine:
+        # Feather the fill a couple of pixels past the mask so the seam with the original is not visible.
+        fill = refine_fill(fill)
+        alpha = cv2.GaussianBlur(region_mask.astype(np.float32), (0, 0), sigmaX=1.5)
+        alpha = np.maximum(alpha, region_mask)
+        blend = alpha > 0.01
+        weight = alpha[blend][:, None]
+        region[blend] = np.round(region[blend] * (1 - weight) + fill[blend] * weight).astype(np.uint8)
+    else:
+        region[region_mask] = fill[region_mask]
+    return result
@@ -0,0 +1,59 @@
+import hashlib
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+
+from PIL import Image
+
+
+def get_image_key(image: Image.Image) -> str:
+    """
+    Key an image by its mode, size and pixels, so recordings and cached detections match however the file was named.
+    """
+    digest = hashlib.sha256(f"{image.mode}:{image.size}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+@dataclass
+class BoundingBox:
+    """
+    A bounding box normalised to the image size, with the same attributes as the Custom Vision SDK's BoundingBox.
+    """
+
+    left: float
+    top: float
+    width: float
+    height: float
+
+
+@dataclass
+class Prediction:
+    """
+    A detected object, with the same attributes as the Custom Vision SDK's Prediction that `create_masks` reads.
+    """
+
+    tag_name: str
+    probability: float
+    bounding_box: BoundingBox
+
+
+class Detector(ABC):
+    @abstractmethod
+    def detect(self, image: Image.Image) -> list[Prediction]:
+        """
+        Detect the objects in an image.
+
+        Parameters:
+        image (PIL.Image.Image): The image, as prepared by `mask.get_predictions`.
+
+        Returns:
+        list[Prediction]: Every prediction of the backend, unfiltered. Boxes are normalised to the image size.
+        """
+        raise NotImplementedError()
+
+    def get_cache_identity(self) -> dict:
+        """
+        Describes the model behind the detector, for keying cached detections. Detectors returning None, the default,
+        are not cached.
+        """
+        return None
@@ -0,0 +1,194 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Iterable, Iterator
+
+from PIL import Image
+
+from detection.base import Detector, Prediction
+from detection.registry import get_detector
+from ImageCompression import convert_to_monochrome
+
+log = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        """
+        A thread safe token bucket limiting calls to `rate` per second, with bursts of up to `capacity` calls.
+
+        Parameters:
+        rate (float): The tokens added per second, e.g. the prediction endpoint's transactions per second quota.
+        capacity (float): The largest burst. Defaults to the rate (at least one).
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token, waiting until one is available.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_seconds = (1 - self._tokens) / self.rate
+            time.sleep(wait_seconds)
+
+
+def get_status_code(error: Exception) -> int:
+    """
+    Returns the HTTP status code of a failed request, as raised by the Custom Vision SDK (msrest) or requests, or None.
+    """
+    response = getattr(error, "response", None)
+    status_code = getattr(response, "status_code", None)
+    return status_code if status_code is not None else getattr(error, "status_code", None)
+
+
+def get_retry_after(error: Exception) -> float:
+    """
+    Returns the seconds a 429 response asked to wait in its Retry-After header, or None.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def get_transient_error_types() -> tuple:
+    """
+    Returns the exception types of requests that failed without a response: the built-in connection errors, and
+    those of msrest (which the Custom Vision SDK raises for connection failures and timeouts) and requests, when they
+    are installed.
+    """
+    error_types = [ConnectionError, TimeoutError]
+    try:
+        from msrest.exceptions import ClientRequestError
+
+        error_types.append(ClientRequestError)
+    except ImportError:
+        pass
+    try:
+        from requests.exceptions import RequestException
+
+        error_types.append(RequestException)
+    except ImportError:
+        pass
+    return tuple(error_types)
+
+
+TRANSIENT_ERROR_TYPES = get_transient_error_types()
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Throttling (429), server errors (5xx) and connection failures are worth retrying; anything else is not.
+    """
+    status_code = get_status_code(error)
+    if status_code is not None:
+        return status_code == 429 or status_code >= 500
+    return isinstance(error, TRANSIENT_ERROR_TYPES)
+
+
+def detect_with_retry(
+        detector: Detector,
+        image: Image.Image,
+        rate_limiter: TokenBucket = None,
+        max_retries: int = 5,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+) -> list[Prediction]:
+    """
+    Detect objects in an image, retrying throttled and failed requests with exponential backoff and full jitter.
+    A Retry-After header on a 429 response is honoured when it asks for a longer wait.
+
+    Parameters:
+    detector (Detector): The detector.
+    image (PIL.Image.Image): The prepared image.
+    rate_limiter (TokenBucket): Taken from before every attempt. No limit when None.
+    max_retries (int): The retries after the first attempt.
+    base_delay (float): The backoff of the first retry in seconds, doubled on every further retry.
+    max_delay (float): The longest backoff in seconds.
+
+    Returns:
+    list[Prediction]: The detector's predictions.
+    """
+    for attempt in range(max_retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            return detector.detect(image)
+        except Exception as e:
+            if attempt == max_retries or not is_retryable(e):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            retry_after = get_retry_after(e)
+            if retry_after is not None:
+                delay = max(delay, min(max_delay, retry_after))
+            log.warning(f"Detection failed with {get_status_code(e) or type(e).__name__}, retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+
+def detect_batch(
+        image_paths: Iterable[str],
+        detector: Detector = None,
+        max_workers: int = 8,
+        rate_per_second: float = 10.0,
+        min_probability: float = 0.8,
+        prepare: Callable[[str], Image.Image] = convert_to_monochrome,
+        max_retries: int = 5,
+) -> Iterator[tuple]:
+    """
+    Detect objects in many images concurrently and yield each result as soon as it completes, in completion order.
+    At most `max_workers` requests are in flight, and requests are rate limited to the prediction endpoint's quota.
+
+    Parameters:
+    image_paths (Iterable[str]): The images. Consumed lazily, so a long listing can be streamed in.
+    detector (Detector): The detector. Defaults to the process wide detector, see detection.registry.get_detector.
+    max_workers (int): The number of concurrent requests.
+    rate_per_second (float): The requests per second allowed, 10 for the Custom Vision S0 prediction tier.
+    min_probability (float): Predictions at or below this probability are dropped, as in `mask.get_predictions`.
+    prepare (Callable): Loads and prepares an image for detection. Defaults to the monochrome conversion.
+    max_retries (int): The retries of a throttled or failed request, see detect_with_retry.
+
+    Yields:
+    tuple: The image path, its predictions (None when the detection failed) and the exception (None on success).
+    """
+    detector = detector if detector is not None else get_detector()
+    rate_limiter = TokenBucket(rate_per_second)
+
+    def detect_one(image_path: str) -> list[Prediction]:
+        predictions = detect_with_retry(detector, prepare(image_path), rate_limiter, max_retries)
+        return [prediction for prediction in predictions if prediction.probability > min_probability]
+
+    remaining = iter(image_paths)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="detect") as executor:
+        pending = {}
+        while True:
+            # Keep the pool busy without queueing the whole listing up front.
+            while len(pending) < 2 * max_workers:
+                image_path = next(remaining, None)
+                if image_path is None:
+                    break
+                pending[executor.submit(detect_one, image_path)] = image_path
+            if not pending:
+                return
+            (done, _) = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                image_path = pending.pop(future)
+                error = future.exception()
+                if error is not None:
+                    log.error(f"Detection of {image_path} failed: {error}")
+                    yield image_path, None, error
+                else:
+                    yield image_path, future.result(), None
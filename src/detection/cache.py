@@ -0,0 +1,177 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from PIL import Image
+
+import directories
+from detection.base import BoundingBox, Detector, Prediction, get_image_key
+
+log = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS detections (
+    key TEXT PRIMARY KEY,
+    predictions TEXT NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+)
+"""
+
+
+def pack_predictions(predictions: list) -> str:
+    """
+    Store predictions compactly as a JSON list of [tag name, probability, left, top, width, height] rows.
+    """
+    return json.dumps(
+        [
+            [
+                prediction.tag_name,
+                round(prediction.probability, 6),
+                round(prediction.bounding_box.left, 6),
+                round(prediction.bounding_box.top, 6),
+                round(prediction.bounding_box.width, 6),
+                round(prediction.bounding_box.height, 6),
+            ]
+            for prediction in predictions
+        ],
+        separators=(",", ":"),
+    )
+
+
+def unpack_predictions(packed: str) -> list[Prediction]:
+    return [
+        Prediction(tag_name, probability, BoundingBox(left, top, width, height))
+        for (tag_name, probability, left, top, width, height) in json.loads(packed)
+    ]
+
+
+class DetectionCache:
+    def __init__(
+            self,
+            db_path: str = os.path.join(directories.cache_dir, "detections.sqlite3"),
+            ttl_hours: float = 720,
+            max_entries: int = 10000,
+    ):
+        """
+        A persistent SQLite cache of detection results, keyed by the image content and the identity of the detector
+        (e.g. the Custom Vision project id and iteration name). Entries expire `ttl_hours` after they were stored and
+        the least recently used ones are evicted beyond `max_entries`.
+
+        Parameters:
+        db_path (str): The SQLite database file. Defaults to detections.sqlite3 in directories.cache_dir.
+        ttl_hours (float): How long a detection stays valid.
+        max_entries (int): The number of detections kept.
+        """
+        self.db_path = db_path
+        self.ttl_seconds = ttl_hours * 3600
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        Open a connection for one transaction, committed on success and closed afterwards.
+        """
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    @staticmethod
+    def make_key(image: Image.Image, identity: dict) -> str:
+        digest = hashlib.sha256(get_image_key(image).encode())
+        digest.update(json.dumps(identity, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> list[Prediction]:
+        """
+        Look a detection up and mark it as recently used.
+
+        Returns:
+        list[Prediction]: The cached predictions, or None on a miss or when the entry expired.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT predictions FROM detections WHERE key = ? AND created >= ?", (key, now - self.ttl_seconds)
+            ).fetchone()
+            if row is not None:
+                connection.execute("UPDATE detections SET last_used = ? WHERE key = ?", (now, key))
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return None if row is None else unpack_predictions(row[0])
+
+    def put(self, key: str, predictions: list):
+        """
+        Store a detection and evict expired and least recently used entries.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO detections (key, predictions, created, last_used) VALUES (?, ?, ?, ?)",
+                (key, pack_predictions(predictions), now, now),
+            )
+        self.evict()
+
+    def evict(self) -> int:
+        """
+        Delete expired entries and the least recently used ones beyond `max_entries`.
+
+        Returns:
+        int: The number of entries deleted.
+        """
+        with self._connect() as connection:
+            expired = connection.execute(
+                "DELETE FROM detections WHERE created < ?", (time.time() - self.ttl_seconds,)
+            ).rowcount
+            overflow = connection.execute(
+                "DELETE FROM detections WHERE key IN "
+                "(SELECT key FROM detections ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            ).rowcount
+        if expired or overflow:
+            log.info(f"Evicted {expired} expired and {overflow} least recently used detection(s)")
+        return expired + overflow
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+class CachedDetector(Detector):
+    def __init__(self, detector: Detector, cache: DetectionCache):
+        """
+        Detector answering from a DetectionCache and only calling the wrapped detector on a miss.
+        """
+        self.detector = detector
+        self.cache = cache
+
+    def get_cache_identity(self) -> dict:
+        return self.detector.get_cache_identity()
+
+    def detect(self, image: Image.Image) -> list[Prediction]:
+        key = self.cache.make_key(image, self.detector.get_cache_identity())
+        predictions = self.cache.get(key)
+        if predictions is None:
+            predictions = self.detector.detect(image)
+            self.cache.put(key, predictions)
+        log.info(f"Detection cache {self.cache.stats()}")
+        return predictions
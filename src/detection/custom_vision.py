@@ -0,0 +1,63 @@
+import os
+
+from azure.cognitiveservices.vision.customvision.prediction import CustomVisionPredictionClient
+from msrest.authentication import ApiKeyCredentials
+from PIL import Image
+
+from detection.base import Detector, Prediction
+from detection.upload import prepare_upload
+
+
+class CustomVisionDetector(Detector):
+    def __init__(
+            self,
+            endpoint: str = None,
+            prediction_key: str = None,
+            project_id: str = None,
+            iteration_name: str = None,
+            max_edge: int = None,
+            max_upload_bytes: int = None,
+    ):
+        """
+        Detector calling a published Custom Vision iteration over HTTP.
+
+        Parameters:
+        endpoint (str): The prediction endpoint. Defaults to the CUSTOM_VISION_ENDPOINT environment variable.
+        prediction_key (str): The prediction key. Defaults to the CUSTOM_VISION_KEY environment variable.
+        project_id (str): The project id. Defaults to the CUSTOM_VISION_PROJECT_ID environment variable.
+        iteration_name (str): The published iteration. Defaults to the CUSTOM_VISION_ITERATION_NAME environment variable.
+        max_edge (int): The longest edge images are shrunk to before the upload, see `prepare_upload`.
+        max_upload_bytes (int): The byte budget of an upload, see `prepare_upload`.
+        """
+        self.endpoint = endpoint or os.environ["CUSTOM_VISION_ENDPOINT"]
+        self.project_id = project_id or os.environ["CUSTOM_VISION_PROJECT_ID"]
+        self.iteration_name = iteration_name or os.environ["CUSTOM_VISION_ITERATION_NAME"]
+        credentials = ApiKeyCredentials(
+            in_headers={"Prediction-key": prediction_key or os.environ["CUSTOM_VISION_KEY"]}
+        )
+        self.client = CustomVisionPredictionClient(self.endpoint, credentials)
+        self.max_edge = max_edge or int(os.getenv("DETECTION_MAX_EDGE", "1024"))
+        self.max_upload_bytes = max_upload_bytes or int(float(os.getenv("DETECTION_MAX_UPLOAD_KB", "256")) * 1024)
+        self.last_upload: dict = {}
+
+    def get_cache_identity(self) -> dict:
+        return {
+            "backend": "custom_vision",
+            "project_id": self.project_id,
+            "iteration_name": self.iteration_name,
+            "max_edge": self.max_edge,
+            "max_upload_bytes": self.max_upload_bytes,
+        }
+
+    def detect(self, image: Image.Image) -> list[Prediction]:
+        """
+        Upload the image, shrunk and encoded by `prepare_upload`, and return the SDK's predictions, which have the same
+        attributes as Prediction. What was sent is kept in `last_upload`.
+        """
+        (image_bytes, self.last_upload) = prepare_upload(image, self.max_edge, self.max_upload_bytes)
+        results = self.client.detect_image(
+            project_id=self.project_id,
+            published_name=self.iteration_name,
+            image_data=image_bytes,
+        )
+        return list(results.predictions)
@@ -0,0 +1,96 @@
+import json
+import logging
+import os
+import threading
+
+from PIL import Image
+
+from detection.base import BoundingBox, Detector, Prediction, get_image_key
+
+log = logging.getLogger(__name__)
+
+
+def prediction_to_dict(prediction) -> dict:
+    """
+    Serialise a Prediction, or a Custom Vision SDK prediction, to a JSON friendly dict.
+    """
+    box = prediction.bounding_box
+    return {
+        "tag_name": prediction.tag_name,
+        "probability": prediction.probability,
+        "bounding_box": {"left": box.left, "top": box.top, "width": box.width, "height": box.height},
+    }
+
+
+def prediction_from_dict(values: dict) -> Prediction:
+    return Prediction(
+        tag_name=values["tag_name"],
+        probability=values["probability"],
+        bounding_box=BoundingBox(**values["bounding_box"]),
+    )
+
+
+class FakeDetector(Detector):
+    def __init__(self, recordings_path: str = None, default_predictions: list[dict] = None):
+        """
+        In-process detector replaying recorded predictions, for running and benchmarking the generation path offline.
+
+        Recordings are a JSON file mapping image keys (see get_image_key) to lists of serialised predictions. Images
+        without a recording get `default_predictions`.
+
+        Parameters:
+        recordings_path (str): The JSON recordings file. Nothing is replayed when None or missing.
+        default_predictions (list[dict]): Serialised predictions returned for unrecorded images. Defaults to none.
+        """
+        self.recordings_path = recordings_path
+        self._lock = threading.Lock()
+        self.recordings: dict[str, list[dict]] = {}
+        if recordings_path and os.path.exists(recordings_path):
+            with open(recordings_path, "r") as f:
+                self.recordings = json.load(f)
+            log.info(f"Loaded {len(self.recordings)} recorded detection(s) from {recordings_path}")
+        self.default_predictions = default_predictions or []
+
+    def detect(self, image: Image.Image) -> list[Prediction]:
+        key = get_image_key(image)
+        with self._lock:
+            recorded = self.recordings.get(key, self.default_predictions)
+        return [prediction_from_dict(values) for values in recorded]
+
+    def record(self, image: Image.Image, predictions: list):
+        """
+        Record the predictions another detector returned for an image, so they can be replayed.
+        """
+        key = get_image_key(image)
+        values = [prediction_to_dict(prediction) for prediction in predictions]
+        with self._lock:
+            self.recordings[key] = values
+
+    def save(self, recordings_path: str = None):
+        """
+        Write the recordings to a JSON file, by default the one they were loaded from. The file is replaced
+        atomically, so a reader or a crash never sees it half written.
+        """
+        recordings_path = recordings_path or self.recordings_path
+        os.makedirs(os.path.dirname(os.path.abspath(recordings_path)), exist_ok=True)
+        temp_path = f"{recordings_path}.tmp"
+        with self._lock:
+            with open(temp_path, "w") as f:
+                json.dump(self.recordings, f, indent=2)
+            os.replace(temp_path, recordings_path)
+
+
+class RecordingDetector(Detector):
+    def __init__(self, detector: Detector, fake: FakeDetector):
+        """
+        Detector passing images on to another detector and recording its predictions into a FakeDetector, whose
+        recordings file is rewritten after every detection. Safe to call from several threads.
+        """
+        self.detector = detector
+        self.fake = fake
+
+    def detect(self, image: Image.Image) -> list[Prediction]:
+        predictions = self.detector.detect(image)
+        self.fake.record(image, predictions)
+        self.fake.save()
+        return predictions
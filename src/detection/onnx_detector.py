@@ -0,0 +1,99 @@
+import logging
+import os
+import time
+
+import numpy as np
+import onnxruntime
+from PIL import Image
+
+import directories
+from detection.base import BoundingBox, Detector, Prediction
+
+log = logging.getLogger(__name__)
+
+
+def load_labels(labels_path: str) -> list[str]:
+    """
+    Read the tag names of an exported model, one per line, in class id order.
+    """
+    with open(labels_path, "r") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+class OnnxDetector(Detector):
+    def __init__(self, model_path: str = None, labels_path: str = None, num_threads: int = None):
+        """
+        Detector running a Custom Vision object detection model exported as ONNX locally with ONNX Runtime, so no
+        network round trip is needed. The export's metadata tells whether the model expects BGR input and pixel values
+        in the range [0, 255]; its outputs are the detected_boxes (normalised x1, y1, x2, y2), detected_classes and
+        detected_scores.
+
+        Parameters:
+        model_path (str): The exported model.onnx. Defaults to the DETECTOR_ONNX_MODEL environment variable, then to
+            model.onnx in directories.detector_model_dir.
+        labels_path (str): The exported labels.txt. Defaults to labels.txt next to the model.
+        num_threads (int): The ONNX Runtime intra-op thread count. Defaults to ONNX Runtime's choice.
+        """
+        self.model_path = (
+            model_path
+            or os.getenv("DETECTOR_ONNX_MODEL")
+            or os.path.join(directories.detector_model_dir, "model.onnx")
+        )
+        self.labels = load_labels(labels_path or os.path.join(os.path.dirname(self.model_path), "labels.txt"))
+        start = time.perf_counter()
+        options = onnxruntime.SessionOptions()
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(
+            self.model_path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.input_type = np.float16 if model_input.type == "tensor(float16)" else np.float32
+        (height, width) = model_input.shape[2:]
+        self.input_size = (width, height) if isinstance(width, int) and isinstance(height, int) else None
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.is_bgr = metadata.get("Image.BitmapPixelFormat") == "Bgr8"
+        self.is_range255 = metadata.get("Image.NominalPixelRange") == "NominalRange_0_255"
+        log.info(f"Loaded {self.model_path} in {time.perf_counter() - start:.2f}s")
+
+    def preprocess(self, image: Image.Image) -> np.ndarray:
+        """
+        Resize the image to the model input and lay it out as the 1x3xHxW tensor the export expects.
+        """
+        image = image.convert("RGB")
+        if self.input_size is not None:
+            image = image.resize(self.input_size)
+        inputs = np.asarray(image, dtype=np.float32).transpose((2, 0, 1))[np.newaxis]
+        if self.is_bgr:
+            inputs = inputs[:, ::-1]
+        if not self.is_range255:
+            inputs = inputs / 255
+        return np.ascontiguousarray(inputs, dtype=self.input_type)
+
+    def get_cache_identity(self) -> dict:
+        model_stat = os.stat(self.model_path)
+        return {
+            "backend": "onnx",
+            "model": os.path.abspath(self.model_path),
+            "model_size": model_stat.st_size,
+            "model_mtime": model_stat.st_mtime,
+        }
+
+    def detect(self, image: Image.Image) -> list[Prediction]:
+        outputs = self.session.run(
+            ["detected_boxes", "detected_classes", "detected_scores"], {self.input_name: self.preprocess(image)}
+        )
+        (boxes, classes, scores) = (output[0] for output in outputs)
+        predictions = []
+        for (box, class_id, score) in zip(boxes, classes, scores):
+            (x1, y1, x2, y2) = (float(value) for value in np.clip(box, 0.0, 1.0))
+            class_id = int(class_id)
+            predictions.append(
+                Prediction(
+                    tag_name=self.labels[class_id] if class_id < len(self.labels) else str(class_id),
+                    probability=float(score),
+                    bounding_box=BoundingBox(left=x1, top=y1, width=x2 - x1, height=y2 - y1),
+                )
+            )
+        return predictions
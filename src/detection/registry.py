@@ -0,0 +1,129 @@
+import logging
+import os
+import threading
+import time
+from typing import Callable
+
+import directories
+from detection.base import Detector
+
+log = logging.getLogger(__name__)
+
+_factories: dict[str, Callable[[], Detector]] = {}
+_detectors: dict[tuple[str, bool], Detector] = {}
+_lock = threading.Lock()
+
+
+def register_backend(name: str, factory: Callable[[], Detector]):
+    """
+    Register a detector backend. The factory is only called the first time the backend is used.
+
+    Parameters:
+    name (str): The backend name, as used in the DETECTOR_BACKEND environment variable.
+    factory (Callable): Creates the detector. Backends with heavy dependencies should import them inside the factory.
+    """
+    with _lock:
+        _factories[name] = factory
+        for key in [key for key in _detectors if key[0] == name]:
+            del _detectors[key]
+
+
+def get_backends() -> tuple[str, ...]:
+    with _lock:
+        return tuple(_factories)
+
+
+def create_detector(backend: str = None) -> Detector:
+    """
+    Create a new detector of a backend, bypassing the cache.
+
+    Parameters:
+    backend (str): A registered backend. Defaults to the DETECTOR_BACKEND environment variable, then "custom_vision".
+
+    Returns:
+    Detector: The detector.
+
+    Raises:
+    ValueError: If the backend is not registered.
+    """
+    backend = backend or os.getenv("DETECTOR_BACKEND", "custom_vision")
+    with _lock:
+        factory = _factories.get(backend)
+    if factory is None:
+        raise ValueError(f"Unknown detector backend {backend}, expected one of {get_backends()}")
+    start = time.perf_counter()
+    detector = factory()
+    log.info(f"Created the {backend} detector in {time.perf_counter() - start:.2f}s")
+    return detector
+
+
+def get_detector(backend: str = None, use_cache: bool = None) -> Detector:
+    """
+    Return the process wide detector of a backend, creating it on first use. See create_detector.
+
+    Parameters:
+    backend (str): A registered backend. Defaults to the DETECTOR_BACKEND environment variable, then "custom_vision".
+    use_cache (bool): Answer repeated detections of the same image from the persistent DetectionCache. Only applies to
+        detectors with a cache identity. Defaults to the DETECTION_CACHE environment variable, then true.
+    """
+    backend = backend or os.getenv("DETECTOR_BACKEND", "custom_vision")
+    if use_cache is None:
+        use_cache = os.getenv("DETECTION_CACHE", "true").lower() == "true"
+    with _lock:
+        detector = _detectors.get((backend, use_cache))
+    if detector is None:
+        detector = create_detector(backend)
+        if use_cache and detector.get_cache_identity() is not None:
+            from detection.cache import CachedDetector, DetectionCache
+
+            detector = CachedDetector(
+                detector,
+                DetectionCache(
+                    ttl_hours=float(os.getenv("DETECTION_CACHE_TTL_HOURS", "720")),
+                    max_entries=int(os.getenv("DETECTION_CACHE_MAX_ENTRIES", "10000")),
+                ),
+            )
+        with _lock:
+            detector = _detectors.setdefault((backend, use_cache), detector)
+    return detector
+
+
+def reset_detectors():
+    """
+    Drop the cached detectors, e.g. after the configuration changed.
+    """
+    with _lock:
+        _detectors.clear()
+
+
+def _create_custom_vision_detector() -> Detector:
+    from detection.custom_vision import CustomVisionDetector
+
+    return CustomVisionDetector()
+
+
+def _create_onnx_detector() -> Detector:
+    from detection.onnx_detector import OnnxDetector
+
+    return OnnxDetector()
+
+
+def _create_fake_detector() -> Detector:
+    from detection.fake import FakeDetector
+
+    return FakeDetector(os.getenv("DETECTOR_RECORDINGS") or directories.detection_recordings_file)
+
+
+def _create_recording_detector() -> Detector:
+    from detection.fake import FakeDetector, RecordingDetector
+
+    return RecordingDetector(
+        create_detector(os.getenv("DETECTOR_RECORD_FROM", "custom_vision")),
+        FakeDetector(os.getenv("DETECTOR_RECORDINGS") or directories.detection_recordings_file),
+    )
+
+
+register_backend("custom_vision", _create_custom_vision_detector)
+register_backend("onnx", _create_onnx_detector)
+register_backend("fake", _create_fake_detector)
+register_backend("record", _create_recording_detector)
@@ -0,0 +1,99 @@
+import logging
+import math
+import os
+from io import BytesIO
+
+from PIL import Image
+
+log = logging.getLogger(__name__)
+
+JPEG_QUALITIES = (95, 90, 85, 80, 75, 70, 60, 50)
+# Images are not shrunk below this longest edge to fit the byte budget, small print would no longer be detected.
+MIN_UPLOAD_EDGE = 256
+
+
+def encode(image: Image.Image, image_format: str, quality: int = None) -> bytes:
+    with BytesIO() as byte_io:
+        if image_format == "JPEG":
+            image.save(byte_io, format="JPEG", quality=quality, optimize=True)
+        else:
+            image.save(byte_io, format="PNG")
+        return byte_io.getvalue()
+
+
+def resize_to_max_edge(image: Image.Image, max_edge: int) -> Image.Image:
+    """
+    Shrink an image so its longest edge is at most `max_edge` pixels, keeping the aspect ratio. Smaller images are
+    returned as they are.
+    """
+    (width, height) = image.size
+    scale = max_edge / max(width, height)
+    if scale >= 1:
+        return image
+    return image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+
+
+def encode_within(image: Image.Image, max_bytes: int, min_jpeg_quality: int) -> tuple:
+    """
+    Encode an image as a lossless PNG when that fits in `max_bytes`, else as the smaller of the PNG and the best
+    quality JPEG (down to `min_jpeg_quality`) that fits, or the JPEG at `min_jpeg_quality` when none fits.
+
+    Returns:
+    tuple: The encoded bytes, the format and the JPEG quality (None for PNG).
+    """
+    png = encode(image, "PNG")
+    candidates = [(png, "PNG", None)]
+    if len(png) > max_bytes:
+        qualities = [quality for quality in JPEG_QUALITIES if quality >= min_jpeg_quality] or [min_jpeg_quality]
+        for quality in qualities:
+            jpeg = encode(image, "JPEG", quality)
+            if len(jpeg) <= max_bytes or quality == qualities[-1]:
+                candidates.append((jpeg, "JPEG", quality))
+                break
+    return min(candidates, key=lambda candidate: len(candidate[0]))
+
+
+def prepare_upload(
+        image: Image.Image, max_edge: int = None, max_bytes: int = None, min_jpeg_quality: int = 70
+) -> tuple[bytes, dict]:
+    """
+    Prepare an image for a remote detection request: shrink it to `max_edge` and encode it as a lossless PNG when that
+    fits in `max_bytes`, else as the smaller of the PNG and the best quality JPEG (down to `min_jpeg_quality`) that
+    fits, see encode_within. When no quality fits, the image is shrunk further until it does, but not below
+    MIN_UPLOAD_EDGE; an upload still over the budget then is sent anyway with a warning. Detection boxes are
+    normalised to the image size, so they map straight back onto the original image.
+
+    Parameters:
+    image (PIL.Image.Image): The image, e.g. the monochrome image from `convert_to_monochrome`.
+    max_edge (int): The longest edge in pixels. Defaults to the DETECTION_MAX_EDGE environment variable, then 1024.
+    max_bytes (int): The byte budget of the upload. Defaults to the DETECTION_MAX_UPLOAD_KB environment variable,
+        then 256 KB.
+    min_jpeg_quality (int): The lowest JPEG quality used to fit the budget.
+
+    Returns:
+    tuple: The encoded bytes, and a dict with the "format", "quality", "size" and "bytes" that were sent, and whether
+    the upload is "over_budget".
+    """
+    max_edge = max_edge or int(os.getenv("DETECTION_MAX_EDGE", "1024"))
+    max_bytes = max_bytes or int(float(os.getenv("DETECTION_MAX_UPLOAD_KB", "256")) * 1024)
+    if image.mode not in ("L", "RGB"):
+        image = image.convert("RGB")
+    resized = resize_to_max_edge(image, max_edge)
+    (data, image_format, quality) = encode_within(resized, max_bytes, min_jpeg_quality)
+    while len(data) > max_bytes and max(resized.size) > MIN_UPLOAD_EDGE:
+        # The encoded size roughly follows the pixel count, shrink by the square root of the excess with some margin.
+        scale = min(0.9, math.sqrt(max_bytes / len(data)) * 0.95)
+        resized = resize_to_max_edge(image, max(MIN_UPLOAD_EDGE, int(max(resized.size) * scale)))
+        (data, image_format, quality) = encode_within(resized, max_bytes, min_jpeg_quality)
+    over_budget = len(data) > max_bytes
+    if over_budget:
+        log.warning(
+            f"The {resized.size[0]}x{resized.size[1]} upload takes {len(data)} bytes, over the budget of {max_bytes}"
+        )
+    return data, {
+        "format": image_format,
+        "quality": quality,
+        "size": resized.size,
+        "bytes": len(data),
+        "over_budget": over_budget,
+    }
@@ -12,6 +12,13 @@ big_lama_model_dir = os.path.join(os.path.dirname(base_dir), "big-lama")
 models_dir = os.path.join(base_dir, "models")
 fonts_dir = os.path.join(base_dir, "fonts")
 torch_home = os.path.join(base_dir, "torch_home")
+sample_images_dir = os.path.join(os.path.dirname(base_dir), "sample_images")
+thread_budget_file = os.path.join(base_dir, "thread_budget.json")
+cache_dir = os.path.join(base_dir, "cache")
+inpaint_cache_dir = os.path.join(cache_dir, "inpaint")
+detector_model_dir = os.path.join(models_dir, "custom_vision")
+detection_recordings_file = os.path.join(base_dir, "detection_recordings.json")
+batch_manifest_file = os.path.join(base_dir, "batch_manifest.jsonl")
 print(f"base_dir: {base_dir}  ")
 print(f"pack_dir: {pack_dir}")
 print(f"mrhi_dir: {mrhi_dir}")
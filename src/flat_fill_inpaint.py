@@ -0,0 +1,232 @@
+import logging
+import time
+
+import cv2
+import numpy as np
+
+import directories
+from inpaint import Inpainter, inpaint_directory
+from roi_inpaint import inpaint_regions
+
+log = logging.getLogger(__name__)
+
+ROUTES = ("flat", "gradient", "smooth", "lama")
+SMOOTH_METHODS = {"telea": cv2.INPAINT_TELEA, "ns": cv2.INPAINT_NS}
+
+
+def fit_gradient(coordinates: np.ndarray, colors: np.ndarray) -> tuple[np.ndarray, float]:
+    """
+    Fit a linear colour gradient c = a * x + b * y + d per channel to the given pixels.
+
+    Parameters:
+    coordinates (numpy.ndarray): Nx2 (x, y) pixel coordinates.
+    colors (numpy.ndarray): Nx3 colours of those pixels.
+
+    Returns:
+    tuple: The 3x3 coefficients (one column per channel) and the largest per channel residual standard deviation.
+    """
+    design = np.column_stack([coordinates.astype(np.float64), np.ones(len(coordinates))])
+    (coefficients, _, _, _) = np.linalg.lstsq(design, colors.astype(np.float64), rcond=None)
+    residuals = colors - design @ coefficients
+    return coefficients, float(residuals.std(axis=0).max())
+
+
+class FlatFillInpainter(Inpainter):
+    def __init__(
+            self,
+            fallback: Inpainter = None,
+            abs_input_dir: str = None,
+            abs_output_dir: str = None,
+            img_suffix: str = ".png",
+            ring_width: int = 8,
+            flat_std: float = 4.0,
+            gradient_residual: float = 4.0,
+            smooth_std: float = 12.0,
+            smooth_method: str = "telea",
+            roi_margin: int = 128,
+    ):
+        """
+        Inpainter for the single colour backgrounds LaMa is mostly used on. For every connected mask region it looks at
+        a ring of background pixels around the region and picks the cheapest fill that fits:
+
+        - "flat": the ring is uniform, the region is filled with its mean colour.
+        - "gradient": the ring follows a linear colour gradient, the region is filled with the fitted gradient.
+        - "smooth": the ring is smooth but not linear, the region is filled with OpenCV's Telea or Navier-Stokes
+          inpainting.
+        - "lama": the ring is textured, the region is cropped with `roi_margin` pixels of context and handed to the
+          fallback inpainter.
+
+        Routing decisions and timings are kept per region in `last_routes` and summed up by `routing_stats`.
+
+        Args:
+            fallback (Inpainter, optional): The inpainter used for textured regions. Defaults to a LamaInpainter for
+                the big-lama model.
+            abs_input_dir (str, optional): The absolute path of the input directory. Not needed for in-memory inpainting.
+            abs_output_dir (str, optional): The absolute path of the output directory. Not needed for in-memory inpainting.
+            img_suffix (str, optional): The suffix for the image files. Defaults to ".png".
+            ring_width (int, optional): The width in pixels of the background ring measured around a region. Defaults to 8.
+            flat_std (float, optional): The largest per channel standard deviation of a uniform ring. Defaults to 4.0.
+            gradient_residual (float, optional): The largest residual standard deviation of a gradient fit. Defaults to 4.0.
+            smooth_std (float, optional): The largest ring standard deviation filled with OpenCV. Defaults to 12.0.
+            smooth_method (str, optional): The OpenCV inpainting method, "telea" or "ns". Defaults to "telea".
+            roi_margin (int, optional): The context margin kept around regions sent to the fallback. Defaults to 128.
+        """
+        if smooth_method not in SMOOTH_METHODS:
+            raise ValueError(f"Unknown smooth method {smooth_method}, expected one of {tuple(SMOOTH_METHODS)}")
+        self._fallback = fallback
+        self.abs_input_dir = abs_input_dir
+        self.abs_output_dir = abs_output_dir
+        self.img_suffix = img_suffix
+        self.ring_width = ring_width
+        self.flat_std = flat_std
+        self.gradient_residual = gradient_residual
+        self.smooth_std = smooth_std
+        self.smooth_method = smooth_method
+        self.roi_margin = roi_margin
+        self.last_routes: list[dict] = []
+        self.route_totals = {route: {"regions": 0, "pixels": 0, "seconds": 0.0} for route in ROUTES}
+
+    @property
+    def fallback(self) -> Inpainter:
+        if self._fallback is None:
+            from inpaint_lama import LamaInpainter
+
+            self._fallback = LamaInpainter(str(directories.big_lama_model_dir))
+        return self._fallback
+
+    def get_cache_identity(self) -> dict:
+        """
+        Describes the settings that determine the result, see LamaInpainter.get_cache_identity.
+        """
+        identity = {
+            "engine": "flat",
+            "ring_width": self.ring_width,
+            "flat_std": self.flat_std,
+            "gradient_residual": self.gradient_residual,
+            "smooth_std": self.smooth_std,
+            "smooth_method": self.smooth_method,
+            "roi_margin": self.roi_margin,
+        }
+        fallback_identity = getattr(self.fallback, "get_cache_identity", None)
+        if fallback_identity is not None:
+            identity["fallback"] = fallback_identity()
+        return identity
+
+    def inpaint(self):
+        """
+        Inpaints the image and mask pairs of the input directory and writes the results to the output directory.
+
+        Returns:
+            list[str]: A list of file paths to the generated images.
+        """
+        return inpaint_directory(self, self.abs_input_dir, self.abs_output_dir, self.img_suffix)
+
+    def route_region(self, image: np.ndarray, masked: np.ndarray, region: np.ndarray) -> tuple[str, object]:
+        """
+        Decide how a region is filled from the background ring around it.
+
+        Args:
+            image (np.ndarray): The BGR image, cropped around the region.
+            masked (np.ndarray): Every masked pixel of the crop.
+            region (np.ndarray): The pixels of the region being routed.
+
+        Returns:
+            tuple: The route and the fill parameters (the mean colour or the gradient coefficients), or None.
+        """
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * self.ring_width + 1, 2 * self.ring_width + 1))
+        ring = cv2.dilate(region.astype(np.uint8), kernel).astype(bool) & ~masked
+        if ring.sum() < 3:
+            return "lama", None
+        colors = image[ring].astype(np.float64)
+        ring_std = float(colors.std(axis=0).max())
+        if ring_std <= self.flat_std:
+            return "flat", colors.mean(axis=0)
+        (ys, xs) = np.nonzero(ring)
+        (coefficients, residual) = fit_gradient(np.column_stack([xs, ys]), colors)
+        if residual <= self.gradient_residual:
+            return "gradient", coefficients
+        if ring_std <= self.smooth_std:
+            return "smooth", None
+        return "lama", None
+
+    def inpaint_array(self, image: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        """
+        Inpaints a single in-memory image, routing every mask region to the cheapest fill that suits it.
+
+        Args:
+            image (np.ndarray): The HxWx3 uint8 BGR image, as returned by cv2.imread.
+            mask (np.ndarray): The HxW uint8 mask. Non zero pixels are inpainted.
+
+        Returns:
+            np.ndarray: The inpainted HxWx3 uint8 BGR image.
+        """
+        result = image.copy()
+        masked = mask > 0
+        (height, width) = masked.shape
+        (num_labels, labels, stats, _) = cv2.connectedComponentsWithStats(masked.astype(np.uint8), connectivity=8)
+        lama_mask = np.zeros_like(mask)
+        self.last_routes = []
+        pad = self.ring_width + 1
+        for label in range(1, num_labels):
+            start = time.perf_counter()
+            (x, y, w, h, area) = stats[label]
+            (x1, y1) = (max(0, x - pad), max(0, y - pad))
+            (x2, y2) = (min(width, x + w + pad), min(height, y + h + pad))
+            crop = result[y1:y2, x1:x2]
+            region = labels[y1:y2, x1:x2] == label
+            (route, fill) = self.route_region(crop, masked[y1:y2, x1:x2], region)
+            if route == "flat":
+                crop[region] = np.clip(np.round(fill), 0, 255).astype(np.uint8)
+            elif route == "gradient":
+                (ys, xs) = np.nonzero(region)
+                design = np.column_stack([xs, ys, np.ones(len(xs))])
+                crop[region] = np.clip(np.round(design @ fill), 0, 255).astype(np.uint8)
+            elif route == "smooth":
+                filled = cv2.inpaint(crop, region.astype(np.uint8) * 255, 3, SMOOTH_METHODS[self.smooth_method])
+                crop[region] = filled[region]
+            else:
+                lama_mask[y1:y2, x1:x2][region] = 255
+            self.last_routes.append(
+                {"route": route, "pixels": int(area), "seconds": time.perf_counter() - start}
+            )
+        if lama_mask.any():
+            start = time.perf_counter()
+            fallback = self.fallback
+            predict_arrays = getattr(fallback, "inpaint_arrays", None) or (
+                lambda images, masks: [fallback.inpaint_array(i, m) for (i, m) in zip(images, masks)]
+            )
+            result = inpaint_regions(predict_arrays, result, lama_mask, self.roi_margin)
+            lama_routes = [route for route in self.last_routes if route["route"] == "lama"]
+            for route in lama_routes:
+                route["seconds"] += (time.perf_counter() - start) / len(lama_routes)
+        for route in self.last_routes:
+            totals = self.route_totals[route["route"]]
+            totals["regions"] += 1
+            totals["pixels"] += route["pixels"]
+            totals["seconds"] += route["seconds"]
+        log.info(f"Routed {len(self.last_routes)} region(s): {self.routing_stats(self.last_routes)}")
+        return result
+
+    def routing_stats(self, routes: list[dict] = None) -> dict:
+        """
+        Summarise routing decisions: regions, masked pixels and seconds per route, and the share of the masked area
+        that did not need the fallback.
+
+        Args:
+            routes (list[dict], optional): The per region decisions to summarise. Defaults to every region routed by
+                this inpainter so far.
+
+        Returns:
+            dict: The per route totals and "saved_pixel_share".
+        """
+        if routes is None:
+            totals = {route: dict(values) for route, values in self.route_totals.items()}
+        else:
+            totals = {route: {"regions": 0, "pixels": 0, "seconds": 0.0} for route in ROUTES}
+            for route in routes:
+                totals[route["route"]]["regions"] += 1
+                totals[route["route"]]["pixels"] += route["pixels"]
+                totals[route["route"]]["seconds"] += route["seconds"]
+        all_pixels = sum(values["pixels"] for values in totals.values())
+        totals["saved_pixel_share"] = 1 - totals["lama"]["pixels"] / all_pixels if all_pixels else 0.0
+        return totals
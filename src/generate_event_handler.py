@@ -65,7 +65,7 @@ def off_pack_generate_clicked(
             return (io.BytesIO(open(result_image_path, "rb").read()), evaluation_dict)
 
 
-def on_pack_generate_clicked(original_image, original_mrhi_image, text_input: str):
+def on_pack_generate_clicked(original_image, original_mrhi_image, text_input: str, inpaint_mode: str = None, run_info: dict = None):
     '''"""
     This function is triggered when the 'pack generate' button is clicked. It takes an original image, an original MRHI image, and a text input as arguments.
 
@@ -77,6 +77,8 @@ def on_pack_generate_clicked(original_image, original_mrhi_image, text_input: st
         original_image: The original image file.
         original_mrhi_image: The original MRHI image file.
         text_input (str): The text input.
+        inpaint_mode (str, optional): The inpainting mode passed on to 'run_onpack_process', e.g. "fast" for a preview.
+        run_info (dict, optional): Filled by 'onpack.generate_onpack' with what happened to the image, see 'run_onpack_process'.
 
     Returns:
         The result of the 'run_onpack_process' function.
@@ -95,6 +97,8 @@ def on_pack_generate_clicked(original_image, original_mrhi_image, text_input: st
                 mrhi_dir=Path(mrhi_dir),
                 original_mrhi_image=original_mrhi_image,
                 text_input=text_input,
+                inpaint_mode=inpaint_mode,
+                run_info=run_info,
             )
 
 
@@ -109,6 +113,8 @@ def run_onpack_process(
         should_evaluate=os.getenv("EVALUATE", "False").lower() == "true",
         final_mask_dir: str = directories.generated_mask_dir,
         final_output_dir: str = directories.generated_dir,
+        inpaint_mode: str = None,
+        run_info: dict = None,
 ):
     '''"""
     This function runs the on-pack process which includes generating an on-pack image, validating and evaluating the generated image.
@@ -124,6 +130,8 @@ def run_onpack_process(
         should_evaluate (bool, optional): A flag to determine if the generated image should be evaluated. Defaults to the value of the environment variable "EVALUATE".
         final_mask_dir (str, optional): The directory where the final mask images are stored. Defaults to directories.generated_mask_dir.
         final_output_dir (str, optional): The directory where the final output images are stored. Defaults to directories.generated_dir.
+        inpaint_mode (str, optional): The inpainting mode used by 'onpack.generate_onpack'. Defaults to its own default.
+        run_info (dict, optional): Filled by 'onpack.generate_onpack' with the mask coverage, whether inpainting was done or skipped, the memory governor decisions and, with the flat engine, the per region routing statistics.
 
     Raises:
         Exception: If CUDA is not available and the environment variable "USE_LAMA" is not set to true.
@@ -131,6 +139,7 @@ def run_onpack_process(
     Returns:
         tuple: A tuple containing the BytesIO object of the generated image, the validation results, and the evaluation results.
     """'''
+    onpack_kwargs = {} if inpaint_mode is None else {"inpaint_mode": inpaint_mode}
     copied_file_location = onpack.generate_onpack(
         orignal_file=original_file_path,
         bottom_text=text_input,
@@ -138,6 +147,8 @@ def run_onpack_process(
         temp_generated_dir=generated_dir,
         final_mask_dir=final_mask_dir,
         final_output_dir=final_output_dir,
+        run_info=run_info,
+        **onpack_kwargs,
     )
     validation_results = {}
     evaluation_result = {}
@@ -1,5 +1,13 @@
+import glob
+import logging
+import os
 from abc import ABC
 
+import cv2
+import numpy as np
+
+log = logging.getLogger(__name__)
+
 
 class Inpainter(ABC):
     def inpaint(self):
@@ -10,3 +18,51 @@ class Inpainter(ABC):
             NotImplementedError: This method is not yet implemented.
         """
         raise NotImplementedError
+
+    def inpaint_array(self, image: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        """
+        This method is intended to perform inpainting on an in-memory image without going through the file system.
+
+        Args:
+            image (np.ndarray): The HxWx3 uint8 BGR image, as returned by cv2.imread.
+            mask (np.ndarray): The HxW uint8 mask. Non zero pixels are inpainted.
+
+        Returns:
+            np.ndarray: The inpainted HxWx3 uint8 BGR image.
+
+        Raises:
+            NotImplementedError: This method is not implemented by the inpainter.
+        """
+        raise NotImplementedError
+
+
+def inpaint_directory(inpainter: Inpainter, abs_input_dir: str, abs_output_dir: str, img_suffix: str) -> list[str]:
+    """
+    Inpaints the image and mask pairs of a directory in memory with the given inpainter and writes the results to the
+    output directory. Files are paired and named the way the lama prediction script does it: every `*mask*.png` is
+    matched with the image sharing its name up to `_mask`, and the result is written under the mask's name.
+
+    Args:
+        inpainter (Inpainter): The inpainter whose `inpaint_array` is used.
+        abs_input_dir (str): The absolute path of the input directory.
+        abs_output_dir (str): The absolute path of the output directory.
+        img_suffix (str): The suffix for the image files.
+
+    Returns:
+        list[str]: A list of file paths to the generated images.
+    """
+    mask_fnames = sorted(glob.glob(os.path.join(abs_input_dir, "**", "*mask*.png"), recursive=True))
+    generated_images = []
+    for mask_fname in mask_fnames:
+        img_fname = mask_fname.rsplit("_mask", 1)[0] + img_suffix
+        image = cv2.imread(img_fname)
+        mask = cv2.imread(mask_fname, cv2.IMREAD_GRAYSCALE)
+        cur_out_fname = os.path.join(
+            abs_output_dir,
+            os.path.splitext(os.path.relpath(mask_fname, abs_input_dir))[0] + ".png",
+        )
+        os.makedirs(os.path.dirname(cur_out_fname), exist_ok=True)
+        cv2.imwrite(cur_out_fname, inpainter.inpaint_array(image, mask))
+        generated_images.append(cur_out_fname)
+        log.info(f"Saved {cur_out_fname}")
+    return generated_images
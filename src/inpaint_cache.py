@@ -0,0 +1,171 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+
+import cv2
+import numpy as np
+
+import directories
+
+log = logging.getLogger(__name__)
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def hash_array(digest, array: np.ndarray):
+    """
+    Feed an array's shape, dtype and bytes into a hashlib digest.
+    """
+    digest.update(f"{array.shape}:{array.dtype}".encode())
+    digest.update(np.ascontiguousarray(array).tobytes())
+
+
+class InpaintCache:
+    def __init__(self, cache_dir: str = directories.inpaint_cache_dir, max_mb: float = 1024):
+        """
+        An on-disk cache of inpainting results, addressed by the content of the image and mask and by the identity of
+        the inpainter (checkpoint and settings). Results are stored as PNG files and the least recently used ones are
+        evicted once the cache grows beyond `max_mb`.
+
+        Args:
+            cache_dir (str, optional): The directory the results are stored in. Defaults to directories.inpaint_cache_dir.
+            max_mb (float, optional): The size the cache is trimmed to after every insert. Defaults to 1024.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_mb * 2 ** 20)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(image: np.ndarray, mask: np.ndarray, identity: dict) -> str:
+        """
+        Build the cache key of an inpainting request.
+
+        Args:
+            image (np.ndarray): The image to be inpainted.
+            mask (np.ndarray): Its mask.
+            identity (dict): The checkpoint identity and inpainting settings, see LamaInpainter.get_cache_identity.
+
+        Returns:
+            str: The hex SHA-256 key.
+        """
+        digest = hashlib.sha256()
+        hash_array(digest, image)
+        hash_array(digest, mask)
+        digest.update(json.dumps(identity, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.png")
+
+    def get(self, key: str) -> np.ndarray:
+        """
+        Look a result up and mark it as recently used.
+
+        Returns:
+            np.ndarray: The cached BGR result, or None on a miss.
+        """
+        path = self._path(key)
+        result = cv2.imread(path) if os.path.exists(path) else None
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if result is not None:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                # Evicted by another thread since it was read, the result read is still valid.
+                pass
+        log.info(f"Inpaint cache {'hit' if result is not None else 'miss'} for {key[:12]}, {self.stats()}")
+        return result
+
+    def put(self, key: str, result: np.ndarray):
+        """
+        Store a result and evict the least recently used entries if the cache grew too large.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        (ok, encoded) = cv2.imencode(".png", result)
+        if not ok:
+            log.warning(f"Could not encode the result for {key[:12]}, not caching it")
+            return
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(encoded.tobytes())
+        os.replace(temp_path, path)
+        self.evict()
+
+    def _entries(self) -> list[tuple]:
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for file in files:
+                if file.endswith(".png"):
+                    try:
+                        stat = os.stat(os.path.join(root, file))
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, os.path.join(root, file)))
+        return entries
+
+    def evict(self) -> int:
+        """
+        Delete the least recently used results until the cache fits in its size limit.
+
+        Returns:
+            int: The number of results deleted.
+        """
+        entries = sorted(self._entries())
+        total = sum(size for (_, size, _) in entries)
+        evicted = 0
+        for (_, size, path) in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        if evicted:
+            log.info(f"Evicted {evicted} inpaint cache entries")
+        return evicted
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: The hits, misses and hit rate since the cache was created.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def usage(self) -> dict:
+        """
+        Returns:
+            dict: The number of cached results and their total size in bytes. Walks the cache directory.
+        """
+        entries = self._entries()
+        return {"entries": len(entries), "bytes": sum(size for (_, size, _) in entries)}
+
+
+def get_default_cache() -> InpaintCache:
+    """
+    Returns the process wide cache, sized by the INPAINT_CACHE_MAX_MB environment variable (default 1024).
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = InpaintCache(max_mb=float(os.getenv("INPAINT_CACHE_MAX_MB", "1024")))
+        return _default_cache
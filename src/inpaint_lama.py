@@ -1,86 +1,452 @@
+import glob
+import itertools
 import logging
+import math
 import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator
 
 import cv2
 import numpy as np
 import torch
 import tqdm
-import yaml
 from omegaconf import OmegaConf
+from PIL import Image
+from saicinpainting.evaluation.data import ceil_modulo
 from saicinpainting.evaluation.refinement import refine_predict
 from saicinpainting.evaluation.utils import move_to_device
 from saicinpainting.training.data.datasets import make_default_val_dataset
-from saicinpainting.training.trainers import load_checkpoint
 from torch.utils.data._utils.collate import default_collate
 
 import directories
-from inpaint import Inpainter
+from coarse_inpaint import inpaint_coarse_to_fine
+from inpaint import Inpainter, inpaint_directory
+from model_registry import PRECISIONS, LoadedModel, ModelRegistry, registry as default_registry
+from roi_inpaint import inpaint_regions
+from thread_budget import apply_thread_budget
+from tiled_inpaint import get_memory_bounded_tile_size, inpaint_tiled
 
-os.environ["OMP_NUM_THREADS"] = "1"
-os.environ["OPENBLAS_NUM_THREADS"] = "1"
-os.environ["MKL_NUM_THREADS"] = "1"
-os.environ["VECLIB_MAXIMUM_THREADS"] = "1"
-os.environ["NUMEXPR_NUM_THREADS"] = "1"
 log = logging.getLogger(__name__)
 
+# Rough fp32 activation footprint of big-lama per input pixel, used to keep batches within a memory cap. Not calibrated
+# against a measured peak RSS, so the memory caps built on it are opt-in.
+ACTIVATION_BYTES_PER_PIXEL = 1536
+INPAINT_MODES = ("full", "roi", "tiled", "fast")
+PAD_POLICIES = ("modulo", "fft")
+
 
 class LamaInpainter(Inpainter):
     def __init__(
             self,
             abs_model_path: str,
-            abs_input_dir: str,
-            abs_output_dir: str,
-            img_suffix: str,
+            abs_input_dir: str = None,
+            abs_output_dir: str = None,
+            img_suffix: str = ".png",
+            registry: ModelRegistry = None,
+            batch_size: int = 1,
+            max_batch_memory_mb: float = None,
+            mode: str = "full",
+            roi_margin: int = 128,
+            tile_size: int = 1024,
+            tile_overlap: int = 128,
+            fast_scale: float = 0.5,
+            fast_refine: bool = False,
+            precision: str = "fp32",
+            num_threads: int = None,
+            num_interop_threads: int = None,
+            prefetch: int = 2,
+            pad_policy: str = "modulo",
+            max_image_memory_mb: float = None,
     ):
         '''"""
         Initializes the instance variables of the class.
 
         Args:
             abs_model_path (str): The absolute path of the model.
-            abs_input_dir (str): The absolute path of the input directory.
-            abs_output_dir (str): The absolute path of the output directory.
-            img_suffix (str): The suffix for the image files.
+            abs_input_dir (str, optional): The absolute path of the input directory. Not needed for in-memory inpainting.
+            abs_output_dir (str, optional): The absolute path of the output directory. Not needed for in-memory inpainting.
+            img_suffix (str, optional): The suffix for the image files. Defaults to ".png".
+            registry (ModelRegistry, optional): The registry holding loaded checkpoints. Defaults to the process wide registry.
+            batch_size (int, optional): The maximum number of same sized images run through the model at once. Defaults to 1.
+            max_batch_memory_mb (float, optional): The estimated activation memory a batch may use. Defaults to no cap.
+            mode (str, optional): How images are inpainted, one of INPAINT_MODES. "full" runs the model over the whole
+                frame, "roi" crops the masked regions with `roi_margin` pixels of context and inpaints only those,
+                "tiled" splits the image into overlapping tiles and inpaints the tiles holding mask pixels, "fast"
+                inpaints a downscaled copy and composites the upsampled fill into the masked region. Defaults to "full".
+            roi_margin (int, optional): The context margin in pixels kept around each masked region in "roi" mode.
+                Defaults to 128.
+            tile_size (int, optional): The tile side length in "tiled" mode. It is shrunk further when a single tile
+                would exceed `max_batch_memory_mb`. Defaults to 1024.
+            tile_overlap (int, optional): The number of pixels neighbouring tiles share and are feathered over in
+                "tiled" mode. Defaults to 128.
+            fast_scale (float, optional): The scale the image is inpainted at in "fast" mode. Defaults to 0.5.
+            fast_refine (bool, optional): Sharpen and feather the upsampled fill at full resolution in "fast" mode.
+                Defaults to False.
+            precision (str, optional): One of PRECISIONS. "int8" dynamically quantises the generator's linear
+                layers (convolutions stay fp32, and loading fails for generators without linear layers such as big-lama's, see `quantize_generator`), "bf16" runs the generator under bfloat16 autocast on CPUs that support it and falls back to
+                fp32 elsewhere. Defaults to "fp32".
+            num_threads (int, optional): The PyTorch intra-op thread count applied when the inpainter is created.
+                Defaults to INPAINT_NUM_THREADS, then the value tuned for this host by thread_budget.py, then all cores.
+            num_interop_threads (int, optional): The PyTorch inter-op thread count. Only takes effect the first time
+                it is set in a process. Defaults to PyTorch's choice.
+            prefetch (int, optional): How many batches 'run_prediction' loads ahead while the model runs, and roughly
+                how many results may wait for the background writer. 0 runs every stage in turn. Defaults to 2.
+            pad_policy (str, optional): One of PAD_POLICIES. "modulo" pads the input to the dataset's
+                `pad_out_to_modulo`, "fft" pads it further to the nearest size whose Fourier convolutions only see 2, 3
+                and 5 as prime factors, see `get_pad_size`. Defaults to "modulo".
+            max_image_memory_mb (float, optional): The estimated activation memory a single model input may use.
+                Larger inputs are inpainted at a lower resolution that fits, and only the upsampled fill of the masked
+                region is composited back into the full resolution image. The decision taken for every input is kept
+                in `last_memory_decisions`. Defaults to no limit.
+
+        Raises:
+            ValueError: If the mode is not one of INPAINT_MODES, the precision is not one of PRECISIONS or the padding
+                policy is not one of PAD_POLICIES.
         """'''
+        if mode not in INPAINT_MODES:
+            raise ValueError(f"Unknown inpainting mode {mode}, expected one of {INPAINT_MODES}")
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision {precision}, expected one of {PRECISIONS}")
+        if pad_policy not in PAD_POLICIES:
+            raise ValueError(f"Unknown padding policy {pad_policy}, expected one of {PAD_POLICIES}")
         self.abs_model_path = abs_model_path
         self.abs_input_dir = abs_input_dir
         self.abs_output_dir = abs_output_dir
         self.img_suffix = img_suffix
+        self.registry = registry if registry is not None else default_registry
+        self.batch_size = batch_size
+        self.max_batch_memory_mb = max_batch_memory_mb
+        self.mode = mode
+        self.roi_margin = roi_margin
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.fast_scale = fast_scale
+        self.fast_refine = fast_refine
+        self.precision = precision
+        self.num_threads = apply_thread_budget(num_threads, num_interop_threads)
+        self.prefetch = prefetch
+        self.pad_policy = pad_policy
+        self.max_image_memory_mb = max_image_memory_mb
+        self._local = threading.local()
+        self.last_load_seconds = 0.0
+        self.last_inference_seconds = 0.0
+        self.predict_config = self.build_predict_config()
 
-    def inpaint(self):
+    def build_predict_config(self) -> OmegaConf:
         '''"""
-        This method is used to perform inpainting on images. It first logs the absolute paths of the model, input directory, output directory, and image suffix. Then, it loads the default configuration file for prediction from 'lama-configs/prediction/default.yaml'. After that, it updates the model path, input directory, output directory, and image suffix in the configuration with the respective absolute paths. Finally, it calls the 'run_prediction' function with the updated configuration.
-
-        Parameters:
-        None
+        Loads the default lama prediction configuration and fills in the model path, input directory, output directory,
+        image suffix and device of this inpainter. Built once, when the inpainter is created, and kept in
+        `predict_config`.
 
         Returns:
-        The result of the 'run_prediction' function.
+            OmegaConf: The prediction configuration.
         """'''
-        log.info(
-            f"abs_model_path: {self.abs_model_path}, abs_input_dir: {self.abs_input_dir}, abs_output_dir: {self.abs_output_dir}, img_suffix: {self.img_suffix}"
-        )
-        from omegaconf import OmegaConf
-
         omega_conf = OmegaConf.load(os.path.join(directories.third_party_dir, "lama", "configs", "prediction", "default.yaml"))
         omega_conf.model.path = self.abs_model_path
         omega_conf.indir = self.abs_input_dir
         omega_conf.outdir = self.abs_output_dir
         omega_conf.dataset.img_suffix = self.img_suffix
+        omega_conf.batch_size = self.batch_size
+        omega_conf.max_batch_memory_mb = self.max_batch_memory_mb
+        omega_conf.precision = self.precision
+        omega_conf.prefetch = self.prefetch
+        omega_conf.pad_policy = self.pad_policy
         if torch.cuda.is_available():
             log.info("CUDA is available, using GPU")
             omega_conf.device = "cuda"
         else:
             log.info("CUDA is not available, using CPU")
             omega_conf.device = "cpu"
-        return run_prediction(omega_conf)
+        return omega_conf
+
+    def get_cache_identity(self) -> dict:
+        '''"""
+        Describes everything besides the image and mask that determines the inpainted result: the checkpoint (path,
+        size and modification time) and the settings that change the output. Used to key cached results.
+
+        Returns:
+            dict: The identity of this inpainter's results.
+        """'''
+        predict_config = self.predict_config
+        checkpoint_path = os.path.join(self.abs_model_path, "models", predict_config.model.checkpoint)
+        checkpoint_stat = os.stat(checkpoint_path)
+        identity = {
+            "checkpoint": os.path.abspath(checkpoint_path),
+            "checkpoint_size": checkpoint_stat.st_size,
+            "checkpoint_mtime": checkpoint_stat.st_mtime,
+            "pad_out_to_modulo": predict_config.dataset.get("pad_out_to_modulo", None),
+            "mode": self.mode,
+            "precision": self.precision,
+            "pad_policy": self.pad_policy,
+            "max_image_memory_mb": self.max_image_memory_mb,
+        }
+        if self.mode == "roi":
+            identity["roi_margin"] = self.roi_margin
+        elif self.mode == "tiled":
+            identity.update(tile_size=self.tile_size, tile_overlap=self.tile_overlap, max_batch_memory_mb=self.max_batch_memory_mb)
+        elif self.mode == "fast":
+            identity.update(fast_scale=self.fast_scale, fast_refine=self.fast_refine)
+        return identity
+
+    def warm_up(self, predict_config: OmegaConf = None) -> LoadedModel:
+        '''"""
+        Loads the checkpoint into the registry ahead of the first inpainting call. The time spent loading is stored in
+        `last_load_seconds` and is 0.0 when the model was already resident.
+
+        Args:
+            predict_config (OmegaConf, optional): The prediction configuration. Defaults to `predict_config`.
+
+        Returns:
+            LoadedModel: The resident model.
+        """'''
+        if predict_config is None:
+            predict_config = self.predict_config
+        device = get_model_device(predict_config)
+        self.last_load_seconds = self.registry.warm_up(
+            self.abs_model_path, predict_config.model.checkpoint, device, self.precision
+        )
+        return self.registry.get(self.abs_model_path, predict_config.model.checkpoint, device, self.precision)
 
+    def get_model(self) -> torch.nn.Module:
+        '''"""
+        Returns the resident model, warming it up only when it is not loaded yet. The in-memory paths call this for
+        every tile, region or image, so `last_load_seconds` keeps the time of the load that actually happened instead
+        of being reset to 0.0 by each call.
+
+        Returns:
+            torch.nn.Module: The loaded LaMa model.
+        """'''
+        predict_config = self.predict_config
+        device = get_model_device(predict_config)
+        checkpoint = predict_config.model.checkpoint
+        if not self.registry.is_loaded(self.abs_model_path, checkpoint, device, self.precision):
+            return self.warm_up(predict_config).model
+        return self.registry.get(self.abs_model_path, checkpoint, device, self.precision).model
+
+    def unload(self) -> bool:
+        '''"""
+        Removes this inpainter's checkpoint from the registry so its memory can be released.
+
+        Returns:
+            bool: True if a resident model was unloaded.
+        """'''
+        predict_config = self.predict_config
+        return self.registry.unload(
+            self.abs_model_path, predict_config.model.checkpoint, get_model_device(predict_config), self.precision
+        ) > 0
+
+    def inpaint(self):
+        '''"""
+        This method is used to perform inpainting on images. It first logs the absolute paths of the model, input directory, output directory, and image suffix. Then, it builds the prediction configuration, makes sure the model is resident in the registry and calls the 'run_prediction' function with the configuration. In any mode other than "full", or when an image is over `max_image_memory_mb` (see 'needs_downscaling'), the images are instead read from the input directory and inpainted in memory with 'inpaint_arrays', so the batching and prefetching of 'run_prediction' are only given up when they have to be. The model load time and the inference time are logged separately and kept in `last_load_seconds` and `last_inference_seconds`.
+
+        Parameters:
+        None
+
+        Returns:
+        list[str]: A list of file paths to the generated images.
+        """'''
+        log.info(
+            f"abs_model_path: {self.abs_model_path}, abs_input_dir: {self.abs_input_dir}, abs_output_dir: {self.abs_output_dir}, img_suffix: {self.img_suffix}"
+        )
+        # run_prediction completes the configuration in place, so it gets its own copy.
+        omega_conf = self.predict_config.copy()
+        self.warm_up(omega_conf)
+        if self.mode != "full" or self.needs_downscaling():
+            return self.inpaint_directory()
+        start = time.perf_counter()
+        generated_images = run_prediction(omega_conf, self.registry)
+        self.last_inference_seconds = time.perf_counter() - start
+        log.info(
+            f"Model load took {self.last_load_seconds:.2f}s, inference took {self.last_inference_seconds:.2f}s"
+        )
+        return generated_images
+
+    @property
+    def last_memory_decisions(self) -> list[dict]:
+        '''"""
+        The memory decisions of the images the calling thread inpainted last, so one inpainter can be shared by the
+        jobs of a batch.
+        """'''
+        if not hasattr(self._local, "memory_decisions"):
+            self._local.memory_decisions = []
+        return self._local.memory_decisions
+
+    @last_memory_decisions.setter
+    def last_memory_decisions(self, decisions: list[dict]):
+        self._local.memory_decisions = decisions
+
+    def needs_downscaling(self) -> bool:
+        '''"""
+        Checks whether any image of the input directory is over `max_image_memory_mb` and has to be inpainted at a
+        lower resolution. Only the image headers are read.
+
+        Returns:
+            bool: True if an image is over the budget, False when it fits or no budget is set.
+        """'''
+        if self.max_image_memory_mb is None:
+            return False
+        modulo = self.predict_config.dataset.get("pad_out_to_modulo", None) or 1
+        for mask_fname in glob.glob(os.path.join(self.abs_input_dir, "**", "*mask*.png"), recursive=True):
+            with Image.open(mask_fname.rsplit("_mask", 1)[0] + self.img_suffix) as img:
+                (width, height) = img.size
+            if get_memory_scale(height, width, modulo, self.max_image_memory_mb, self.pad_policy) < 1.0:
+                return True
+        return False
+
+    def inpaint_array(self, image: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        '''"""
+        Inpaints a single in-memory image. See `inpaint_arrays`.
+
+        Args:
+            image (np.ndarray): The HxWx3 uint8 BGR image, as returned by cv2.imread.
+            mask (np.ndarray): The HxW uint8 mask. Non zero pixels are inpainted.
+
+        Returns:
+            np.ndarray: The inpainted HxWx3 uint8 BGR image.
+        """'''
+        return self.inpaint_arrays([image], [mask])[0]
+
+    def inpaint_arrays(self, images: list[np.ndarray], masks: list[np.ndarray]) -> list[np.ndarray]:
+        '''"""
+        Inpaints in-memory images without writing them to the input directory, using the inpainter's mode.
+
+        Args:
+            images (list[np.ndarray]): HxWx3 uint8 BGR images, as returned by cv2.imread.
+            masks (list[np.ndarray]): HxW uint8 masks matching the images. Non zero pixels are inpainted.
+
+        Returns:
+            list[np.ndarray]: The inpainted HxWx3 uint8 BGR images, in the order they were given.
+        """'''
+        start = time.perf_counter()
+        self.last_memory_decisions = []
+        if self.mode == "roi":
+            results = [
+                inpaint_regions(self.predict_arrays, image, mask, self.roi_margin)
+                for (image, mask) in zip(images, masks)
+            ]
+        elif self.mode == "tiled":
+            tile_size = get_memory_bounded_tile_size(
+                self.tile_size, self.max_batch_memory_mb, ACTIVATION_BYTES_PER_PIXEL
+            )
+            results = [
+                inpaint_tiled(
+                    self.predict_arrays, image, mask, tile_size, min(self.tile_overlap, tile_size // 2), self.batch_size
+                )
+                for (image, mask) in zip(images, masks)
+            ]
+        elif self.mode == "fast":
+            results = [
+                inpaint_coarse_to_fine(self.predict_arrays, image, mask, self.fast_scale, self.fast_refine)
+                for (image, mask) in zip(images, masks)
+            ]
+        else:
+            results = self.predict_arrays(images, masks)
+        self.last_inference_seconds = time.perf_counter() - start
+        return results
+
+    def predict_arrays(self, images: list[np.ndarray], masks: list[np.ndarray]) -> list[np.ndarray]:
+        '''"""
+        Runs the resident model over whole in-memory images, keeping each within `max_image_memory_mb`. Images whose
+        estimated activation memory is over the limit are inpainted at the largest scale that fits with
+        'inpaint_coarse_to_fine', the others are passed to 'run_model' together. Every decision is appended to
+        `last_memory_decisions`.
+
+        Args:
+            images (list[np.ndarray]): HxWx3 uint8 BGR images.
+            masks (list[np.ndarray]): HxW uint8 masks matching the images.
+
+        Returns:
+            list[np.ndarray]: The inpainted HxWx3 uint8 BGR images, in the order they were given.
+        """'''
+        if self.max_image_memory_mb is None:
+            return self.run_model(images, masks)
+        modulo = self.predict_config.dataset.get("pad_out_to_modulo", None) or 1
+        results = [None] * len(images)
+        within_budget = []
+        for img_i, image in enumerate(images):
+            (height, width) = image.shape[:2]
+            scale = get_memory_scale(height, width, modulo, self.max_image_memory_mb, self.pad_policy)
+            decision = {
+                "size": (height, width),
+                "estimated_mb": estimate_memory_mb(height, width, modulo, self.pad_policy),
+                "budget_mb": self.max_image_memory_mb,
+                "scale": scale,
+            }
+            self.last_memory_decisions.append(decision)
+            if scale < 1.0:
+                log.warning(f"Inpainting a {width}x{height} image at scale {scale:.3f} to stay within the memory budget")
+                results[img_i] = inpaint_coarse_to_fine(self.run_model, image, masks[img_i], scale)
+            else:
+                within_budget.append(img_i)
+        if within_budget:
+            within_results = self.run_model(
+                [images[img_i] for img_i in within_budget], [masks[img_i] for img_i in within_budget]
+            )
+            for img_i, result in zip(within_budget, within_results):
+                results[img_i] = result
+        return results
+
+    def run_model(self, images: list[np.ndarray], masks: list[np.ndarray]) -> list[np.ndarray]:
+        '''"""
+        Runs the resident model over whole in-memory images at their full resolution. The images are normalised and
+        padded to the dataset modulo in memory the same way the lama dataset does it (or to FFT friendly sizes with the
+        "fft" padding policy), and grouped into batches of equal size.
+
+        Args:
+            images (list[np.ndarray]): HxWx3 uint8 BGR images.
+            masks (list[np.ndarray]): HxW uint8 masks matching the images.
+
+        Returns:
+            list[np.ndarray]: The inpainted HxWx3 uint8 BGR images, in the order they were given.
+        """'''
+        predict_config = self.predict_config
+        model = self.get_model()
+        device = torch.device(predict_config.device)
+        modulo = predict_config.dataset.get("pad_out_to_modulo", None) or 1
+        items = [prepare_item(image, mask, modulo, self.pad_policy) for (image, mask) in zip(images, masks)]
+        sizes = [tuple(item["image"].shape[1:]) for item in items]
+        results = [None] * len(items)
+        for batch_indices in make_batches(sizes, self.batch_size, self.max_batch_memory_mb):
+            batch_res = predict_batch(
+                model, [items[img_i] for img_i in batch_indices], device, predict_config.out_key, self.precision
+            )
+            for img_i, cur_res in zip(batch_indices, batch_res):
+                results[img_i] = to_bgr_image(cur_res)
+        return results
+
+    def inpaint_directory(self) -> list[str]:
+        '''"""
+        Inpaints the image and mask pairs of the input directory in memory and writes the results to the output
+        directory, using the same file naming as 'run_prediction'.
+
+        Returns:
+            list[str]: A list of file paths to the generated images.
+        """'''
+        return inpaint_directory(self, self.abs_input_dir, self.abs_output_dir, self.img_suffix)
 
-def run_prediction(predict_config: OmegaConf) -> list[str]:
+
+def get_model_device(predict_config: OmegaConf):
+    '''"""
+    Returns the device the model should be resident on for the given configuration. The refinement path moves the model
+    itself, so the model is kept on the CPU (None) when 'refine' is set.
+    """'''
+    if predict_config.get("refine", False):
+        return None
+    if torch.cuda.is_available():
+        return torch.device("cuda")
+    return torch.device(predict_config.device)
+
+
+def run_prediction(predict_config: OmegaConf, registry: ModelRegistry = None) -> list[str]:
     '''"""
-    This function runs the prediction process for a given configuration. It loads the model from the checkpoint, prepares the dataset, and runs the model on the dataset. The results are saved as images in the specified output directory.
+    This function runs the prediction process for a given configuration. It takes the model from the registry (loading the checkpoint only if it is not resident yet), prepares the dataset, and runs the model on the dataset. The next batch is decoded and padded on a background thread while the model runs, and the results are converted and saved as images in the specified output directory by a background writer.
 
     Args:
         predict_config (OmegaConf): The configuration object containing all the necessary parameters for the prediction process.
+        registry (ModelRegistry, optional): The registry to take the model from. Defaults to the process wide registry.
 
     Returns:
         list[str]: A list of file paths to the generated images.
@@ -88,62 +454,320 @@ def run_prediction(predict_config: OmegaConf) -> list[str]:
     Raises:
         AssertionError: If the 'refine' option is set to True but 'unpad_to_size' is not in the batch.
     """'''
-    generated_images = []
     if torch.cuda.is_available():
         log.info("CUDA is available, using GPU")
         predict_config.device = "cuda"
     device = torch.device(predict_config.device)
-    train_config_path = os.path.join(predict_config.model.path, "config.yaml")
-    with open(train_config_path, "r") as f:
-        train_config = OmegaConf.create(yaml.safe_load(f))
-    train_config.training_model.predict_only = True
-    train_config.visualizer.kind = "noop"
     out_ext = predict_config.get("out_ext", ".png")
-    checkpoint_path = os.path.join(
-        predict_config.model.path, "models", predict_config.model.checkpoint
-    )
-    model = load_checkpoint(
-        train_config, checkpoint_path, strict=False, map_location="cpu"
-    )
-    model.freeze()
-    if not predict_config.get("refine", False):
-        model.to(device)
+    registry = registry if registry is not None else default_registry
+    precision = predict_config.get("precision", "fp32")
+    model = registry.get(
+        predict_config.model.path,
+        predict_config.model.checkpoint,
+        get_model_device(predict_config),
+        precision,
+    ).model
     if not predict_config.indir.endswith("/"):
         predict_config.indir += "/"
     dataset = make_default_val_dataset(predict_config.indir, **predict_config.dataset)
-    for img_i in tqdm.trange(len(dataset)):
-        mask_fname = dataset.mask_filenames[img_i]
-        cur_out_fname = os.path.join(
-            predict_config.outdir,
-            os.path.splitext(mask_fname[len(predict_config.indir):])[0] + out_ext,
+    refine = predict_config.get("refine", False)
+    batch_size = predict_config.get("batch_size", 1)
+    modulo = predict_config.dataset.get("pad_out_to_modulo", None) or 1
+    # The refinement builds its own image pyramid from the dataset padding, so it keeps the modulo policy.
+    pad_policy = "modulo" if refine else predict_config.get("pad_policy", "modulo")
+    if batch_size > 1 and not refine and predict_config.dataset.get("scale_factor", None) is None:
+        sizes = [get_padded_size(img_fname, modulo, pad_policy) for img_fname in dataset.img_filenames]
+        batches = make_batches(sizes, batch_size, predict_config.get("max_batch_memory_mb", None))
+        log.info(f"Running {len(dataset)} images in {len(batches)} batches")
+    else:
+        batches = [[img_i] for img_i in range(len(dataset))]
+    prefetch = predict_config.get("prefetch", 2)
+    generated_images = [None] * len(dataset)
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="inpaint-writer") as writer:
+        pending_writes = deque()
+        loaded_batches = iterate_prefetched(
+            lambda batch_indices: [pad_item(dataset[img_i], modulo, pad_policy) for img_i in batch_indices],
+            batches,
+            prefetch,
         )
-        os.makedirs(os.path.dirname(cur_out_fname), exist_ok=True)
-        batch = default_collate([dataset[img_i]])
-        if predict_config.get("refine", False):
-            assert (
-                    "unpad_to_size" in batch
-            ), "Unpadded size is required for the refinement"
-            cur_res = refine_predict(batch, model, **predict_config.refiner)
-            cur_res = cur_res[0].permute(1, 2, 0).detach().cpu().numpy()
-        else:
-            with torch.no_grad():
-                batch = move_to_device(batch, device)
-                batch["mask"] = (batch["mask"] > 0) * 1
-                batch = model(batch)
-                cur_res = (
-                    batch[predict_config.out_key][0]
-                    .permute(1, 2, 0)
-                    .detach()
-                    .cpu()
-                    .numpy()
+        for batch_indices, items in tqdm.tqdm(loaded_batches, total=len(batches)):
+            if refine:
+                batch = default_collate(items)
+                assert (
+                        "unpad_to_size" in batch
+                ), "Unpadded size is required for the refinement"
+                cur_res = refine_predict(batch, model, **predict_config.refiner)
+                results = [cur_res[0].permute(1, 2, 0).detach().cpu().numpy()]
+            else:
+                results = predict_batch(model, items, device, predict_config.out_key, precision)
+            for img_i, cur_res in zip(batch_indices, results):
+                mask_fname = dataset.mask_filenames[img_i]
+                cur_out_fname = os.path.join(
+                    predict_config.outdir,
+                    os.path.splitext(mask_fname[len(predict_config.indir):])[0] + out_ext,
                 )
-                unpad_to_size = batch.get("unpad_to_size", None)
-                if unpad_to_size is not None:
-                    (orig_height, orig_width) = unpad_to_size
-                    cur_res = cur_res[:orig_height, :orig_width]
-        cur_res = np.clip(cur_res * 255, 0, 255).astype("uint8")
-        cur_res = cv2.cvtColor(cur_res, cv2.COLOR_RGB2BGR)
-        cv2.imwrite(cur_out_fname, cur_res)
-        generated_images.append(cur_out_fname)
-        log.info(f"Saved {cur_out_fname}")
+                pending_writes.append(writer.submit(write_result, cur_out_fname, cur_res))
+                generated_images[img_i] = cur_out_fname
+            # Bound the results waiting to be written so memory does not grow when writing is the slower stage.
+            while len(pending_writes) > max(prefetch, 1) * len(batch_indices):
+                pending_writes.popleft().result()
+        for pending_write in pending_writes:
+            pending_write.result()
     return generated_images
+
+
+def iterate_prefetched(load: Callable, batches: list, prefetch: int) -> Iterator[tuple]:
+    '''"""
+    Yields each batch together with its loaded items, loading up to `prefetch` batches ahead on a background thread
+    while the caller runs the model on the current one.
+
+    Args:
+        load (Callable): Loads the items of a batch.
+        batches (list): The batches to load, in order.
+        prefetch (int): How many batches are loaded ahead. 0 loads each batch on the calling thread when it is needed.
+
+    Yields:
+        tuple: The batch and its loaded items.
+    """'''
+    if prefetch <= 0:
+        for batch in batches:
+            yield batch, load(batch)
+        return
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="inpaint-prefetch") as loader:
+        remaining = iter(batches)
+        pending = deque((batch, loader.submit(load, batch)) for batch in itertools.islice(remaining, prefetch))
+        while pending:
+            (batch, loaded) = pending.popleft()
+            items = loaded.result()
+            next_batch = next(remaining, None)
+            if next_batch is not None:
+                pending.append((next_batch, loader.submit(load, next_batch)))
+            yield batch, items
+
+
+def write_result(cur_out_fname: str, cur_res: np.ndarray):
+    '''"""
+    Converts a model result to a BGR image and writes it, creating the output directory if needed.
+    """'''
+    os.makedirs(os.path.dirname(cur_out_fname), exist_ok=True)
+    cv2.imwrite(cur_out_fname, to_bgr_image(cur_res))
+    log.info(f"Saved {cur_out_fname}")
+
+
+def is_bf16_supported(device: torch.device) -> bool:
+    '''"""
+    Returns True if bfloat16 autocast is worthwhile on the device: CUDA devices with bf16 support, or CPUs whose oneDNN
+    build has native bf16 kernels (AVX512-BF16 or AMX).
+    """'''
+    if device.type == "cuda":
+        return torch.cuda.is_bf16_supported()
+    is_supported = getattr(torch.ops.mkldnn, "_is_mkldnn_bf16_supported", None)
+    return torch.backends.mkldnn.is_available() and is_supported is not None and is_supported()
+
+
+def predict_batch(
+        model, items: list[dict], device: torch.device, out_key: str, precision: str = "fp32"
+) -> list[np.ndarray]:
+    '''"""
+    Runs the model on a list of dataset items that share the same padded size and returns one result per item.
+
+    Args:
+        model: The LaMa model.
+        items (list[dict]): Dataset items holding 'image', 'mask' and optionally 'unpad_to_size'.
+        device (torch.device): The device the model lives on.
+        out_key (str): The key of the model output to return, usually 'inpainted'.
+        precision (str, optional): "bf16" runs the model under bfloat16 autocast when the device supports it.
+            Quantisation ("int8") is part of the loaded model. Defaults to "fp32".
+
+    Returns:
+        list[np.ndarray]: The unpadded HxWx3 RGB results as floats in the range [0, 1].
+    """'''
+    batch = default_collate([{"image": item["image"], "mask": item["mask"]} for item in items])
+    use_bf16 = precision == "bf16" and is_bf16_supported(device)
+    if precision == "bf16" and not use_bf16:
+        log.warning(f"bfloat16 is not supported on {device}, running in fp32")
+    with torch.no_grad(), torch.autocast(device.type, dtype=torch.bfloat16, enabled=use_bf16):
+        batch = move_to_device(batch, device)
+        batch["mask"] = (batch["mask"] > 0) * 1
+        batch = model(batch)
+        batch_res = batch[out_key].float().permute(0, 2, 3, 1).detach().cpu().numpy()
+    results = []
+    for item, cur_res in zip(items, batch_res):
+        unpad_to_size = item.get("unpad_to_size", None)
+        if unpad_to_size is not None:
+            (orig_height, orig_width) = unpad_to_size
+            cur_res = cur_res[:orig_height, :orig_width]
+        results.append(cur_res)
+    return results
+
+
+def estimate_memory_mb(height: int, width: int, modulo: int, pad_policy: str = "modulo") -> float:
+    '''"""
+    Estimates the activation memory in MB the model needs for an image of the given size, after padding.
+    """'''
+    padded_pixels = get_pad_size(height, modulo, pad_policy) * get_pad_size(width, modulo, pad_policy)
+    return padded_pixels * ACTIVATION_BYTES_PER_PIXEL / 2 ** 20
+
+
+def get_memory_scale(height: int, width: int, modulo: int, max_memory_mb: float, pad_policy: str = "modulo") -> float:
+    '''"""
+    Returns the largest scale (up to 1.0) at which an image's estimated activation memory fits in `max_memory_mb`.
+
+    Args:
+        height (int): The image height.
+        width (int): The image width.
+        modulo (int): The size the image is padded to a multiple of.
+        max_memory_mb (float): The activation memory budget.
+        pad_policy (str, optional): One of PAD_POLICIES. Defaults to "modulo".
+
+    Returns:
+        float: The scale the image should be inpainted at, 1.0 when it fits as is.
+    """'''
+    scale = 1.0
+    while True:
+        (scaled_height, scaled_width) = (max(1, round(height * scale)), max(1, round(width * scale)))
+        estimate = estimate_memory_mb(scaled_height, scaled_width, modulo, pad_policy)
+        if estimate <= max_memory_mb or max(scaled_height, scaled_width) <= modulo:
+            return scale
+        # Padding makes the estimate step rather than shrink smoothly, so shrink at least a little every round.
+        scale *= min(0.98, math.sqrt(max_memory_mb / estimate))
+
+
+def is_fft_friendly(size: int) -> bool:
+    '''"""
+    Returns True if the size has no prime factors other than 2, 3 and 5, the sizes FFT libraries handle fastest.
+    """'''
+    for factor in (2, 3, 5):
+        while size % factor == 0:
+            size //= factor
+    return size == 1
+
+
+def get_pad_size(size: int, modulo: int, pad_policy: str = "modulo") -> int:
+    '''"""
+    Returns the side length an image side is padded to.
+
+    With the "modulo" policy this is the next multiple of the modulo, as the lama dataset pads. With the "fft" policy it
+    is the smallest multiple of the modulo for which both the padded size and the size after dividing by the modulo
+    have only 2, 3 and 5 as prime factors. big-lama downsamples by 8 (its usual modulo) before the Fourier
+    convolution blocks, so this keeps every FFT the model runs on a smooth size.
+
+    Args:
+        size (int): The image side length.
+        modulo (int): The size the side must be a multiple of.
+        pad_policy (str, optional): One of PAD_POLICIES. Defaults to "modulo".
+
+    Returns:
+        int: The padded side length.
+    """'''
+    padded = ceil_modulo(size, modulo)
+    if pad_policy == "fft":
+        while not (is_fft_friendly(padded // modulo) and is_fft_friendly(padded)):
+            padded += modulo
+    return padded
+
+
+def pad_img_to_size(img: np.ndarray, height: int, width: int) -> np.ndarray:
+    '''"""
+    Pads a CxHxW image at the bottom and right to the given size with symmetric padding, like the lama dataset's
+    `pad_img_to_modulo`.
+    """'''
+    return np.pad(img, ((0, 0), (0, height - img.shape[1]), (0, width - img.shape[2])), mode="symmetric")
+
+
+def pad_item(item: dict, modulo: int, pad_policy: str = "modulo") -> dict:
+    '''"""
+    Pads a lama dataset item, already padded to the modulo, further to the size of the padding policy. Items are
+    returned unchanged with the "modulo" policy.
+    """'''
+    if pad_policy == "modulo":
+        return item
+    (height, width) = item["image"].shape[1:]
+    (pad_height, pad_width) = (get_pad_size(height, modulo, pad_policy), get_pad_size(width, modulo, pad_policy))
+    if (pad_height, pad_width) != (height, width):
+        item = dict(item)
+        item.setdefault("unpad_to_size", (height, width))
+        item["image"] = pad_img_to_size(item["image"], pad_height, pad_width)
+        item["mask"] = pad_img_to_size(item["mask"], pad_height, pad_width)
+    return item
+
+
+def prepare_item(image: np.ndarray, mask: np.ndarray, modulo: int, pad_policy: str = "modulo") -> dict:
+    '''"""
+    Builds the same item the lama evaluation dataset produces for an image and mask file pair, from in-memory arrays.
+
+    Args:
+        image (np.ndarray): The HxWx3 (or HxWx4) uint8 BGR image.
+        mask (np.ndarray): The HxW uint8 mask. A 3 channel mask is converted to grayscale.
+        modulo (int): The size the image and mask are padded to a multiple of.
+        pad_policy (str, optional): One of PAD_POLICIES, see `get_pad_size`. Defaults to "modulo".
+
+    Returns:
+        dict: The item with a CxHxW float 'image' and 1xHxW float 'mask' in the range [0, 1], and 'unpad_to_size'
+        when padding was applied.
+    """'''
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+    elif image.shape[2] == 4:
+        image = cv2.cvtColor(image, cv2.COLOR_BGRA2RGB)
+    else:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    if mask.ndim == 3:
+        mask = cv2.cvtColor(mask, cv2.COLOR_BGR2GRAY)
+    item = dict(
+        image=np.transpose(image, (2, 0, 1)).astype("float32") / 255,
+        mask=mask[None, ...].astype("float32") / 255,
+    )
+    if modulo > 1 or pad_policy != "modulo":
+        item["unpad_to_size"] = item["image"].shape[1:]
+        (height, width) = item["unpad_to_size"]
+        (pad_height, pad_width) = (get_pad_size(height, modulo, pad_policy), get_pad_size(width, modulo, pad_policy))
+        item["image"] = pad_img_to_size(item["image"], pad_height, pad_width)
+        item["mask"] = pad_img_to_size(item["mask"], pad_height, pad_width)
+    return item
+
+
+def to_bgr_image(cur_res: np.ndarray) -> np.ndarray:
+    '''"""
+    Converts a float RGB model result in the range [0, 1] into a uint8 BGR image ready for OpenCV.
+    """'''
+    cur_res = np.clip(cur_res * 255, 0, 255).astype("uint8")
+    return cv2.cvtColor(cur_res, cv2.COLOR_RGB2BGR)
+
+
+def get_padded_size(img_fname: str, modulo: int, pad_policy: str = "modulo") -> tuple[int, int]:
+    '''"""
+    Returns the (height, width) an image will have after it is padded with the given modulo and padding policy. Only
+    the image header is read.
+    """'''
+    with Image.open(img_fname) as img:
+        (width, height) = img.size
+    return (get_pad_size(height, modulo, pad_policy), get_pad_size(width, modulo, pad_policy))
+
+
+def make_batches(sizes: list[tuple[int, int]], batch_size: int, max_batch_memory_mb: float = None) -> list[list[int]]:
+    '''"""
+    Groups image indices into batches of images with the same padded size (bucketing), so they can be stacked into a
+    single tensor without extra padding.
+
+    Args:
+        sizes (list[tuple[int, int]]): The padded (height, width) of each image.
+        batch_size (int): The maximum number of images in a batch.
+        max_batch_memory_mb (float, optional): The estimated activation memory a batch may use. Images larger than
+            the cap still run, one at a time.
+
+    Returns:
+        list[list[int]]: The image indices of each batch.
+    """'''
+    buckets: dict[tuple[int, int], list[int]] = {}
+    for img_i, size in enumerate(sizes):
+        buckets.setdefault(size, []).append(img_i)
+    batches = []
+    for (height, width), indices in buckets.items():
+        cur_batch_size = batch_size
+        if max_batch_memory_mb is not None:
+            per_image_mb = height * width * ACTIVATION_BYTES_PER_PIXEL / 2 ** 20
+            cur_batch_size = max(1, min(batch_size, int(max_batch_memory_mb // per_image_mb)))
+        for start in range(0, len(indices), cur_batch_size):
+            batches.append(indices[start:start + cur_batch_size])
+    return batches
@@ -0,0 +1,252 @@
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import traceback
+from concurrent.futures import Future
+from typing import Iterable, Iterator
+
+import numpy as np
+import torch
+
+from inpaint import Inpainter
+
+log = logging.getLogger(__name__)
+
+
+def _worker_main(inpainter: Inpainter, tasks, results, num_threads: int):
+    """
+    Worker loop: inpaint (index, image, mask) tasks until a None task arrives. The inpainter and its model were
+    inherited from the parent by fork, so nothing is loaded here. The parent never ran a parallel region before the
+    fork (see InpaintWorkerPool.start), so the worker can size its own intra-op pool safely.
+    """
+    torch.set_num_threads(num_threads)
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        (index, image, mask) = task
+        try:
+            result = inpainter.inpaint_array(image, mask)
+            info = {"memory_decisions": getattr(inpainter, "last_memory_decisions", None) or []}
+            results.put((index, result, None, info))
+        except Exception:
+            results.put((index, None, traceback.format_exc(), None))
+
+
+class InpaintWorkerPool:
+    def __init__(self, inpainter: Inpainter, num_workers: int = None, threads_per_worker: int = None):
+        """
+        A pool of forked worker processes sharing one loaded inpainting model.
+
+        The model is loaded in the parent before the workers are forked, so its weights are shared copy-on-write and
+        memory does not grow with the number of workers (apart from each worker's activations). Work is spread over
+        the workers through a queue; `submit` can be called from several threads at once and results are matched back
+        to their Future by a collector thread. Forking is only safe on the CPU, and the pool needs the "fork" start
+        method (Linux, macOS).
+
+        A forked child only inherits the thread that forked it, so a parent whose OpenMP/intra-op pool is already
+        running hands its children a runtime with missing worker threads, which can deadlock their first parallel
+        operation. The parent is therefore kept single threaded from `start` to `close`: start the pool before the
+        process runs any multi-threaded PyTorch work.
+
+        Args:
+            inpainter (Inpainter): The inpainter the workers use, e.g. a LamaInpainter.
+            num_workers (int, optional): The number of worker processes. Defaults to one per two cores.
+            threads_per_worker (int, optional): The PyTorch thread count of each worker. Defaults to an even share of
+                the cores.
+        """
+        cpu_count = os.cpu_count() or 1
+        self.inpainter = inpainter
+        self.num_workers = num_workers or max(1, cpu_count // 2)
+        self.threads_per_worker = threads_per_worker or max(1, cpu_count // self.num_workers)
+        self._workers = []
+        self._tasks = None
+        self._results = None
+        self._submitted = 0
+        self._pending: dict[int, Future] = {}
+        self._lock = threading.Lock()
+        self._collector = None
+        self._closing = False
+        self._broken = False
+        self._parent_threads = None
+
+    def start(self):
+        """
+        Loads the model (if the inpainter supports warming up) with a single intra-op thread and forks the workers.
+        Safe to call from several threads: the workers are only forked once.
+        """
+        with self._lock:
+            if not self._workers:
+                self._start()
+        return self
+
+    def _start(self):
+        self._parent_threads = torch.get_num_threads()
+        torch.set_num_threads(1)
+        warm_up = getattr(self.inpainter, "warm_up", None)
+        if warm_up is not None:
+            warm_up()
+        context = multiprocessing.get_context("fork")
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._workers = [
+            context.Process(
+                target=_worker_main,
+                args=(self.inpainter, self._tasks, self._results, self.threads_per_worker),
+                name=f"inpaint-worker-{i}",
+                daemon=True,
+            )
+            for i in range(self.num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+        self._closing = False
+        self._broken = False
+        self._collector = threading.Thread(target=self._collect, name="inpaint-pool-collector", daemon=True)
+        self._collector.start()
+        log.info(f"Started {self.num_workers} inpainting worker(s) with {self.threads_per_worker} thread(s) each")
+
+    def close(self):
+        """
+        Stops the workers once they have finished the tasks already queued, and restores the parent's thread count.
+        """
+        with self._lock:
+            if not self._workers:
+                return
+            # Set before the workers stop, so the collector does not take a worker that exited for a dead one.
+            self._closing = True
+            if self._broken:
+                # Tasks queued for a dead worker are never read, do not wait for them to be flushed at exit.
+                self._tasks.cancel_join_thread()
+            for _ in self._workers:
+                self._tasks.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._collector.join()
+        self._workers = []
+        torch.set_num_threads(self._parent_threads)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def submit(self, image: np.ndarray, mask: np.ndarray) -> Future:
+        """
+        Queues an image for inpainting. Safe to call from several threads.
+
+        Returns:
+            Future: Resolves to the inpainted image and a dict with the inpainter's "memory_decisions" for it, or
+            fails with a RuntimeError if the worker failed to inpaint the image or died.
+        """
+        self.start()
+        future = Future()
+        with self._lock:
+            if self._broken:
+                raise RuntimeError("An inpainting worker died, the pool has to be restarted")
+            if self._closing:
+                raise RuntimeError("The inpainting pool is closing")
+            index = self._submitted
+            self._submitted += 1
+            self._pending[index] = future
+            self._tasks.put((index, image, mask))
+        return future
+
+    def imap(self, pairs: Iterable[tuple]) -> Iterator[np.ndarray]:
+        """
+        Inpaints (image, mask) pairs on the workers and yields the results in submission order as they become
+        available. All pairs are queued up front.
+
+        Args:
+            pairs (Iterable[tuple]): The (image, mask) pairs to inpaint.
+
+        Yields:
+            np.ndarray: The inpainted images.
+
+        Raises:
+            RuntimeError: If a worker failed to inpaint an image or died.
+        """
+        futures = [self.submit(image, mask) for (image, mask) in pairs]
+        for future in futures:
+            yield future.result()[0]
+
+    def map(self, images: list[np.ndarray], masks: list[np.ndarray]) -> list[np.ndarray]:
+        """
+        Inpaints the images on the workers and returns the results in the order the images were given.
+        """
+        return list(self.imap(zip(images, masks)))
+
+    def _collect(self):
+        """
+        Collector thread: resolves the Future of every finished task, and fails the pending ones if a worker dies.
+        Stops once the pool is closing and every worker has exited and its results have been read.
+
+        A worker has died when it exited with a non-zero exit code; workers stopped by `close` exit with 0. The task
+        the dead worker was running cannot be told apart from the others, so every pending task is failed, and the
+        results other workers still deliver for them are dropped.
+        """
+        while True:
+            try:
+                (index, result, error, info) = self._results.get(timeout=1)
+            except queue.Empty:
+                with self._lock:
+                    dead = [worker.name for worker in self._workers if worker.exitcode not in (None, 0)]
+                    stopped = self._closing and all(worker.exitcode is not None for worker in self._workers)
+                    if not (dead or stopped):
+                        continue
+                    self._broken = self._broken or bool(dead)
+                    pending = list(self._pending.values())
+                    self._pending.clear()
+                for future in pending:
+                    if dead:
+                        future.set_exception(RuntimeError(f"Inpainting worker(s) {dead} died"))
+                    else:
+                        future.set_exception(RuntimeError("The inpainting pool was closed"))
+                if stopped:
+                    return
+                continue
+            with self._lock:
+                future = self._pending.pop(index, None)
+            if future is None:
+                # Already failed because a worker died.
+                continue
+            if error is not None:
+                future.set_exception(RuntimeError(f"Inpainting task {index} failed in a worker:\n{error}"))
+            else:
+                future.set_result((result, info))
+
+
+class PooledInpainter(Inpainter):
+    def __init__(self, pool: InpaintWorkerPool):
+        """
+        Inpainter handing every image to an InpaintWorkerPool, so several threads (e.g. the jobs of a batch) can share
+        one set of forked workers. It can stand in for the pool's inpainter wherever an Inpainter is expected, e.g. as
+        the fallback of a FlatFillInpainter.
+
+        Args:
+            pool (InpaintWorkerPool): The pool. Started on first use.
+        """
+        self.pool = pool
+        self._local = threading.local()
+
+    def get_cache_identity(self) -> dict:
+        return self.pool.inpainter.get_cache_identity()
+
+    @property
+    def last_memory_decisions(self) -> list[dict]:
+        """
+        The memory decisions of the images the calling thread inpainted last.
+        """
+        return getattr(self._local, "memory_decisions", [])
+
+    def inpaint_array(self, image: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        return self.inpaint_arrays([image], [mask])[0]
+
+    def inpaint_arrays(self, images: list[np.ndarray], masks: list[np.ndarray]) -> list[np.ndarray]:
+        futures = [self.pool.submit(image, mask) for (image, mask) in zip(images, masks)]
+        results = [future.result() for future in futures]
+        self._local.memory_decisions = [decision for (_, info) in results for decision in info["memory_decisions"]]
+        return [result for (result, _) in results]
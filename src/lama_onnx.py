@@ -0,0 +1,281 @@
+import argparse
+import copy
+import logging
+import os
+import threading
+import time
+import types
+
+import numpy as np
+import onnxruntime
+import torch
+from saicinpainting.training.modules.ffc import FourierUnit
+
+import directories
+from inpaint import Inpainter, inpaint_directory
+from inpaint_lama import prepare_item, to_bgr_image
+from model_registry import registry
+
+log = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("onnx", "torchscript")
+
+_sessions: dict[tuple, onnxruntime.InferenceSession] = {}
+_sessions_lock = threading.Lock()
+
+
+class LamaGeneratorWrapper(torch.nn.Module):
+    def __init__(self, generator: torch.nn.Module):
+        """
+        Wraps the big-lama generator so the exported graph takes the image and mask and returns the inpainted image,
+        exactly like the 'inpainted' output of the lama training module.
+
+        Args:
+            generator (torch.nn.Module): The generator of the loaded LaMa model.
+        """
+        super().__init__()
+        self.generator = generator
+
+    def forward(self, image: torch.Tensor, mask: torch.Tensor) -> torch.Tensor:
+        mask = (mask > 0).to(image.dtype)
+        masked_img = torch.cat([image * (1 - mask), mask], dim=1)
+        predicted_image = self.generator(masked_img)
+        return mask * predicted_image + (1 - mask) * image
+
+
+def fourier_unit_export_forward(self: FourierUnit, x: torch.Tensor) -> torch.Tensor:
+    """
+    The forward of lama's FourierUnit, rewritten for the dynamo ONNX exporter. The original stacks the `.real` and
+    `.imag` views of the complex spectrum and reshapes it with sizes read from that complex tensor, which the exporter
+    cannot translate once the spatial size is symbolic ("No decompositions registered for the complex-valued input").
+    Here the spectrum goes through `view_as_real`/`view_as_complex` and every size comes from the real input. Only the
+    configuration big-lama uses is supported, see 'patch_fourier_units'.
+    """
+    batch = x.shape[0]
+    (height, width) = x.shape[-2:]
+    ffted = torch.view_as_real(torch.fft.rfftn(x.float(), dim=(-2, -1), norm=self.fft_norm))
+    ffted = ffted.permute(0, 1, 4, 2, 3).reshape(batch, -1, height, width // 2 + 1)
+    ffted = self.relu(self.bn(self.conv_layer(ffted)))
+    ffted = ffted.reshape(batch, -1, 2, height, width // 2 + 1).permute(0, 1, 3, 4, 2).contiguous()
+    return torch.fft.irfftn(torch.view_as_complex(ffted), s=(height, width), dim=(-2, -1), norm=self.fft_norm)
+
+
+def patch_fourier_units(generator: torch.nn.Module) -> int:
+    """
+    Switches every FourierUnit of a generator to 'fourier_unit_export_forward'. Call it on a copy of the generator,
+    the resident model keeps lama's own forward.
+
+    Returns:
+        int: The number of patched units.
+
+    Raises:
+        ValueError: If a unit uses an option the export forward does not implement (3D FFC, spatial scaling,
+            spectral position encoding or squeeze and excitation).
+    """
+    patched = 0
+    for module in generator.modules():
+        if not isinstance(module, FourierUnit):
+            continue
+        if module.ffc3d or module.spatial_scale_factor is not None or module.spectral_pos_encoding or module.use_se:
+            raise ValueError("Only 2D FourierUnits without scaling, position encoding or SE blocks can be exported")
+        module.forward = types.MethodType(fourier_unit_export_forward, module)
+        patched += 1
+    return patched
+
+
+def export_generator(
+        model_path: str,
+        output_path: str,
+        checkpoint: str = "best.ckpt",
+        export_format: str = "onnx",
+        opset_version: int = 18,
+        max_abs_diff: float = 1e-3,
+) -> str:
+    """
+    Exports the big-lama generator with dynamic batch and spatial dimensions. The ONNX graph is built with the dynamo
+    exporter from a copy of the generator whose Fourier units are patched with 'patch_fourier_units': the TorchScript
+    exporter has no symbolic for `aten::fft_rfftn`, and the dynamo exporter lowers the FFTs to the ONNX DFT operator
+    but cannot translate lama's handling of the complex spectrum. The exported graph is checked against the unpatched
+    eager generator with 'check_parity' before it is returned.
+
+    Args:
+        model_path (str): The directory of the LaMa model.
+        output_path (str): Where the exported graph is written.
+        checkpoint (str, optional): The checkpoint file name. Defaults to "best.ckpt".
+        export_format (str, optional): "onnx" or "torchscript". Defaults to "onnx".
+        opset_version (int, optional): The ONNX opset to export with. Defaults to 18, the lowest the dynamo exporter
+            targets.
+        max_abs_diff (float, optional): The largest difference to the eager output, in [0, 1] image units, accepted
+            by the parity check. Defaults to 1e-3.
+
+    Returns:
+        str: The path of the exported graph.
+
+    Raises:
+        ValueError: If the export format is not one of EXPORT_FORMATS.
+        RuntimeError: If the exported ONNX graph does not match the eager generator.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {export_format}, expected one of {EXPORT_FORMATS}")
+    model = registry.get(model_path, checkpoint, torch.device("cpu")).model
+    wrapper = LamaGeneratorWrapper(model.generator).eval()
+    export_wrapper = wrapper
+    if export_format == "onnx":
+        export_wrapper = LamaGeneratorWrapper(copy.deepcopy(model.generator)).eval()
+        log.info(f"Patched {patch_fourier_units(export_wrapper.generator)} Fourier units for the export")
+    image = torch.rand(1, 3, 256, 256)
+    mask = (torch.rand(1, 1, 256, 256) > 0.5).float()
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with torch.no_grad():
+        if export_format == "torchscript":
+            torch.jit.trace(wrapper, (image, mask)).save(output_path)
+        else:
+            dynamic_dims = {0: torch.export.Dim("batch"), 2: torch.export.Dim("height"), 3: torch.export.Dim("width")}
+            torch.onnx.export(
+                export_wrapper,
+                (image, mask),
+                output_path,
+                input_names=["image", "mask"],
+                output_names=["inpainted"],
+                dynamic_shapes={"image": dynamic_dims, "mask": dynamic_dims},
+                opset_version=opset_version,
+                dynamo=True,
+            )
+    log.info(f"Exported {export_format} generator to {output_path}")
+    if export_format == "onnx":
+        diff = check_parity(wrapper, output_path)
+        if diff > max_abs_diff:
+            raise RuntimeError(f"The exported generator differs from the eager one by {diff:.2e} > {max_abs_diff:.2e}")
+    return output_path
+
+
+def check_parity(
+        wrapper: torch.nn.Module, onnx_path: str, sizes: tuple = ((256, 256), (200, 312)), seed: int = 0
+) -> float:
+    """
+    Runs the eager generator and the exported graph on the same random image and mask at each of `sizes`, including
+    a size that is not the export size, and returns the largest absolute difference of their outputs.
+
+    Args:
+        wrapper (torch.nn.Module): The eager LamaGeneratorWrapper, with lama's own Fourier units.
+        onnx_path (str): The exported ONNX graph.
+        sizes (tuple, optional): The (height, width) sizes checked. Defaults to the export size and 200x312.
+        seed (int, optional): The seed of the random inputs. Defaults to 0.
+
+    Returns:
+        float: The maximum absolute difference, in [0, 1] image units.
+    """
+    session = onnxruntime.InferenceSession(os.path.abspath(onnx_path), providers=["CPUExecutionProvider"])
+    generator = torch.Generator().manual_seed(seed)
+    max_diff = 0.0
+    for (height, width) in sizes:
+        image = torch.rand(1, 3, height, width, generator=generator)
+        mask = (torch.rand(1, 1, height, width, generator=generator) > 0.5).float()
+        with torch.no_grad():
+            expected = wrapper(image, mask).numpy()
+        (actual,) = session.run(["inpainted"], {"image": image.numpy(), "mask": mask.numpy()})
+        diff = float(np.abs(actual - expected).max())
+        log.info(f"Parity at {width}x{height}: max abs diff {diff:.2e}")
+        max_diff = max(max_diff, diff)
+    return max_diff
+
+
+def get_session(onnx_path: str, num_threads: int = None) -> onnxruntime.InferenceSession:
+    """
+    Returns a CPU ONNX Runtime session for the exported generator. Sessions are created once per process and reused.
+    """
+    key = (os.path.abspath(onnx_path), num_threads)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            start = time.perf_counter()
+            options = onnxruntime.SessionOptions()
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if num_threads is not None:
+                options.intra_op_num_threads = num_threads
+            session = onnxruntime.InferenceSession(
+                key[0], sess_options=options, providers=["CPUExecutionProvider"]
+            )
+            _sessions[key] = session
+            log.info(f"Loaded {key[0]} in {time.perf_counter() - start:.2f}s")
+        return session
+
+
+class OnnxLamaInpainter(Inpainter):
+    def __init__(
+            self,
+            onnx_path: str,
+            abs_input_dir: str = None,
+            abs_output_dir: str = None,
+            img_suffix: str = ".png",
+            pad_out_to_modulo: int = 8,
+            num_threads: int = None,
+    ):
+        """
+        Inpainter running the exported big-lama generator with ONNX Runtime on the CPU. Pre- and post-processing are
+        the same as the eager LamaInpainter.
+
+        Args:
+            onnx_path (str): The path of the exported ONNX generator.
+            abs_input_dir (str, optional): The absolute path of the input directory. Not needed for in-memory inpainting.
+            abs_output_dir (str, optional): The absolute path of the output directory. Not needed for in-memory inpainting.
+            img_suffix (str, optional): The suffix for the image files. Defaults to ".png".
+            pad_out_to_modulo (int, optional): The size images are padded to a multiple of. Defaults to 8, as in the
+                lama prediction config.
+            num_threads (int, optional): The ONNX Runtime intra-op thread count. Defaults to the runtime's choice.
+        """
+        self.onnx_path = onnx_path
+        self.abs_input_dir = abs_input_dir
+        self.abs_output_dir = abs_output_dir
+        self.img_suffix = img_suffix
+        self.pad_out_to_modulo = pad_out_to_modulo
+        self.num_threads = num_threads
+        self.last_inference_seconds = 0.0
+
+    def inpaint(self):
+        """
+        Inpaints the image and mask pairs of the input directory and writes the results to the output directory.
+
+        Returns:
+            list[str]: A list of file paths to the generated images.
+        """
+        return inpaint_directory(self, self.abs_input_dir, self.abs_output_dir, self.img_suffix)
+
+    def inpaint_array(self, image: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        """
+        Inpaints a single in-memory image.
+
+        Args:
+            image (np.ndarray): The HxWx3 uint8 BGR image, as returned by cv2.imread.
+            mask (np.ndarray): The HxW uint8 mask. Non zero pixels are inpainted.
+
+        Returns:
+            np.ndarray: The inpainted HxWx3 uint8 BGR image.
+        """
+        session = get_session(self.onnx_path, self.num_threads)
+        start = time.perf_counter()
+        item = prepare_item(image, mask, self.pad_out_to_modulo)
+        (cur_res,) = session.run(
+            ["inpainted"],
+            {"image": item["image"][None, ...], "mask": item["mask"][None, ...]},
+        )
+        cur_res = np.transpose(cur_res[0], (1, 2, 0))
+        unpad_to_size = item.get("unpad_to_size", None)
+        if unpad_to_size is not None:
+            (orig_height, orig_width) = unpad_to_size
+            cur_res = cur_res[:orig_height, :orig_width]
+        self.last_inference_seconds = time.perf_counter() - start
+        return to_bgr_image(cur_res)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Export the big-lama generator for CPU inference")
+    parser.add_argument("--model-path", default=directories.big_lama_model_dir)
+    parser.add_argument("--checkpoint", default="best.ckpt")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="onnx")
+    parser.add_argument("--output", default=os.path.join(directories.models_dir, "big-lama.onnx"))
+    parser.add_argument("--opset", type=int, default=18)
+    parser.add_argument("--max-abs-diff", type=float, default=1e-3, help="Largest difference accepted by the parity check")
+    args = parser.parse_args()
+    export_generator(args.model_path, args.output, args.checkpoint, args.format, args.opset, args.max_abs_diff)
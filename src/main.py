@@ -1,3 +1,4 @@
+import argparse
 import logging
 import os
 import sys
@@ -9,13 +10,13 @@ import directories
 from directories import (
     generated_dir,
 )
+from batch_onpack import load_texts, run_batch
 from generate_event_handler import run_onpack_process
 
 load_dotenv()
 input_file_name_relative = "pack/pack_image.png"
 mrhi_image_loc_relative = "mrhi/mrhi.jpeg"
 bottom_text = "12 PACKS"
-scan_dir = False
 
 logging.basicConfig(level=logging.INFO, stream=sys.stdout)
 logging.getLogger("saicinpainting.training.trainers.base").setLevel(logging.WARNING)
@@ -23,7 +24,8 @@ logger = logging.getLogger(__name__)
 logger.info("Setting PYTORCH_ENABLE_MPS_FALLBACK=1 for mac machines to fallback to CPU")
 os.environ.setdefault("PYTORCH_ENABLE_MPS_FALLBACK", "1")
 
-if __name__ == "__main__":
+
+def run_single():
     base_image_location = os.path.join(
         directories.images_dir, f"{input_file_name_relative}"
     )
@@ -47,3 +49,42 @@ if __name__ == "__main__":
         should_validate=False,
         should_evaluate=False,
     )
+
+
+def run_batch_command(args):
+    manifest = run_batch(
+        source=args.source,
+        texts=load_texts(args.texts) if args.texts else None,
+        default_text=args.text,
+        jobs=args.jobs,
+        manifest_path=args.manifest,
+        output_dir=args.output_dir,
+        mask_dir=args.mask_dir,
+    )
+    summary = manifest.summary()
+    print(f"Manifest written to {manifest.path}: {summary}")
+    return 1 if summary.get("failed") else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate on-pack images from the command line")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser(
+        "single", help=f"Process images/{input_file_name_relative} after cleaning the output directories (default)"
+    )
+    batch_parser = subparsers.add_parser(
+        "batch", help="Process a directory or glob of pack images, resuming from the manifest of an earlier run"
+    )
+    batch_parser.add_argument("source", help="A directory of pack images, or a glob pattern such as 'packs/**/*.png'")
+    batch_parser.add_argument(
+        "--texts", help="A JSON object or a CSV file (columns file, text) mapping image names to their bottom text"
+    )
+    batch_parser.add_argument("--text", default="", help="The bottom text of images missing from --texts")
+    batch_parser.add_argument("--jobs", type=int, default=1, help="The number of images processed in parallel")
+    batch_parser.add_argument("--manifest", help="The manifest file. Defaults to src/batch_manifest.jsonl")
+    batch_parser.add_argument("--output-dir", default=generated_dir)
+    batch_parser.add_argument("--mask-dir", default=directories.generated_mask_dir)
+    args = parser.parse_args()
+    if args.command == "batch":
+        sys.exit(run_batch_command(args))
+    run_single()
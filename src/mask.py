@@ -3,24 +3,12 @@ import shutil
 from pathlib import Path
 import cv2
 import numpy as np
-from io import BytesIO
-from azure.cognitiveservices.vision.customvision.prediction import (
-    CustomVisionPredictionClient,
-)
-from azure.cognitiveservices.vision.customvision.prediction.models import (
-    ImagePrediction,
-)
 from dotenv import load_dotenv
-from msrest.authentication import ApiKeyCredentials
-from ImageCompression import convert_to_monochrome
+from detection.registry import get_detector
+from ImageCompression import convert_array_to_monochrome, convert_to_monochrome
+from mask_postprocess import close_mask, postprocess_predictions
 
 load_dotenv()
-prediction_key = os.environ["CUSTOM_VISION_KEY"]
-endpoint = os.environ["CUSTOM_VISION_ENDPOINT"]
-prediction_credentials = ApiKeyCredentials(
-    in_headers={"Prediction-key": prediction_key}
-)
-predictor = CustomVisionPredictionClient(endpoint, prediction_credentials)
 
 
 def perform_canny_edge_detection(img):
@@ -82,6 +70,51 @@ def get_edge_contours(img):
     return edge_contours
 
 
+def get_contour_boxes(contours):
+    """
+    Compute the bounding boxes of all contours at once.
+
+    The points of every contour are concatenated into one array and reduced per contour with np.minimum.reduceat and
+    np.maximum.reduceat, which gives the same boxes as calling cv2.boundingRect on each contour.
+
+    Parameters:
+    contours (list): Contours as returned by cv2.findContours.
+
+    Returns:
+    numpy.ndarray: An Nx4 int array of (x1, y1, x2, y2) boxes, with x2 and y2 exclusive.
+    """
+    if len(contours) == 0:
+        return np.zeros((0, 4), np.int64)
+    points = np.concatenate([contour.reshape(-1, 2) for contour in contours]).astype(np.int64)
+    starts = np.cumsum([0] + [len(contour) for contour in contours[:-1]])
+    mins = np.minimum.reduceat(points, starts, axis=0)
+    maxs = np.maximum.reduceat(points, starts, axis=0) + 1
+    return np.hstack([mins, maxs])
+
+
+def get_contours_inside_rois(contour_boxes, rois):
+    """
+    Test which contour boxes lie inside which regions of interest, for all pairs at once.
+
+    Parameters:
+    contour_boxes (numpy.ndarray): An Nx4 array of (x1, y1, x2, y2) contour boxes, see get_contour_boxes.
+    rois (numpy.ndarray): An Mx4 array of (x1, y1, x2, y2) regions of interest.
+
+    Returns:
+    numpy.ndarray: An NxM bool array, True where the contour is inside the region as tested by is_contour_inside_roi.
+    """
+    boxes = np.asarray(contour_boxes)[:, None, :]
+    rois = np.asarray(rois).reshape(-1, 4)[None, :, :]
+    return (
+        (rois[..., 0] <= boxes[..., 0])
+        & (boxes[..., 0] <= rois[..., 2])
+        & (rois[..., 1] <= boxes[..., 1])
+        & (boxes[..., 1] <= rois[..., 3])
+        & (boxes[..., 2] <= rois[..., 2])
+        & (boxes[..., 3] <= rois[..., 3])
+    )
+
+
 def detect_contours_in_rect(img, edge_contours, roi_coordinates):
     '''"""
     This function detects contours within a specified region of interest (ROI) in an image.
@@ -100,44 +133,181 @@ def detect_contours_in_rect(img, edge_contours, roi_coordinates):
         >>> roi_coordinates = (10, 10, 50, 50)
         >>> contours_in_roi = detect_contours_in_rect(img, edge_contours, roi_coordinates)
     """'''
-    contours_inside_roi = []
-    for i, contour in enumerate(edge_contours):
-        if is_contour_inside_roi(contour, roi_coordinates):
-            contours_inside_roi.append(contour)
-    return contours_inside_roi
+    inside = get_contours_inside_rois(get_contour_boxes(edge_contours), [roi_coordinates])[:, 0]
+    return [edge_contours[i] for i in np.flatnonzero(inside)]
 
 
-def create_masks(original_image, prediction_result, mask_dir):
-    '''"""
-    This function creates masks from the prediction results of an original image and saves them in a specified directory.
+def tighten_mask(img, rois, dilation=5):
+    """
+    Replace each region of interest by the union of the edge contours inside it, dilated by `dilation` pixels, so
+    only the detected elements themselves are inpainted instead of the whole box. Regions without contours keep
+    their whole box.
 
-    Args:
-        original_image (str): The path to the original image.
-        prediction_result (list): The list of prediction results.
-        mask_dir (str): The directory where the masks will be saved.
+    Parameters:
+    img (numpy.ndarray): The decoded BGR image.
+    rois (list): The (x1, y1, x2, y2) regions of interest, x2 and y2 exclusive.
+    dilation (int): The number of pixels the contours are grown by, within their region.
 
-    Raises:
-        shutil.SameFileError: If the mask directory and input file directory are the same.
-    """'''
-    filename_with_extension = os.path.basename(original_image)
-    (input_file_name, input_file_ext) = os.path.splitext(filename_with_extension)
-    print(f"Creating masks... from {original_image}")
-    img = cv2.imread(original_image)
+    Returns:
+    numpy.ndarray: The HxW uint8 mask.
+    """
     mask = np.zeros(img.shape[:2], np.uint8)
-    white_color = (255, 255, 255)
+    if len(rois) == 0:
+        return mask
+    rois = np.asarray(rois, np.int64)
     edge_contours = get_edge_contours(img)
-    for i, prediction in enumerate(prediction_result):
-        y = int(prediction.bounding_box.top * img.shape[0]) - 2
-        h = int(prediction.bounding_box.height * img.shape[0]) + 10
-        x = int(prediction.bounding_box.left * img.shape[1]) - 2
-        w = int(prediction.bounding_box.width * img.shape[1]) + 10
-        mask[y : y + h, x : x + w] = 255
+    # Containment is inclusive of the region's far edge, as in is_contour_inside_roi.
+    inside = get_contours_inside_rois(get_contour_boxes(edge_contours), rois)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * dilation + 1, 2 * dilation + 1))
+    for roi_i, (x1, y1, x2, y2) in enumerate(rois):
+        contours = [edge_contours[i] for i in np.flatnonzero(inside[:, roi_i])]
+        if not contours:
+            mask[y1:y2, x1:x2] = 255
+            continue
+        region = np.zeros((y2 - y1, x2 - x1), np.uint8)
+        cv2.drawContours(region, contours, -1, 255, thickness=cv2.FILLED, offset=(int(-x1), int(-y1)))
+        cv2.drawContours(region, contours, -1, 255, thickness=1, offset=(int(-x1), int(-y1)))
+        mask[y1:y2, x1:x2] |= cv2.dilate(region, kernel)
+    return mask
+
+
+def get_mask_coverage(mask):
+    """
+    Fraction of the image covered by a mask.
+
+    Parameters:
+    mask (numpy.ndarray): The mask, non zero pixels are masked.
+
+    Returns:
+    float: The masked share of the pixels, between 0 and 1.
+    """
+    return float(np.count_nonzero(mask)) / mask.size if mask.size else 0.0
+
+
+def load_image(image_path):
+    """
+    Decode an image once, as a BGR array, for the whole mask construction.
+
+    Parameters:
+    image_path (str): The path to the image.
+
+    Returns:
+    numpy.ndarray: The HxWx3 uint8 BGR image.
+
+    Raises:
+    FileNotFoundError: If the image does not exist or cannot be decoded.
+    """
+    img = cv2.imread(str(image_path))
+    if img is None:
+        raise FileNotFoundError(f"Could not read the image {image_path}")
+    return img
+
+
+def get_prediction_rois(img, prediction_result):
+    """
+    Turn normalised prediction boxes into pixel regions of interest, padded by 2 pixels at the top and left and 8 at
+    the bottom and right and clamped to the image.
+
+    Parameters:
+    img (numpy.ndarray): The decoded image.
+    prediction_result (list): The list of prediction results, or None if nothing was detected.
+
+    Returns:
+    list: The (x1, y1, x2, y2) regions, x2 and y2 exclusive.
+    """
+    (height, width) = img.shape[:2]
+    rois = []
+    for prediction in prediction_result or []:
+        y = int(prediction.bounding_box.top * height) - 2
+        h = int(prediction.bounding_box.height * height) + 10
+        x = int(prediction.bounding_box.left * width) - 2
+        w = int(prediction.bounding_box.width * width) + 10
+        rois.append((max(0, x), max(0, y), min(width, x + w), min(height, y + h)))
+    return rois
+
+
+def build_mask(img, prediction_result, tighten=None, postprocess=None):
+    """
+    Paint the predicted boxes into a mask for the image and soften its edges, and list the masked regions.
+
+    With `postprocess` the boxes are padded per class and overlapping or nearby boxes are merged into one region, see
+    mask_postprocess.postprocess_predictions. Only the padded boxes themselves are painted, not the merged regions,
+    and the holes and gaps left between them are closed, see mask_postprocess.close_mask. Without it every box is its
+    own region, padded as in get_prediction_rois.
+
+    Parameters:
+    img (numpy.ndarray): The decoded image.
+    prediction_result (list): The list of prediction results, or None if nothing was detected.
+    tighten (bool): Mask only the edge contours inside each region, see tighten_mask, instead of the whole region.
+        Defaults to the environment variable "TIGHTEN_MASKS" or false.
+    postprocess (bool): Merge the boxes and close the mask. Defaults to the environment variable "MASK_POSTPROCESS"
+        or false.
+
+    Returns:
+    tuple: The HxW uint8 mask, and the regions as dicts with their "box" (x1, y1, x2, y2), x2 and y2 exclusive, and
+        their "tags".
+    """
+    if tighten is None:
+        tighten = os.getenv("TIGHTEN_MASKS", "false").lower() == "true"
+    if postprocess is None:
+        postprocess = os.getenv("MASK_POSTPROCESS", "false").lower() == "true"
+    if postprocess:
+        (rois, regions) = postprocess_predictions(img.shape, prediction_result)
+        rois = [tuple(int(v) for v in box) for box in rois]
+    else:
+        rois = get_prediction_rois(img, prediction_result)
+        regions = [
+            {"box": roi, "tags": [prediction.tag_name]} for (roi, prediction) in zip(rois, prediction_result or [])
+        ]
+    if tighten:
+        mask = tighten_mask(img, rois)
+    else:
+        mask = np.zeros(img.shape[:2], np.uint8)
+        for (x1, y1, x2, y2) in rois:
+            mask[y1:y2, x1:x2] = 255
+    if postprocess and regions:
+        mask = close_mask(mask)
+    mask = cv2.GaussianBlur(
+        mask, (0, 0), sigmaX=1, sigmaY=1, borderType=cv2.BORDER_DEFAULT
+    )
+    return mask, regions
+
+
+def draw_mask(img, prediction_result, tighten=None):
+    """
+    Paint the predicted boxes into a mask for the image and soften its edges, see build_mask.
+
+    Parameters:
+    img (numpy.ndarray): The decoded image.
+    prediction_result (list): The list of prediction results, or None if nothing was detected.
+    tighten (bool): Mask only the edge contours inside each box, see tighten_mask, instead of the whole box. Defaults
+        to the environment variable "TIGHTEN_MASKS" or false.
+
+    Returns:
+    numpy.ndarray: The HxW uint8 mask.
+    """
+    return build_mask(img, prediction_result, tighten)[0]
+
+
+def write_mask_files(original_image, img, mask, mask_dir, write_debug=None):
+    """
+    Write the LaMa inputs for an image to the mask directory: `<name>.png` and `<name>_mask.png`, and with
+    `write_debug` the `<name>_dummy.png` visualisation that keeps only the masked pixels.
+
+    Parameters:
+    original_image (str): The path to the original image, used for the file names. PNG originals are copied as is.
+    img (numpy.ndarray): The decoded original image.
+    mask (numpy.ndarray): The mask.
+    mask_dir (str): The directory where the files will be written.
+    write_debug (bool): Whether to write the debug visualisation. Defaults to the environment variable "DEBUG_MASKS" or false.
+    """
+    if write_debug is None:
+        write_debug = os.getenv("DEBUG_MASKS", "false").lower() == "true"
+    (input_file_name, input_file_ext) = os.path.splitext(os.path.basename(original_image))
     if not os.path.exists(mask_dir):
         os.makedirs(mask_dir)
     if input_file_ext != ".png":
-        cv2.imwrite(
-            os.path.join(mask_dir, f"{input_file_name}.png"), cv2.imread(original_image)
-        )
+        cv2.imwrite(os.path.join(mask_dir, f"{input_file_name}.png"), img)
     else:
         try:
             shutil.copyfile(
@@ -145,43 +315,62 @@ def create_masks(original_image, prediction_result, mask_dir):
             )
         except shutil.SameFileError as sfe:
             print("Looks like the mask dir and input file dir are same")
-    mask = cv2.GaussianBlur(
-        mask, (0, 0), sigmaX=1, sigmaY=1, borderType=cv2.BORDER_DEFAULT
-    )
     cv2.imwrite(os.path.join(mask_dir, f"{input_file_name}_mask.png"), mask)
-    img = cv2.imread(original_image)
-    img[mask == 0] = 255
-    cv2.imwrite(os.path.join(mask_dir, f"{input_file_name}_dummy.png"), img)
+    if write_debug:
+        dummy = img.copy()
+        dummy[mask == 0] = 255
+        cv2.imwrite(os.path.join(mask_dir, f"{input_file_name}_dummy.png"), dummy)
 
 
-def get_predictions(file_path: Path):
+def create_masks(original_image, prediction_result, mask_dir, img=None, write_debug=None):
     '''"""
-    This function takes a file path as input, converts the image at the file path to monochrome, and then uses a predictor to detect images.
+    This function creates masks from the prediction results of an original image and saves them in a specified directory.
+    When there are no prediction results an empty mask is written.
 
-    The predictor uses the project ID and published name from the environment variables "CUSTOM_VISION_PROJECT_ID" and "CUSTOM_VISION_ITERATION_NAME" respectively.
+    Args:
+        original_image (str): The path to the original image.
+        prediction_result (list): The list of prediction results, or None if nothing was detected.
+        mask_dir (str): The directory where the masks will be saved.
+        img (numpy.ndarray, optional): The already decoded original image. Decoded from `original_image` when not given.
+        write_debug (bool, optional): Whether to also write the `_dummy.png` visualisation, see `write_mask_files`.
 
-    The image data is read in bytes. The function then returns a list of predictions with a probability greater than 0.8.
+    Returns:
+        float: The share of the image covered by the mask, see get_mask_coverage.
+
+    Raises:
+        shutil.SameFileError: If the mask directory and input file directory are the same.
+    """'''
+    print(f"Creating masks... from {original_image}")
+    if img is None:
+        img = load_image(original_image)
+    mask = draw_mask(img, prediction_result)
+    write_mask_files(original_image, img, mask, mask_dir, write_debug)
+    return get_mask_coverage(mask)
+
+
+def get_predictions(file_path: Path, img=None):
+    '''"""
+    This function takes a file path as input, converts the image at the file path (or the already decoded image) to monochrome, and then uses the detector to detect objects.
+
+    The detector is created on first use and reused. Its backend is selected with the environment variable "DETECTOR_BACKEND": "custom_vision" calls the published Custom Vision iteration, "onnx" runs its ONNX export locally, "fake" replays predictions recorded by the "record" backend. The function then returns a list of predictions with a probability greater than 0.8.
 
     If no predictions are found, the function prints a message and returns None.
 
     Args:
         file_path (Path): The path of the image file to be processed.
+        img (numpy.ndarray, optional): The already decoded BGR image, so the file is not decoded again.
 
     Returns:
         list: A list of predictions with a probability greater than 0.8. Returns None if no predictions are found.
     """'''
-    monochrome_image = convert_to_monochrome(file_path)
-    with BytesIO() as byte_io:
-        monochrome_image.save(byte_io, format="PNG")
-        byte_io.seek(0)
-        image_bytes = byte_io.read()
-    results = predictor.detect_image(
-        project_id=os.environ["CUSTOM_VISION_PROJECT_ID"],
-        published_name=os.environ["CUSTOM_VISION_ITERATION_NAME"],
-        image_data=image_bytes,
-    )
+    if img is not None:
+        monochrome_image = convert_array_to_monochrome(img)
+    else:
+        monochrome_image = convert_to_monochrome(file_path)
     prediction_result = [
-        prediction for prediction in results.predictions if prediction.probability > 0.8
+        prediction
+        for prediction in get_detector().detect(monochrome_image)
+        if prediction.probability > 0.8
     ]
     if len(prediction_result) == 0:
         print("No predictions found for the image")
@@ -199,7 +388,8 @@ def create_mask_and_write(base_image_location: Path, pack_dir, generated_mask_di
         generated_mask_dir (str): The directory where the generated mask will be written.
 
     Returns:
-        None
+        float: The share of the image covered by the mask.
     """'''
-    predictions = get_predictions(pack_dir)
-    create_masks(base_image_location, predictions, generated_mask_dir)
+    img = load_image(base_image_location)
+    predictions = get_predictions(pack_dir, img if str(pack_dir) == str(base_image_location) else None)
+    return create_masks(base_image_location, predictions, generated_mask_dir, img)
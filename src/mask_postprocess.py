@@ -0,0 +1,177 @@
+import logging
+
+import cv2
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# (before, after) padding in pixels per Custom Vision tag: added to the top and left, and to the bottom and right of
+# the predicted box. Nutrient tables usually have a ruled border just outside the predicted box.
+CLASS_PADDING = {
+    "nutrients": (4, 12),
+    "additional_text": (2, 8),
+    "weight": (2, 8),
+}
+DEFAULT_PADDING = (2, 8)
+
+
+def pad_prediction_boxes(predictions: list, width: int, height: int, class_padding: dict = None) -> tuple:
+    """
+    Convert normalised prediction boxes to pixel boxes padded by the padding of their tag, clamped to the image.
+
+    Parameters:
+    predictions (list): The predictions, with tag_name and a normalised bounding_box.
+    width (int): The image width.
+    height (int): The image height.
+    class_padding (dict): The (before, after) padding per tag. Defaults to CLASS_PADDING, DEFAULT_PADDING for other tags.
+
+    Returns:
+    tuple: An Nx4 int array of (x1, y1, x2, y2) boxes with exclusive end coordinates, and the N tag names.
+    """
+    class_padding = CLASS_PADDING if class_padding is None else class_padding
+    boxes = []
+    tags = []
+    for prediction in predictions or []:
+        (before, after) = class_padding.get(prediction.tag_name, DEFAULT_PADDING)
+        box = prediction.bounding_box
+        boxes.append(
+            (
+                max(0, int(box.left * width) - before),
+                max(0, int(box.top * height) - before),
+                min(width, int((box.left + box.width) * width) + after),
+                min(height, int((box.top + box.height) * height) + after),
+            )
+        )
+        tags.append(prediction.tag_name)
+    return np.array(boxes, np.int64).reshape(-1, 4), tags
+
+
+def get_box_links(boxes: np.ndarray, iou_threshold: float, max_gap: int) -> np.ndarray:
+    """
+    Decide for every pair of boxes whether they belong to the same region: their IoU is at least `iou_threshold`, or
+    the gap between them is at most `max_gap` pixels along both axes (touching and overlapping boxes have no gap).
+
+    Returns:
+    numpy.ndarray: An NxN bool array.
+    """
+    (a, b) = (boxes[:, None, :], boxes[None, :, :])
+    inter_w = np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0])
+    inter_h = np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1])
+    intersection = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    union = areas[:, None] + areas[None, :] - intersection
+    iou = np.divide(intersection, union, out=np.zeros(intersection.shape), where=union > 0)
+    return (iou >= iou_threshold) | ((-inter_w <= max_gap) & (-inter_h <= max_gap))
+
+
+def find(parents: list[int], i: int) -> int:
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+
+def merge_boxes(boxes: np.ndarray, tags: list[str], iou_threshold: float = 0.1, max_gap: int = 8) -> list[dict]:
+    """
+    Merge boxes that overlap or lie within `max_gap` pixels of each other into regions, with union-find over the
+    pairwise links of get_box_links. Merging is repeated on the merged regions until they are all apart, since a
+    merged region can reach boxes none of its members reached.
+
+    Parameters:
+    boxes (numpy.ndarray): An Nx4 array of (x1, y1, x2, y2) boxes with exclusive end coordinates.
+    tags (list[str]): The tag of each box.
+    iou_threshold (float): The IoU from which two boxes are merged.
+    max_gap (int): The largest gap in pixels between two boxes that are merged.
+
+    Returns:
+    list[dict]: The regions, each with its "box" (x1, y1, x2, y2) and the sorted "tags" of the merged boxes.
+    """
+    regions = [{"box": tuple(int(v) for v in box), "tags": {tag}} for (box, tag) in zip(boxes, tags)]
+    while len(regions) > 1:
+        region_boxes = np.array([region["box"] for region in regions], np.int64)
+        links = get_box_links(region_boxes, iou_threshold, max_gap)
+        parents = list(range(len(regions)))
+        for (i, j) in zip(*np.nonzero(np.triu(links, k=1))):
+            parents[find(parents, i)] = find(parents, j)
+        groups: dict[int, list[int]] = {}
+        for i in range(len(regions)):
+            groups.setdefault(find(parents, i), []).append(i)
+        if len(groups) == len(regions):
+            break
+        regions = [
+            {
+                "box": (
+                    int(region_boxes[members, 0].min()),
+                    int(region_boxes[members, 1].min()),
+                    int(region_boxes[members, 2].max()),
+                    int(region_boxes[members, 3].max()),
+                ),
+                "tags": set().union(*(regions[i]["tags"] for i in members)),
+            }
+            for members in groups.values()
+        ]
+    return [{"box": region["box"], "tags": sorted(region["tags"])} for region in regions]
+
+
+def box_sum(binary: np.ndarray, size: int, pad_value: int) -> np.ndarray:
+    """
+    Count the set pixels in the size x size window centred on every pixel, from the integral image. Pixels outside
+    the image count as `pad_value`.
+    """
+    padded = np.pad(binary.astype(np.uint8), size // 2, constant_values=pad_value)
+    integral = cv2.integral(padded)
+    (height, width) = binary.shape
+    return (
+        integral[size:size + height, size:size + width]
+        - integral[:height, size:size + width]
+        - integral[size:size + height, :width]
+        + integral[:height, :width]
+    )
+
+
+def close_mask(mask: np.ndarray, size: int = 7) -> np.ndarray:
+    """
+    Morphological closing with a size x size square, computed with integral images: a dilation (any pixel of the
+    window set) followed by an erosion (every pixel of the window set). Fills holes and gaps narrower than `size`.
+    The cost does not depend on the window size.
+
+    Parameters:
+    mask (numpy.ndarray): The HxW uint8 mask.
+    size (int): The odd window side length.
+
+    Returns:
+    numpy.ndarray: The closed HxW uint8 mask, 0 or 255.
+    """
+    binary = mask > 0
+    dilated = box_sum(binary, size, 0) > 0
+    closed = box_sum(dilated, size, 1) == size * size
+    return closed.astype(np.uint8) * 255
+
+
+def postprocess_predictions(
+        image_shape: tuple,
+        predictions: list,
+        class_padding: dict = None,
+        iou_threshold: float = 0.1,
+        max_gap: int = 8,
+) -> tuple:
+    """
+    Pad the predicted boxes by class and merge them into regions, see pad_prediction_boxes and merge_boxes. The
+    padded boxes are what should be masked: a merged region is the bounding box of its members and also covers the
+    background between them, e.g. everything between two diagonally adjacent boxes.
+
+    Parameters:
+    image_shape (tuple): The image shape, (height, width, ...).
+    predictions (list): The predictions, or None.
+    class_padding (dict): The (before, after) padding per tag.
+    iou_threshold (float): The IoU from which two boxes are merged.
+    max_gap (int): The largest gap in pixels between two boxes that are merged.
+
+    Returns:
+    tuple: The Nx4 int array of padded (x1, y1, x2, y2) boxes, and the merged regions.
+    """
+    (height, width) = image_shape[:2]
+    (boxes, tags) = pad_prediction_boxes(predictions, width, height, class_padding)
+    regions = merge_boxes(boxes, tags, iou_threshold, max_gap)
+    log.info(f"Merged {len(boxes)} box(es) into {len(regions)} region(s)")
+    return boxes, regions
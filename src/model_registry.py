@@ -0,0 +1,194 @@
+import logging
+import os
+import threading
+import time
+
+import torch
+import yaml
+from omegaconf import OmegaConf
+from saicinpainting.training.trainers import load_checkpoint
+
+log = logging.getLogger(__name__)
+
+PRECISIONS = ("fp32", "int8", "bf16")
+
+
+class LoadedModel:
+    def __init__(self, model, key: tuple, load_seconds: float):
+        """
+        A checkpoint that has been loaded into memory by the ModelRegistry.
+
+        Args:
+            model: The frozen LaMa training module returned by `load_checkpoint`.
+            key (tuple): The registry key (model path, checkpoint name, device, weight precision) the model is stored under.
+            load_seconds (float): Wall clock time it took to read the config and load the checkpoint.
+        """
+        self.model = model
+        self.key = key
+        self.load_seconds = load_seconds
+
+    def __repr__(self):
+        return f"LoadedModel(key={self.key}, load_seconds={self.load_seconds:.2f})"
+
+
+def get_weight_precision(precision: str) -> str:
+    """
+    Returns the precision of the weights a model is loaded with. Only int8 changes the loaded weights, fp32 and bf16
+    share the same model.
+    """
+    return "int8" if precision == "int8" else "fp32"
+
+
+def quantize_generator(generator: torch.nn.Module) -> torch.nn.Module:
+    """
+    Apply dynamic int8 quantisation to the linear layers of the generator. Convolutions stay in fp32: dynamically
+    quantised convolutions are documented by PyTorch as inaccurate, and in big-lama they would mostly hit the 1x1
+    convolutions of the Fourier units, which run in the frequency domain. They should only be added once
+    benchmark/precision_drift.py shows an acceptable PSNR against fp32.
+
+    Raises:
+        ValueError: If the generator has no linear layers, as big-lama's has not: int8 would change nothing but keep
+            a second fp32 copy of the checkpoint in the registry.
+    """
+    qconfig_spec = {
+        name: torch.ao.quantization.default_dynamic_qconfig
+        for (name, module) in generator.named_modules()
+        if isinstance(module, torch.nn.Linear)
+    }
+    if not qconfig_spec:
+        raise ValueError("The generator has no linear layers to quantise, use the fp32 precision instead of int8")
+    log.info(f"Quantising {len(qconfig_spec)} layer(s) to int8")
+    return torch.ao.quantization.quantize_dynamic(
+        generator,
+        qconfig_spec=qconfig_spec,
+        mapping={torch.nn.Linear: torch.ao.nn.quantized.dynamic.Linear},
+        dtype=torch.qint8,
+    )
+
+
+def load_model(model_path: str, checkpoint: str, device=None, precision: str = "fp32"):
+    """
+    Load a LaMa checkpoint the same way the lama prediction script does.
+
+    Args:
+        model_path (str): The directory holding `config.yaml` and the `models` folder.
+        checkpoint (str): The checkpoint file name inside `models`, e.g. `best.ckpt`.
+        device (torch.device, optional): The device to move the model to. When None the model stays on the CPU,
+            which is what the refinement path expects.
+        precision (str, optional): "int8" quantises the generator's linear layers, which only runs on the CPU, and
+            fails for generators without any, see `quantize_generator`.
+            Other precisions load the fp32 weights; bf16 is applied with autocast at inference time.
+
+    Returns:
+        The frozen model.
+    """
+    train_config_path = os.path.join(model_path, "config.yaml")
+    with open(train_config_path, "r") as f:
+        train_config = OmegaConf.create(yaml.safe_load(f))
+    train_config.training_model.predict_only = True
+    train_config.visualizer.kind = "noop"
+    checkpoint_path = os.path.join(model_path, "models", checkpoint)
+    model = load_checkpoint(
+        train_config, checkpoint_path, strict=False, map_location="cpu"
+    )
+    model.freeze()
+    if precision == "int8":
+        if device is not None and torch.device(device).type != "cpu":
+            log.warning(f"int8 quantisation is only supported on the CPU, keeping fp32 weights on {device}")
+        else:
+            model.generator = quantize_generator(model.generator)
+    if device is not None:
+        model.to(device)
+    return model
+
+
+class ModelRegistry:
+    """
+    Keeps LaMa checkpoints resident for the lifetime of the process so that repeated inpainting calls do not pay for
+    reading and deserialising the checkpoint every time. Models are keyed by model path, checkpoint name, device and
+    precision.
+    """
+
+    def __init__(self):
+        self._models: dict[tuple, LoadedModel] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model_path: str, checkpoint: str, device=None, precision: str = "fp32") -> tuple:
+        return (
+            os.path.abspath(str(model_path)),
+            checkpoint,
+            None if device is None else str(torch.device(device)),
+            get_weight_precision(precision),
+        )
+
+    def get(self, model_path: str, checkpoint: str, device=None, precision: str = "fp32") -> LoadedModel:
+        """
+        Return the loaded model for the given key, loading it on first use.
+
+        Args:
+            model_path (str): The directory of the LaMa model.
+            checkpoint (str): The checkpoint file name.
+            device (optional): The device the model should live on. None keeps it on the CPU without moving it.
+            precision (str, optional): One of PRECISIONS. Defaults to "fp32".
+
+        Returns:
+            LoadedModel: The cached model together with the time its load took.
+        """
+        key = self.make_key(model_path, checkpoint, device, precision)
+        with self._lock:
+            loaded = self._models.get(key)
+            if loaded is None:
+                start = time.perf_counter()
+                model = load_model(
+                    key[0], checkpoint, None if device is None else torch.device(device), key[3]
+                )
+                loaded = LoadedModel(model, key, time.perf_counter() - start)
+                self._models[key] = loaded
+                log.info(f"Loaded {key} in {loaded.load_seconds:.2f}s")
+            return loaded
+
+    def warm_up(self, model_path: str, checkpoint: str, device=None, precision: str = "fp32") -> float:
+        """
+        Load the model ahead of the first request.
+
+        Returns:
+            float: The time spent loading, or 0.0 if the model was already resident.
+        """
+        was_loaded = self.is_loaded(model_path, checkpoint, device, precision)
+        loaded = self.get(model_path, checkpoint, device, precision)
+        return 0.0 if was_loaded else loaded.load_seconds
+
+    def is_loaded(self, model_path: str, checkpoint: str, device=None, precision: str = "fp32") -> bool:
+        with self._lock:
+            return self.make_key(model_path, checkpoint, device, precision) in self._models
+
+    def unload(self, model_path: str = None, checkpoint: str = None, device=None, precision: str = None) -> int:
+        """
+        Drop cached models so their memory can be reclaimed. Arguments left as None match every model.
+
+        Returns:
+            int: The number of models that were unloaded.
+        """
+        with self._lock:
+            keys = [
+                key
+                for key in self._models
+                if (model_path is None or key[0] == os.path.abspath(str(model_path)))
+                and (checkpoint is None or key[1] == checkpoint)
+                and (device is None or key[2] == str(torch.device(device)))
+                and (precision is None or key[3] == get_weight_precision(precision))
+            ]
+            for key in keys:
+                del self._models[key]
+        if keys and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        log.info(f"Unloaded {len(keys)} model(s)")
+        return len(keys)
+
+    def load_times(self) -> dict[tuple, float]:
+        with self._lock:
+            return {key: loaded.load_seconds for key, loaded in self._models.items()}
+
+
+registry = ModelRegistry()
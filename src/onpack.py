@@ -3,53 +3,76 @@ import os
 import shutil
 import tempfile
 from pathlib import Path
+import cv2
+import numpy as np
 from dotenv import load_dotenv
 import cornerlozenges
 import directories
 import inpaint_lama
 from directories import fonts_dir
+from flat_fill_inpaint import FlatFillInpainter
+from inpaint import Inpainter
+from inpaint_cache import get_default_cache
 from inpaint_lama import LamaInpainter
-from mask import create_mask_and_write, get_predictions, create_masks
+from mask import create_mask_and_write, get_predictions, build_mask, get_mask_coverage, load_image, write_mask_files
 load_dotenv()
 logger = logging.getLogger(__name__)
 
 def create_mask_and_write(original_image: str, mask_dir: Path, generated_dir: Path):
     '''"""
-This function creates a mask for an original image and writes it to a specified directory.
+This function creates a mask for an original image and writes it to a specified directory. The original is decoded once and the same array is used for detection, mask drawing and writing the LaMa inputs.
 
 Args:
     original_image (str): The path to the original image.
     mask_dir (Path): The directory where the mask will be written.
     generated_dir (Path): The directory where the generated image will be written.
 
+Returns:
+    tuple: The decoded BGR image, its mask and the masked regions, see `build_mask`.
+
 Raises:
     FileNotFoundError: If the original image does not exist.
 
 Note:
     This function uses the `get_predictions` function to generate predictions for the original image.
-    It then uses the `create_masks` function to create a mask based on these predictions.
-    The mask is then written to the `mask_dir`.
+    It then uses the `build_mask` function to create a mask based on these predictions.
+    The mask is then written to the `mask_dir` with `write_mask_files`.
 """'''
-    predictions = get_predictions(Path(original_image))
-    create_masks(original_image, predictions, mask_dir)
+    img = load_image(original_image)
+    predictions = get_predictions(Path(original_image), img)
     print('Waiting for mask to be created')
+    (mask, regions) = build_mask(img, predictions)
+    write_mask_files(original_image, img, mask, mask_dir)
+    return (img, mask, regions)
 
-def generate_onpack(orignal_file: Path, temp_mask_dir: Path, temp_generated_dir: Path, bottom_text: str, final_mask_dir: str=directories.generated_mask_dir, final_output_dir: str=directories.generated_dir) -> str:
+def generate_onpack(orignal_file: Path, temp_mask_dir: Path, temp_generated_dir: Path, bottom_text: str, final_mask_dir: str=directories.generated_mask_dir, final_output_dir: str=directories.generated_dir, inpaint_mode: str=os.getenv('INPAINT_MODE', 'full'), inpaint_engine: str=os.getenv('INPAINT_ENGINE', 'lama'), use_cache: bool=os.getenv('INPAINT_CACHE', 'true').lower() == 'true', min_mask_coverage: float=float(os.getenv('MIN_MASK_COVERAGE', '0.0005')), max_image_memory_mb: float=float(os.getenv('INPAINT_MAX_MEMORY_MB')) if os.getenv('INPAINT_MAX_MEMORY_MB') else None, run_info: dict=None, lama_inpainter: Inpainter=None) -> str:
     '''"""
-This function generates an onpack image by creating a mask and writing it to a temporary directory. It then copies the mask files to a final directory for future debugging. If the environment variable "ONLY_MASK" is set to "false", it uses either the LamaInpainter or ZitsInpainter to inpaint the image. If a bottom text is provided, it is processed and added to the image. The function raises an exception if more than one file is generated. The final image is then copied to the output directory.
+This function generates an onpack image by creating a mask and writing it to a temporary directory. It then copies the mask files to a final directory for future debugging. If the environment variable "ONLY_MASK" is set to "false", it inpaints the image in memory with the LamaInpainter (or the FlatFillInpainter, which only hands textured regions to LaMa) and writes the result straight to the output directory. Unless disabled, the inpainting cache is checked first so that a resubmitted image with the same mask and settings is not inpainted again. When nothing was detected, or the mask covers less than `min_mask_coverage` of the image, inpainting is skipped and the original image is used as is. If a bottom text is provided, it is processed and added to the image.
 
 Args:
     orignal_file (Path): The path of the original file.
     temp_mask_dir (Path): The path of the temporary mask directory.
-    temp_generated_dir (Path): The path of the temporary generated directory.
+    temp_generated_dir (Path): The path of the temporary generated directory. Unused by the in-memory inpainting, kept for compatibility.
     bottom_text (str): The text to be added at the bottom of the image.
     final_mask_dir (str, optional): The path of the final mask directory. Defaults to directories.generated_mask_dir.
     final_output_dir (str, optional): The path of the final output directory. Defaults to directories.generated_dir.
+    inpaint_mode (str, optional): The LamaInpainter mode, e.g. "full" or "fast" for a quick preview. Defaults to the value of the environment variable "INPAINT_MODE" or "full".
+    inpaint_engine (str, optional): "lama" to inpaint every region with LaMa, or "flat" to fill uniform backgrounds with a colour or gradient fit and use LaMa only for textured regions. Defaults to the value of the environment variable "INPAINT_ENGINE" or "lama".
+    use_cache (bool, optional): Whether to read and fill the inpainting result cache. Defaults to the value of the environment variable "INPAINT_CACHE" or true.
+    min_mask_coverage (float, optional): The share of the image the mask must cover to be inpainted. Defaults to the value of the environment variable "MIN_MASK_COVERAGE" or 0.0005.
+    max_image_memory_mb (float, optional): The estimated activation memory inpainting may use. Larger images are inpainted at a lower resolution and only the masked region is composited back. Defaults to the value of the environment variable "INPAINT_MAX_MEMORY_MB", or no limit when it is not set. The estimate is not calibrated against measured memory use, so only set a limit after checking it on the target host.
+    run_info (dict, optional): Filled with what happened to the image: "mask_coverage", the "mask_regions" (merged boxes and their tags, see `build_mask`), "inpainting" ("done", or "skipped" together with a "reason") and, when the image was inpainted, what `inpaint_and_write` reports ("memory_decisions", and "routes" and "routing" for the flat engine), so batch runs and the UI can count skipped, downscaled and flat filled images.
+    lama_inpainter (Inpainter, optional): The LaMa inpainter to use instead of a new LamaInpainter, e.g. the PooledInpainter a batch shares between its jobs. `inpaint_mode` and `max_image_memory_mb` are then those it was created with.
 
 Returns:
-    str: The path of the copied file location if "ONLY_MASK" is set to "false", else the path of the mask file.
+    str: The path of the inpainted file in the output directory if "ONLY_MASK" is set to "false", else the path of the mask file.
 """'''
-    create_mask_and_write(str(orignal_file), Path(temp_mask_dir), Path(temp_generated_dir))
+    if run_info is None:
+        run_info = {}
+    (image, mask, regions) = create_mask_and_write(str(orignal_file), Path(temp_mask_dir), Path(temp_generated_dir))
+    mask_coverage = get_mask_coverage(mask)
+    run_info['mask_coverage'] = mask_coverage
+    run_info['mask_regions'] = regions
     for ff in os.listdir(temp_mask_dir):
         if ff.endswith('.png'):
             if ff.endswith('_mask.png'):
@@ -60,25 +83,66 @@ Returns:
                 pass
             logger.debug('Copied files from {} to {}'.format(temp_mask_dir, final_mask_dir))
     if os.getenv('ONLY_MASK', 'false').lower() == 'false':
-        inpainter = LamaInpainter(str(directories.big_lama_model_dir), str(temp_mask_dir), str(temp_generated_dir), '.png')
-        inpaint_ouput: list[str] = inpainter.inpaint()
-        for image_file in inpaint_ouput:
-            if bottom_text != '' and bottom_text is not None:
-                modified_image = cornerlozenges.process(image_file, font_dir=fonts_dir, text=bottom_text)
-                modified_image.save(image_file)
-        if len(inpaint_ouput) != 1:
-            raise Exception(f'Was expecting exactly one file, but got {len(inpaint_ouput)}')
-        logger.info('Copying file {} to output directory'.format(inpaint_ouput[0]))
-        try:
-            src = os.path.join(temp_generated_dir, inpaint_ouput[0])
-            copied_file_location = shutil.copy2(src, os.path.join(final_output_dir, f'output_{os.path.basename(src)}'))
-        except shutil.SameFileError as sfe:
-            logger.error(f'Ignoring SameFileError. This must be runnning with main.py. The message is {str(sfe)}')
-            copied_file_location = os.path.join(temp_generated_dir, inpaint_ouput[0])
-        return copied_file_location
+        input_file_name = Path(orignal_file).stem
+        output_file = os.path.join(final_output_dir, f'output_{input_file_name}_mask.png')
+        if mask_coverage < min_mask_coverage:
+            reason = 'no detections' if mask_coverage == 0 else 'mask coverage {:.5f} below {}'.format(mask_coverage, min_mask_coverage)
+            logger.info('Skipping inpainting of {}: {}'.format(orignal_file, reason))
+            run_info.update(inpainting='skipped', reason=reason)
+            shutil.copyfile(os.path.join(temp_mask_dir, f'{input_file_name}.png'), output_file)
+        else:
+            run_info['inpainting'] = 'done'
+            run_info.update(inpaint_and_write(image, mask, output_file, inpaint_mode, inpaint_engine, use_cache, max_image_memory_mb, lama_inpainter))
+        if bottom_text != '' and bottom_text is not None:
+            modified_image = cornerlozenges.process(output_file, font_dir=fonts_dir, text=bottom_text)
+            modified_image.save(output_file)
+        return output_file
     else:
         return mask_file
 
+def inpaint_and_write(image: np.ndarray, mask: np.ndarray, output_file: str, inpaint_mode: str, inpaint_engine: str, use_cache: bool, max_image_memory_mb: float=None, lama_inpainter: Inpainter=None) -> dict:
+    '''"""
+This function inpaints the image and mask returned by `create_mask_and_write` in memory and writes the result to the output file, going through the inpainting cache when enabled.
+
+Args:
+    image (np.ndarray): The decoded BGR original image.
+    mask (np.ndarray): Its mask.
+    output_file (str): The path the inpainted image is written to.
+    inpaint_mode (str): The LamaInpainter mode.
+    inpaint_engine (str): "lama" or "flat", see `generate_onpack`.
+    use_cache (bool): Whether to read and fill the inpainting result cache.
+    max_image_memory_mb (float, optional): The memory budget of a single LaMa input, see `LamaInpainter`.
+    lama_inpainter (Inpainter, optional): The LaMa inpainter to use. Defaults to a new LamaInpainter with `inpaint_mode` and `max_image_memory_mb`.
+
+Returns:
+    dict: "cache_hit", the "memory_decisions" of the memory governor for the LaMa inputs and, with the flat engine, the per region "routes" of the FlatFillInpainter and their "routing" summary (see `FlatFillInpainter.routing_stats`). Decisions and routes are empty on a cache hit, and the decisions are empty when the flat engine did not hand any region to LaMa.
+"""'''
+    if lama_inpainter is None:
+        lama_inpainter = LamaInpainter(str(directories.big_lama_model_dir), mode=inpaint_mode, max_image_memory_mb=max_image_memory_mb)
+    inpainter = lama_inpainter
+    if inpaint_engine == 'flat':
+        inpainter = FlatFillInpainter(fallback=lama_inpainter)
+    inpainted_image = None
+    if use_cache:
+        cache = get_default_cache()
+        cache_key = cache.make_key(image, mask, inpainter.get_cache_identity())
+        inpainted_image = cache.get(cache_key)
+    info = {'cache_hit': inpainted_image is not None, 'memory_decisions': []}
+    if inpaint_engine == 'flat':
+        info.update(routes=[], routing=None)
+    if inpainted_image is None:
+        inpainted_image = inpainter.inpaint_array(image, mask)
+        if use_cache:
+            cache.put(cache_key, inpainted_image)
+        if inpaint_engine == 'flat':
+            info.update(routes=inpainter.last_routes, routing=inpainter.routing_stats(inpainter.last_routes))
+        # The decisions are those of the last LaMa call of this thread, which belong to another image when every region was filled without LaMa.
+        if inpaint_engine != 'flat' or any(route['route'] == 'lama' for route in inpainter.last_routes):
+            info['memory_decisions'] = lama_inpainter.last_memory_decisions
+    logger.info('Writing inpainted image to {}'.format(output_file))
+    cv2.imwrite(output_file, inpainted_image)
+    return info
+
 def generate_mrhi_onpack(original_image: Path, mask_image: Path, output_image: Path, bottom_text: str, big_lama_model_dir: Path=directories.big_lama_model_dir):
     '''"""
 This function generates a modified image with a mask and text overlay, using the Big LAMA model for inpainting.
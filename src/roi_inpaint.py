@@ -0,0 +1,118 @@
+import logging
+from typing import Callable
+
+import cv2
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+def boxes_overlap(box_a: tuple, box_b: tuple) -> bool:
+    """
+    Check if two (x1, y1, x2, y2) boxes with exclusive end coordinates overlap or touch.
+    """
+    return (
+        box_a[0] <= box_b[2]
+        and box_b[0] <= box_a[2]
+        and box_a[1] <= box_b[3]
+        and box_b[1] <= box_a[3]
+    )
+
+
+def merge_overlapping_boxes(boxes: list[tuple]) -> list[tuple]:
+    """
+    Merge (x1, y1, x2, y2) boxes that overlap into their common bounding box until no two boxes overlap.
+
+    Parameters:
+    boxes (list[tuple]): The boxes to merge.
+
+    Returns:
+    list[tuple]: The merged boxes.
+    """
+    merged = list(boxes)
+    changed = True
+    while changed:
+        changed = False
+        result = []
+        for box in merged:
+            for i, other in enumerate(result):
+                if boxes_overlap(box, other):
+                    result[i] = (
+                        min(box[0], other[0]),
+                        min(box[1], other[1]),
+                        max(box[2], other[2]),
+                        max(box[3], other[3]),
+                    )
+                    changed = True
+                    break
+            else:
+                result.append(box)
+        merged = result
+    return merged
+
+
+def find_mask_regions(mask: np.ndarray, margin: int) -> list[tuple]:
+    """
+    Find the connected regions of a mask and grow each of them by a context margin.
+
+    Parameters:
+    mask (numpy.ndarray): The HxW mask. Non zero pixels are inpainted.
+    margin (int): The number of context pixels added around each region, clamped to the image.
+
+    Returns:
+    list[tuple]: The (x1, y1, x2, y2) crop boxes, with overlapping crops merged.
+    """
+    (height, width) = mask.shape[:2]
+    (num_labels, _, stats, _) = cv2.connectedComponentsWithStats(
+        (mask > 0).astype(np.uint8), connectivity=8
+    )
+    boxes = []
+    for label in range(1, num_labels):
+        (x, y, w, h) = stats[label][:4]
+        boxes.append(
+            (
+                max(0, int(x) - margin),
+                max(0, int(y) - margin),
+                min(width, int(x + w) + margin),
+                min(height, int(y + h) + margin),
+            )
+        )
+    return merge_overlapping_boxes(boxes)
+
+
+def inpaint_regions(
+    predict_arrays: Callable[[list, list], list],
+    image: np.ndarray,
+    mask: np.ndarray,
+    margin: int,
+) -> np.ndarray:
+    """
+    Inpaint only the masked regions of an image. Each region is cropped with a context margin, all crops are inpainted
+    in one call (so equally sized crops share a batch) and the inpainted pixels are written back into a copy of the
+    full resolution original.
+
+    Parameters:
+    predict_arrays (Callable): Inpaints a list of BGR images with their masks and returns the BGR results.
+    image (numpy.ndarray): The HxWx3 uint8 BGR image.
+    mask (numpy.ndarray): The HxW uint8 mask.
+    margin (int): The number of context pixels kept around each region.
+
+    Returns:
+    numpy.ndarray: The inpainted image.
+    """
+    regions = find_mask_regions(mask, margin)
+    result = image.copy()
+    if len(regions) == 0:
+        return result
+    crop_area = sum((x2 - x1) * (y2 - y1) for (x1, y1, x2, y2) in regions)
+    log.info(
+        f"Inpainting {len(regions)} region(s) covering {crop_area / (image.shape[0] * image.shape[1]):.1%} of the image"
+    )
+    crops = [image[y1:y2, x1:x2] for (x1, y1, x2, y2) in regions]
+    crop_masks = [mask[y1:y2, x1:x2] for (x1, y1, x2, y2) in regions]
+    for (x1, y1, x2, y2), crop_mask, inpainted in zip(
+        regions, crop_masks, predict_arrays(crops, crop_masks)
+    ):
+        masked = crop_mask > 0
+        result[y1:y2, x1:x2][masked] = inpainted[masked]
+    return result
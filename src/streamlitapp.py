@@ -34,12 +34,15 @@ This function is used to display the on-pack frame. It allows the user to upload
         'Upload the human generated MRHI image for evaluation')
     text_input = st.text_input(
         'Bottom Lozenges Text', placeholder='Enter information about the product here')
+    fast_preview = st.checkbox(
+        'Fast preview', help='Inpaint at a lower resolution for a quicker, rougher result')
     generate_button = st.button('Generate')
     if original_image is None and generate_button:
         st.warning('Please upload the original image')
     if generate_button:
+        run_info = {}
         (generated_image, validation_results, evaluated_result) = generate_event_handler.on_pack_generate_clicked(
-            original_image, original_mrhi_image, text_input)
+            original_image, original_mrhi_image, text_input, inpaint_mode='fast' if fast_preview else None, run_info=run_info)
         (col1, col2) = st.columns(2)
         col1.image(original_image, caption='Original Image',
                    use_column_width=True)
@@ -53,6 +56,11 @@ This function is used to display the on-pack frame. It allows the user to upload
             with st.expander('Validation Results'):
                 df = pd.DataFrame(validation_results)
                 st.table(df)
+        if run_info.get('routing') is not None:
+            with st.expander('Inpainting Routes'):
+                st.write('Share of the masked area filled without LaMa: {:.1%}'.format(run_info['routing']['saved_pixel_share']))
+                df = pd.DataFrame({route: values for route, values in run_info['routing'].items() if route != 'saved_pixel_share'}).T
+                st.table(df)
 
 
 def display_off_pack():
@@ -0,0 +1,136 @@
+import argparse
+import json
+import logging
+import os
+import socket
+import sys
+import time
+
+import cv2
+import torch
+
+import directories
+
+log = logging.getLogger(__name__)
+
+
+def load_tuned_threads(budget_file: str = directories.thread_budget_file) -> int:
+    """
+    Read the thread count the autotune command saved for this host.
+
+    Returns:
+    int: The tuned thread count, or None if this host has not been tuned.
+    """
+    if not os.path.exists(budget_file):
+        return None
+    with open(budget_file, "r") as f:
+        tuned = json.load(f)
+    return tuned.get(socket.gethostname(), {}).get("num_threads", None)
+
+
+def resolve_num_threads(num_threads: int = None) -> int:
+    """
+    Pick the intra-op thread count: the explicit value, else the INPAINT_NUM_THREADS environment variable, else the
+    tuned value for this host, else every core.
+    """
+    if num_threads is not None:
+        return num_threads
+    if os.getenv("INPAINT_NUM_THREADS"):
+        return int(os.environ["INPAINT_NUM_THREADS"])
+    tuned = load_tuned_threads()
+    if tuned is not None:
+        return tuned
+    return os.cpu_count() or 1
+
+
+def apply_thread_budget(num_threads: int = None, num_interop_threads: int = None) -> int:
+    """
+    Apply the thread budget to PyTorch. The inter-op pool can only be sized once per process, before any inter-op
+    work has run, so later requests to change it are logged and ignored.
+
+    Parameters:
+    num_threads (int): The intra-op thread count. Resolved with resolve_num_threads when None.
+    num_interop_threads (int): The inter-op thread count. Left to PyTorch when None.
+
+    Returns:
+    int: The intra-op thread count that was applied.
+    """
+    num_threads = resolve_num_threads(num_threads)
+    if torch.get_num_threads() != num_threads:
+        torch.set_num_threads(num_threads)
+        log.info(f"Using {num_threads} intra-op thread(s)")
+    if num_interop_threads is not None and torch.get_num_interop_threads() != num_interop_threads:
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError as e:
+            log.warning(f"Could not set {num_interop_threads} inter-op thread(s): {str(e)}")
+    return num_threads
+
+
+def autotune(
+    inpainter,
+    image,
+    mask,
+    candidates: list[int] = None,
+    repeats: int = 3,
+    budget_file: str = directories.thread_budget_file,
+) -> dict:
+    """
+    Sweep intra-op thread counts on a sample image and save the fastest one for this host.
+
+    Parameters:
+    inpainter (LamaInpainter): The inpainter used for the sweep. Its model is loaded before timing starts.
+    image (numpy.ndarray): The BGR sample image.
+    mask (numpy.ndarray): The sample mask.
+    candidates (list[int]): The thread counts to try. Defaults to powers of two up to the core count, and the core count.
+    repeats (int): The number of timed runs per thread count, the median is used.
+    budget_file (str): The JSON file the result is saved to, keyed by host name.
+
+    Returns:
+    dict: The fastest thread count and the median seconds of every candidate.
+    """
+    cpu_count = os.cpu_count() or 1
+    if candidates is None:
+        candidates = sorted({2 ** i for i in range(cpu_count.bit_length()) if 2 ** i <= cpu_count} | {cpu_count})
+    inpainter.warm_up()
+    inpainter.predict_arrays([image], [mask])
+    timings = {}
+    for num_threads in candidates:
+        torch.set_num_threads(num_threads)
+        runs = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            inpainter.predict_arrays([image], [mask])
+            runs.append(time.perf_counter() - start)
+        timings[num_threads] = sorted(runs)[len(runs) // 2]
+        log.info(f"{num_threads} thread(s): {timings[num_threads]:.3f}s")
+    best = min(timings, key=timings.get)
+    tuned = {}
+    if os.path.exists(budget_file):
+        with open(budget_file, "r") as f:
+            tuned = json.load(f)
+    tuned[socket.gethostname()] = {"num_threads": best, "timings": timings}
+    with open(budget_file, "w") as f:
+        json.dump(tuned, f, indent=2)
+    torch.set_num_threads(best)
+    log.info(f"Fastest with {best} thread(s), saved to {budget_file}")
+    return tuned[socket.gethostname()]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    from benchmark.samples import make_synthetic_mask
+    from inpaint_lama import LamaInpainter
+
+    parser = argparse.ArgumentParser(description="Find the fastest inpainting thread count for this host")
+    parser.add_argument("--model-path", default=directories.big_lama_model_dir)
+    parser.add_argument("--image", default=os.path.join(directories.sample_images_dir, "2.png"))
+    parser.add_argument("--mask", default=None, help="Mask for the image, a synthetic one is used when not given")
+    parser.add_argument("--threads", type=int, nargs="+", default=None)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    sample_image = cv2.imread(args.image)
+    sample_mask = (
+        cv2.imread(args.mask, cv2.IMREAD_GRAYSCALE) if args.mask else make_synthetic_mask(sample_image)
+    )
+    autotune(LamaInpainter(args.model_path), sample_image, sample_mask, args.threads, args.repeats)
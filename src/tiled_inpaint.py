@@ -0,0 +1,131 @@
+import logging
+from typing import Callable
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+def get_tile_starts(length: int, tile_size: int, overlap: int) -> list[int]:
+    """
+    Get the start offsets of tiles covering an axis of the given length, with at least `overlap` pixels shared
+    between neighbouring tiles. The last tile is aligned to the end of the axis.
+    """
+    if length <= tile_size:
+        return [0]
+    stride = tile_size - overlap
+    starts = list(range(0, length - tile_size, stride))
+    starts.append(length - tile_size)
+    return starts
+
+
+def make_tiles(height: int, width: int, tile_size: int, overlap: int) -> list[tuple]:
+    """
+    Split an image into overlapping tiles in raster order.
+
+    Parameters:
+    height (int): The image height.
+    width (int): The image width.
+    tile_size (int): The tile side length. Tiles are clipped to the image.
+    overlap (int): The number of pixels shared between neighbouring tiles.
+
+    Returns:
+    list[tuple]: The (x1, y1, x2, y2) tiles with exclusive end coordinates.
+    """
+    return [
+        (x, y, min(x + tile_size, width), min(y + tile_size, height))
+        for y in get_tile_starts(height, tile_size, overlap)
+        for x in get_tile_starts(width, tile_size, overlap)
+    ]
+
+
+def feather_weights(tile: tuple, overlap: int) -> np.ndarray:
+    """
+    Get the blending weight of a tile's pixels. The weight ramps up from the left and top edges over `overlap` pixels
+    where the tile overlaps tiles that were blended before it, and is 1 elsewhere.
+
+    Parameters:
+    tile (tuple): The (x1, y1, x2, y2) tile.
+    overlap (int): The width of the ramp.
+
+    Returns:
+    numpy.ndarray: The HxW float32 weights of the tile.
+    """
+    (x1, y1, x2, y2) = tile
+    ramp = np.arange(1, overlap + 1, dtype=np.float32) / (overlap + 1)
+    weight_x = np.ones(x2 - x1, dtype=np.float32)
+    weight_y = np.ones(y2 - y1, dtype=np.float32)
+    if x1 > 0:
+        ramp_x = ramp[: len(weight_x)]
+        weight_x[: len(ramp_x)] = ramp_x
+    if y1 > 0:
+        ramp_y = ramp[: len(weight_y)]
+        weight_y[: len(ramp_y)] = ramp_y
+    return weight_y[:, None] * weight_x[None, :]
+
+
+def get_memory_bounded_tile_size(tile_size: int, max_memory_mb: float, bytes_per_pixel: int, modulo: int = 8) -> int:
+    """
+    Shrink the tile size so that inpainting a single tile stays within the memory budget.
+
+    Parameters:
+    tile_size (int): The requested tile size.
+    max_memory_mb (float): The memory budget. None keeps the requested size.
+    bytes_per_pixel (int): The estimated activation memory per pixel.
+    modulo (int): The tile size is rounded down to a multiple of this value.
+
+    Returns:
+    int: The tile size.
+    """
+    if max_memory_mb is None:
+        return tile_size
+    budget_side = int((max_memory_mb * 2 ** 20 / bytes_per_pixel) ** 0.5)
+    return max(modulo, min(tile_size, budget_side // modulo * modulo))
+
+
+def inpaint_tiled(
+    predict_arrays: Callable[[list, list], list],
+    image: np.ndarray,
+    mask: np.ndarray,
+    tile_size: int,
+    overlap: int,
+    tiles_per_call: int = 1,
+) -> np.ndarray:
+    """
+    Inpaint an image tile by tile. Tiles without mask pixels are skipped, the others are inpainted `tiles_per_call` at
+    a time in raster order and their masked pixels are feathered into the result over the overlap, so only a bounded
+    number of tiles is ever held by the model.
+
+    Parameters:
+    predict_arrays (Callable): Inpaints a list of BGR images with their masks and returns the BGR results.
+    image (numpy.ndarray): The HxWx3 uint8 BGR image.
+    mask (numpy.ndarray): The HxW uint8 mask.
+    tile_size (int): The tile side length.
+    overlap (int): The number of pixels shared between neighbouring tiles.
+    tiles_per_call (int): The number of tiles passed to `predict_arrays` at once.
+
+    Returns:
+    numpy.ndarray: The inpainted image.
+    """
+    tiles = [
+        (x1, y1, x2, y2)
+        for (x1, y1, x2, y2) in make_tiles(image.shape[0], image.shape[1], tile_size, overlap)
+        if mask[y1:y2, x1:x2].any()
+    ]
+    log.info(f"Inpainting {len(tiles)} tile(s) of {tile_size}px with {overlap}px overlap")
+    result = image.copy()
+    for start in range(0, len(tiles), tiles_per_call):
+        chunk = tiles[start:start + tiles_per_call]
+        inpainted_tiles = predict_arrays(
+            [image[y1:y2, x1:x2] for (x1, y1, x2, y2) in chunk],
+            [mask[y1:y2, x1:x2] for (x1, y1, x2, y2) in chunk],
+        )
+        for tile, inpainted in zip(chunk, inpainted_tiles):
+            (x1, y1, x2, y2) = tile
+            masked = mask[y1:y2, x1:x2] > 0
+            weight = feather_weights(tile, overlap)[masked][:, None]
+            region = result[y1:y2, x1:x2]
+            region[masked] = np.round(
+                region[masked] * (1 - weight) + inpainted[masked] * weight
+            ).astype(np.uint8)
+    return result